@@ -0,0 +1,61 @@
+"""Benchmark the related-verses build and lookup.
+
+Uses a compiled Bible (--bible data/bible.bin) when given, otherwise the
+synthetic corpus of bench_search.py cut into 25-verse chapters.
+
+    python benchmarks/bench_related.py [--bible data/bible.bin] [--k 20] [--repeat 20000]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import related  # noqa: E402
+from bench_search import percentile, synthetic_corpus  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bible", help="compiled verse table or JSON translation")
+    parser.add_argument("--k", type=int, default=related.DEFAULT_K)
+    parser.add_argument("--repeat", type=int, default=20000)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.bible:
+        import scripture
+        index = related.build_for_bible(scripture.load(args.bible), k=args.k)
+    else:
+        texts = synthetic_corpus()
+        index = related.RelatedIndex.build(texts, k=args.k, groups=np.arange(len(texts)) // 25)
+    build_seconds = time.perf_counter() - started
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "related.bin")
+        index.save(path)
+        size = os.path.getsize(path)
+        index = related.RelatedIndex.open(path)
+
+        filled = np.count_nonzero(index.neighbours != related.NO_NEIGHBOUR) / index.neighbours.size
+        print(f"verses={index.verse_count} k={index.k} index_bytes={size} "
+              f"build_s={build_seconds:.2f} filled={filled:.1%}")
+        rng = random.Random(7)
+        samples = []
+        for _ in range(args.repeat):
+            ordinal = rng.randrange(index.verse_count)
+            started = time.perf_counter()
+            index.related(ordinal, 10)
+            samples.append((time.perf_counter() - started) * 1e6)
+        print(f"lookup limit=10 p50={statistics.median(samples):.1f}us p95={percentile(samples, 95):.1f}us")
+        del index
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Benchmark verse search latency.
+
+Uses a compiled Bible (--bible data/bible.bin) when given, otherwise a
+synthetic 31,102-verse corpus with a Zipf-distributed vocabulary so the
+numbers are reproducible without shipping a translation.
+
+    python benchmarks/bench_search.py [--bible data/bible.bin] [--repeat 200]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import search  # noqa: E402
+
+VERSE_COUNT = 31102
+
+COMMON_WORDS = ["the", "and", "of", "to", "that", "in", "he", "shall", "unto", "for",
+                "i", "his", "a", "lord", "they", "be", "is", "him", "not", "them",
+                "god", "love", "light", "faith", "grace", "peace", "spirit", "word",
+                "heaven", "earth", "king", "israel", "people", "son", "father", "day"]
+
+
+def synthetic_corpus(seed=7):
+    rng = random.Random(seed)
+    vocabulary = COMMON_WORDS + [f"word{i}" for i in range(12000)]
+    weights = [1.0 / (rank + 1) for rank in range(len(vocabulary))]
+    return [
+        " ".join(rng.choices(vocabulary, weights=weights, k=rng.randint(10, 40)))
+        for _ in range(VERSE_COUNT)
+    ]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bible", help="compiled verse table or JSON translation")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    if args.bible:
+        import scripture
+        table = scripture.load(args.bible)
+        texts = [table.verse_text(o) for o in range(table.verse_count)]
+    else:
+        texts = synthetic_corpus()
+
+    started = time.perf_counter()
+    index = search.SearchIndex.build(texts)
+    build_seconds = time.perf_counter() - started
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "search.bin")
+        index.save(path)
+        size = os.path.getsize(path)
+        index = search.SearchIndex.open(path)
+
+        print(f"verses={index.verse_count} terms={len(index.terms)} "
+              f"index_bytes={size} build_s={build_seconds:.2f}")
+        queries = ["light", "god love", "the lord", "faith grace peace",
+                   '"the lord"', '"son of god"', "heaven earth king israel people"]
+        for query in queries:
+            samples = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                total, _ = index.search(query, limit=20)
+                samples.append((time.perf_counter() - started) * 1000)
+            print(f"{query!r:40} matches={total:6d} "
+                  f"p50={statistics.median(samples):.2f}ms p95={percentile(samples, 95):.2f}ms")
+        del index
+
+
+if __name__ == "__main__":
+    main()
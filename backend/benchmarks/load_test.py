@@ -0,0 +1,424 @@
+"""Load test the API with mixed workloads.
+
+Boots ``server.app`` under uvicorn in a background thread, against MongoDB
+(``--mongo-url``) or by default mongomock-motor, with chat completions served
+by ``fake_openai.app`` and a synthetic Bible unless BIBLE_PATH points at a
+compiled one. Rate limits and chatbot quotas are switched off. Then, over
+real HTTP:
+
+* ``login_burst``  every user logs in at once, ``--login-rounds`` times
+* ``mixed``        ``--concurrency`` virtual users for ``--duration`` seconds,
+                   each picking a scenario by weight: reading a chapter with
+                   its study overlay (sometimes highlighting a verse), chat
+                   send and poll, listing friends, listing notes and asking
+                   the chatbot
+
+and reports p50/p95/p99 latency and throughput per endpoint. mongomock-motor
+cannot run the study overlay aggregation ($unionWith), so without
+``--mongo-url`` the run refuses to start unless ``--skip-overlay`` leaves the
+overlay requests out. ``--output``
+saves the run as JSON, tagged with the git commit, and ``--compare`` prints
+the change against an earlier file.
+
+    python benchmarks/load_test.py [--users 50] [--concurrency 32] [--duration 30]
+        [--mongo-url mongodb://localhost:27017 | --skip-overlay] [--output run.json] [--compare base.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+PASSWORD = "load-test-password"
+CHAPTERS_PER_BOOK = 10
+VERSES_PER_CHAPTER = 25
+
+# Scenario -> weight in the mixed phase
+SCENARIO_WEIGHTS = {
+    "read_chapter": 45,
+    "chat": 25,
+    "friends": 15,
+    "notes": 10,
+    "chatbot": 5,
+}
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def git_revision():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, text=True).strip()
+        dirty = bool(subprocess.check_output(["git", "status", "--porcelain"], cwd=BACKEND_DIR, text=True).strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def synthetic_bible(path: str, index_path: str):
+    import scripture
+    import search
+    rng = random.Random(11)
+    words = ["the", "lord", "and", "of", "light", "grace", "faith", "peace", "word", "spirit",
+             "love", "king", "people", "heaven", "earth", "shall", "unto", "son", "father", "day"]
+    table = scripture.VerseTable.build(
+        (book, chapter, verse, " ".join(rng.choices(words, k=rng.randint(12, 30))))
+        for book in range(len(scripture.BIBLE_BOOKS))
+        for chapter in range(1, CHAPTERS_PER_BOOK + 1)
+        for verse in range(1, VERSES_PER_CHAPTER + 1)
+    )
+    table.save(path)
+    search.build_for_bible(table).save(index_path)
+
+
+def start_server(app, port: int):
+    import uvicorn
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="on")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 60
+    while not server.started:
+        if not thread.is_alive() or time.monotonic() > deadline:
+            raise RuntimeError(f"Server on port {port} did not start")
+        time.sleep(0.05)
+    return server, thread
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.statuses = {}
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def record(self, label: str, seconds: float, status: int):
+        self.samples.setdefault(label, []).append(seconds * 1000)
+        statuses = self.statuses.setdefault(label, {})
+        statuses[status] = statuses.get(status, 0) + 1
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+
+    def report(self) -> dict:
+        endpoints = {}
+        for label, samples in sorted(self.samples.items()):
+            statuses = self.statuses[label]
+            endpoints[label] = {
+                "count": len(samples),
+                "errors": sum(count for status, count in statuses.items() if status >= 400),
+                "status": {str(status): count for status, count in sorted(statuses.items())},
+                "throughput_rps": round(len(samples) / self.elapsed, 2),
+                "mean_ms": round(sum(samples) / len(samples), 2),
+                "p50_ms": round(percentile(samples, 50), 2),
+                "p95_ms": round(percentile(samples, 95), 2),
+                "p99_ms": round(percentile(samples, 99), 2),
+                "max_ms": round(max(samples), 2),
+            }
+        total = sum(len(samples) for samples in self.samples.values())
+        return {
+            "elapsed_s": round(self.elapsed, 2),
+            "requests": total,
+            "throughput_rps": round(total / self.elapsed, 2) if self.elapsed else 0.0,
+            "endpoints": endpoints,
+        }
+
+
+class LoadClient:
+    def __init__(self, http, recorder: Recorder):
+        self.http = http
+        self.recorder = recorder
+
+    async def call(self, label: str, method: str, url: str, token: str = None, **kwargs):
+        headers = kwargs.pop("headers", {})
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        started = time.perf_counter()
+        try:
+            response = await self.http.request(method, url, headers=headers, **kwargs)
+            status = response.status_code
+        except Exception:
+            response, status = None, 599
+        self.recorder.record(label, time.perf_counter() - started, status)
+        return response
+
+
+class VirtualUser:
+    def __init__(self, user: dict, rng: random.Random, books, use_overlay: bool):
+        self.user = user
+        self.rng = rng
+        self.books = books
+        self.use_overlay = use_overlay
+        self.last_seen = {}
+
+    async def read_chapter(self, client: LoadClient):
+        book = self.rng.choice(self.books)
+        chapter = self.rng.randint(1, CHAPTERS_PER_BOOK)
+        token = self.user["token"]
+        await client.call("GET /api/bible/{book}/{chapter}", "GET", f"/api/bible/{book}/{chapter}")
+        if self.use_overlay:
+            await client.call("GET /api/study/overlay/{book}/{chapter}", "GET",
+                              f"/api/study/overlay/{book}/{chapter}", token)
+        if self.rng.random() < 0.2:
+            await client.call("POST /api/highlights", "POST", "/api/highlights", token, json={
+                "book": book, "chapter": chapter, "verse": self.rng.randint(1, VERSES_PER_CHAPTER),
+                "text": "highlighted", "color": self.rng.choice(["yellow", "green", "blue"]),
+            })
+
+    async def chat(self, client: LoadClient):
+        chat_id = self.rng.choice(self.user["chats"])
+        token = self.user["token"]
+        await client.call("POST /api/chats/{chat_id}/messages", "POST", f"/api/chats/{chat_id}/messages", token,
+                          json={"content": f"load test message {self.rng.random():.6f}"})
+        params = {"limit": 50}
+        if chat_id in self.last_seen:
+            params["message_id"] = self.last_seen[chat_id]
+        response = await client.call("GET /api/chats/{chat_id}/messages/since", "GET",
+                                     f"/api/chats/{chat_id}/messages/since", token, params=params)
+        if response is not None and response.status_code == 200:
+            items = response.json()["items"]
+            if items:
+                self.last_seen[chat_id] = items[-1]["id"]
+
+    async def friends(self, client: LoadClient):
+        await client.call("GET /api/friends", "GET", "/api/friends", self.user["token"])
+
+    async def notes(self, client: LoadClient):
+        await client.call("GET /api/notes", "GET", "/api/notes", self.user["token"], params={"limit": 20})
+
+    async def chatbot(self, client: LoadClient):
+        await client.call("POST /api/chatbot/ask", "POST", "/api/chatbot/ask", self.user["token"],
+                          json={"message": "What does this passage mean?"})
+
+
+async def register_users(client: LoadClient, count: int, run_id: str):
+    users = []
+    for i in range(count):
+        email = f"load{i}-{run_id}@example.com"
+        response = await client.call("POST /api/auth/register", "POST", "/api/auth/register",
+                                     json={"name": f"Load User {i}", "email": email, "password": PASSWORD})
+        response.raise_for_status()
+        users.append({"id": response.json()["id"], "email": email, "chats": []})
+    return users
+
+
+async def login_burst(client: LoadClient, users, rounds: int):
+    for _ in range(rounds):
+        responses = await asyncio.gather(*(
+            client.call("POST /api/auth/login", "POST", "/api/auth/login",
+                        json={"email": user["email"], "password": PASSWORD})
+            for user in users
+        ))
+        for user, response in zip(users, responses):
+            if response is not None and response.status_code == 200:
+                user["token"] = response.json()["access_token"]
+
+
+async def seed_social_graph(client: LoadClient, seed_db, users):
+    # Friends of the next two users around a ring, and a chat with each.
+    # There is no endpoint to accept a request, so friendships are written directly.
+    now = datetime.utcnow()
+    friends = []
+    for i, user in enumerate(users):
+        for step in (1, 2):
+            other = users[(i + step) % len(users)]
+            if other is user:
+                continue
+            for a, b in ((user, other), (other, user)):
+                friends.append({"_id": f"{a['id']}:{b['id']}", "user_id": a["id"], "friend_id": b["id"],
+                                "status": "accepted", "created_at": now})
+            response = await client.call("POST /api/chats", "POST", "/api/chats", user["token"],
+                                         json={"participant_id": other["id"]})
+            response.raise_for_status()
+            chat_id = response.json()["id"]
+            user["chats"].append(chat_id)
+            other["chats"].append(chat_id)
+    if friends:
+        await seed_db.friends.insert_many(list({doc["_id"]: doc for doc in friends}.values()))
+
+
+async def mixed_phase(client: LoadClient, virtual_users, duration: float, think: float):
+    scenarios = list(SCENARIO_WEIGHTS)
+    weights = [SCENARIO_WEIGHTS[name] for name in scenarios]
+    deadline = time.monotonic() + duration
+
+    async def run(user: VirtualUser):
+        while time.monotonic() < deadline:
+            scenario = user.rng.choices(scenarios, weights)[0]
+            await getattr(user, scenario)(client)
+            if think:
+                await asyncio.sleep(user.rng.expovariate(1 / think))
+
+    await asyncio.gather(*(run(user) for user in virtual_users))
+
+
+async def drive(args, base_url: str, seed_db, use_overlay: bool):
+    import httpx
+    import scripture
+
+    limits = httpx.Limits(max_connections=max(args.concurrency, args.users), max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as http:
+        setup = LoadClient(http, Recorder())
+        run_id = f"{os.getpid()}-{int(time.time())}"
+        users = await register_users(setup, args.users, run_id)
+
+        phases = {}
+        recorder = Recorder()
+        await login_burst(LoadClient(http, recorder), users, args.login_rounds)
+        recorder.finish()
+        phases["login_burst"] = recorder.report()
+        users = [user for user in users if user.get("token")]
+        if len(users) < 2:
+            raise RuntimeError("Fewer than two users could log in")
+
+        await seed_social_graph(setup, seed_db, users)
+
+        rng = random.Random(args.seed)
+        books = scripture.BIBLE_BOOKS
+        virtual_users = [
+            VirtualUser(users[i % len(users)], random.Random(rng.random()), books, use_overlay)
+            for i in range(args.concurrency)
+        ]
+        recorder = Recorder()
+        await mixed_phase(LoadClient(http, recorder), virtual_users, args.duration, args.think_ms / 1000)
+        recorder.finish()
+        phases["mixed"] = recorder.report()
+    return phases
+
+
+def print_report(phases: dict):
+    for phase, result in phases.items():
+        print(f"\n{phase}: {result['requests']} requests in {result['elapsed_s']}s "
+              f"({result['throughput_rps']} req/s)")
+        print(f"{'endpoint':48} {'count':>7} {'err':>5} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+        for label, stats in result["endpoints"].items():
+            print(f"{label:48} {stats['count']:7d} {stats['errors']:5d} {stats['throughput_rps']:8.1f} "
+                  f"{stats['p50_ms']:8.1f} {stats['p95_ms']:8.1f} {stats['p99_ms']:8.1f}")
+
+
+def print_comparison(baseline: dict, current: dict, threshold: float = 0.10):
+    print(f"\nagainst {baseline['meta'].get('commit') or 'baseline'} (ms, change; ! marks > {threshold:.0%} slower)")
+    for phase, result in current["phases"].items():
+        before = baseline["phases"].get(phase, {}).get("endpoints", {})
+        for label, stats in result["endpoints"].items():
+            if label not in before:
+                continue
+            cells = []
+            for key in ("p50_ms", "p95_ms", "p99_ms"):
+                old, new = before[label][key], stats[key]
+                change = (new - old) / old if old else 0.0
+                cells.append(f"{key[:3]} {old:.1f}->{new:.1f} {change:+.0%}{'!' if change > threshold else ' '}")
+            print(f"{phase:12} {label:48} " + "  ".join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=32, help="virtual users in the mixed phase")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of mixed load")
+    parser.add_argument("--login-rounds", type=int, default=3)
+    parser.add_argument("--think-ms", type=float, default=0, help="mean pause between scenarios")
+    parser.add_argument("--openai-delay", type=float, default=0.005, help="fake model latency per token")
+    parser.add_argument("--mongo-url", help="MongoDB to use instead of mongomock-motor")
+    parser.add_argument("--skip-overlay", action="store_true",
+                        help="leave study overlay requests out of the chapter scenario (needed with mongomock-motor)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--compare", help="print changes against an earlier JSON file")
+    args = parser.parse_args()
+    if not args.mongo_url and not args.skip_overlay:
+        parser.error("the study overlay needs MongoDB ($unionWith is not in mongomock-motor): "
+                     "pass --mongo-url, or --skip-overlay to run without overlay requests")
+
+    tmp = tempfile.TemporaryDirectory()
+    db_name = f"load_test_{os.getpid()}"
+    os.environ.update({
+        "DB_NAME": db_name,
+        "RATE_LIMIT_CHATBOT": "0",
+        "RATE_LIMIT_CHAT": "0",
+        "RATE_LIMIT_WRITE": "0",
+        "CHATBOT_DAILY_TOKENS": "0",
+        "FAKE_OPENAI_DELAY": str(args.openai_delay),
+    })
+    if args.mongo_url:
+        os.environ["MONGO_URL"] = args.mongo_url
+    if not os.path.exists(os.environ.get("BIBLE_PATH", "")):
+        os.environ["BIBLE_PATH"] = os.path.join(tmp.name, "bible.bin")
+        os.environ["SEARCH_INDEX_PATH"] = os.path.join(tmp.name, "search.bin")
+        synthetic_bible(os.environ["BIBLE_PATH"], os.environ["SEARCH_INDEX_PATH"])
+    openai_port, api_port = free_port(), free_port()
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{openai_port}/v1"
+
+    import fake_openai
+    import server
+
+    if args.mongo_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        seed_client = AsyncIOMotorClient(args.mongo_url)
+        backend = "mongodb"
+    else:
+        from mongomock_motor import AsyncMongoMockClient
+        seed_client = AsyncMongoMockClient()
+        server.client = seed_client
+        backend = "mongomock"
+    use_overlay = not args.skip_overlay
+    if not use_overlay:
+        print("skipping study overlay requests")
+
+    fake_server, _ = start_server(fake_openai.app, openai_port)
+    api_server, api_thread = start_server(server.app, api_port)
+    try:
+        phases = asyncio.run(drive(args, f"http://127.0.0.1:{api_port}", seed_client[db_name], use_overlay))
+    finally:
+        api_server.should_exit = True
+        fake_server.should_exit = True
+        api_thread.join(timeout=10)
+        if args.mongo_url:
+            asyncio.run(AsyncIOMotorClient(args.mongo_url).drop_database(db_name))
+        tmp.cleanup()
+
+    commit, dirty = git_revision()
+    results = {
+        "meta": {
+            "commit": commit,
+            "dirty": dirty,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "backend": backend,
+            "args": vars(args),
+        },
+        "phases": phases,
+    }
+    print_report(phases)
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(json.load(f), results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nwrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
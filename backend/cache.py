@@ -0,0 +1,207 @@
+import asyncio
+import functools
+import hashlib
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Hashable, Optional
+
+import references
+
+
+def prompt_hash(*parts: Optional[str]) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update((part or "").encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()[:16]
+
+
+def verse_cache_key(book: str, chapter: int, verse: int, prompt_digest: str, model: str) -> Optional[tuple]:
+    """Keyed on the packed verse id, so "Jn", "john" and "JOHN" share entries;
+    None for a book that cannot be resolved."""
+    index = references.book_index(book)
+    if index is None:
+        return None
+    return (references.verse_id(index, int(chapter), int(verse)), prompt_digest, model)
+
+
+class LRUCache:
+    """Bounded in-process LRU with per-entry TTL."""
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600):
+        self.max_entries = max_entries
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.evictions = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= datetime.utcnow():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl_seconds: Optional[float] = None):
+        ttl = self.ttl if ttl_seconds is None else timedelta(seconds=ttl_seconds)
+        self._entries[key] = (value, datetime.utcnow() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ResponseCache:
+    """Two-tier cache: in-process LRU in front of an optional Mongo collection.
+
+    The Mongo tier relies on a TTL index on ``expires_at`` (see
+    ``ensure_indexes``) so stale answers are purged by the server. Concurrent
+    misses for the same key share a single loader call, which runs as its own
+    task: a caller that is cancelled stops waiting without cancelling it for
+    the others.
+    """
+
+    def __init__(self, collection=None, max_entries: int = 1024, ttl_seconds: float = 86400):
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        self.local = LRUCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self._pending = {}
+        self.hits = 0
+        self.remote_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def _doc_id(key: tuple) -> str:
+        return "|".join(str(part) for part in key)
+
+    async def ensure_indexes(self):
+        if self.collection is not None:
+            await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def get(self, key: tuple):
+        value = self.local.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        if self.collection is not None:
+            doc = await self.collection.find_one(
+                {"_id": self._doc_id(key), "expires_at": {"$gt": datetime.utcnow()}}
+            )
+            if doc is not None:
+                self.remote_hits += 1
+                self.local.set(key, doc["value"])
+                return doc["value"]
+        return None
+
+    async def set(self, key: tuple, value):
+        self.local.set(key, value)
+        if self.collection is not None:
+            await self.collection.update_one(
+                {"_id": self._doc_id(key)},
+                {"$set": {
+                    "value": value,
+                    "expires_at": datetime.utcnow() + timedelta(seconds=self.ttl_seconds),
+                }},
+                upsert=True,
+            )
+
+    async def get_or_load(self, key: tuple, loader: Callable[[], Awaitable]):
+        value = await self.get(key)
+        if value is not None:
+            return value
+
+        task = self._pending.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(self._load(key, loader))
+            self._pending[key] = task
+            task.add_done_callback(functools.partial(self._loaded, key))
+        return await asyncio.shield(task)
+
+    async def _load(self, key: tuple, loader: Callable[[], Awaitable]):
+        value = await loader()
+        await self.set(key, value)
+        return value
+
+    def _loaded(self, key: tuple, task: asyncio.Task):
+        if self._pending.get(key) is task:
+            del self._pending[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved when every caller had left
+            task.exception()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "remote_hits": self.remote_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.local.evictions,
+            "entries": len(self.local),
+        }
+
+
+_MISSING_PRINCIPAL = object()
+
+
+class PrincipalCache:
+    """Short-lived cache of authenticated users keyed by user id.
+
+    Unknown ids are cached too (for ``negative_ttl_seconds``) so a stream of
+    requests with a token for a deleted user does not reach Mongo each time.
+    Call ``invalidate`` whenever a user document changes.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 60, negative_ttl_seconds: float = 10):
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.local = LRUCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+    async def get(self, user_id: str, loader: Callable[[str], Awaitable[Optional[dict]]]) -> Optional[dict]:
+        principal = self.local.get(user_id)
+        if principal is _MISSING_PRINCIPAL:
+            self.negative_hits += 1
+            return None
+        if principal is not None:
+            self.hits += 1
+            return principal
+
+        self.misses += 1
+        principal = await loader(user_id)
+        if principal is None:
+            self.local.set(user_id, _MISSING_PRINCIPAL, ttl_seconds=self.negative_ttl_seconds)
+        else:
+            self.local.set(user_id, principal)
+        return principal
+
+    def invalidate(self, user_id: str):
+        self.local.delete(user_id)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.hits + self.negative_hits) / lookups, 4) if lookups else 0.0,
+            "evictions": self.local.evictions,
+            "entries": len(self.local),
+        }
@@ -0,0 +1,92 @@
+import os
+import json
+from typing import TYPE_CHECKING, AsyncIterator, List, Optional
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+SYSTEM_PROMPT = """You are a helpful Bible study assistant. You help people understand Biblical passages,
+        answer questions about Christian faith, and provide biblical guidance. Always be respectful and grounded in
+        Biblical truth. If you don't know something, say so rather than making up information."""
+
+CHATBOT_MODEL = os.environ.get('CHATBOT_MODEL', 'gpt-3.5-turbo')
+CHATBOT_MAX_TOKENS = 500
+CHATBOT_TEMPERATURE = 0.7
+CHATBOT_TIMEOUT = float(os.environ.get('CHATBOT_TIMEOUT', 30))
+CHATBOT_MAX_CONNECTIONS = int(os.environ.get('CHATBOT_MAX_CONNECTIONS', 20))
+
+
+def create_openai_client() -> "AsyncOpenAI":
+    # One pooled HTTP client per process; OPENAI_BASE_URL can point at a
+    # local fake completion server (see fake_openai.py) for testing. The SDK
+    # is imported here, at worker startup, as it is the slowest import by far.
+    import httpx
+    from openai import AsyncOpenAI
+
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=CHATBOT_MAX_CONNECTIONS,
+            max_keepalive_connections=CHATBOT_MAX_CONNECTIONS,
+        ),
+        timeout=httpx.Timeout(CHATBOT_TIMEOUT, connect=5.0),
+    )
+    return AsyncOpenAI(
+        api_key=os.environ.get('OPENAI_API_KEY', 'not-configured'),
+        base_url=os.environ.get('OPENAI_BASE_URL') or None,
+        http_client=http_client,
+        max_retries=1,
+    )
+
+
+def build_messages(message: str, context: Optional[str] = None) -> List[dict]:
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT}
+    ]
+
+    if context:
+        messages.append({"role": "user", "content": f"Context: {context}"})
+
+    messages.append({"role": "user", "content": message})
+    return messages
+
+
+async def complete(client: "AsyncOpenAI", message: str, context: Optional[str] = None,
+                   timeout: float = CHATBOT_TIMEOUT) -> str:
+    response = await client.chat.completions.create(
+        model=CHATBOT_MODEL,
+        messages=build_messages(message, context),
+        max_tokens=CHATBOT_MAX_TOKENS,
+        temperature=CHATBOT_TEMPERATURE,
+        timeout=timeout,
+    )
+    return response.choices[0].message.content
+
+
+async def stream(client: "AsyncOpenAI", message: str, context: Optional[str] = None,
+                 timeout: float = CHATBOT_TIMEOUT) -> AsyncIterator[str]:
+    response = await client.chat.completions.create(
+        model=CHATBOT_MODEL,
+        messages=build_messages(message, context),
+        max_tokens=CHATBOT_MAX_TOKENS,
+        temperature=CHATBOT_TEMPERATURE,
+        timeout=timeout,
+        stream=True,
+    )
+    try:
+        async for chunk in response:
+            if not chunk.choices:
+                continue
+            token = chunk.choices[0].delta.content
+            if token:
+                yield token
+    finally:
+        # Closing the response releases the pooled connection immediately
+        # when the consumer stops early (e.g. the client disconnected).
+        await response.close()
+
+
+def sse_event(data: dict, event: Optional[str] = None) -> str:
+    payload = f"data: {json.dumps(data)}\n\n"
+    if event:
+        payload = f"event: {event}\n" + payload
+    return payload
@@ -0,0 +1,367 @@
+"""Chat messages stored in buckets of consecutive messages.
+
+Messages are numbered per chat (``n`` = 1, 2, ...) by incrementing
+``message_count`` on the chat document, and message ``n`` lives in bucket
+``(n - 1) // BUCKET_SIZE`` of that chat in ``chat_buckets``::
+
+    {"_id": "<chat_id>:<seq>", "chat_id", "seq", "count", "first_at", "last_at",
+     "messages": [{"_id", "n", "sender_id", "content", "created_at"}, ...],
+     "last": {...}}   # the latest message pushed, for the change stream
+
+Sending is two single-document updates (the counter, then a ``$push`` into
+the bucket) and a page of recent history is one or two bucket reads instead
+of one index entry and document per message. ``last_message`` on the chat
+document serves the chat list without touching the buckets at all.
+
+``ChatArchiver`` moves full buckets whose newest message is older than a
+configurable age to ``chat_archive``, with the messages zlib-compressed
+BSON. Reads fall back to the archive for sequence numbers that are missing
+from ``chat_buckets``, so the move is invisible to clients.
+
+Chats created before buckets existed have no ``message_count``; their
+messages are copied from the old per-message ``chat_messages`` collection on
+first use and by ``migrate_legacy_messages``, once, at startup. The copy is
+idempotent and ``chat_messages`` is left in place.
+"""
+import asyncio
+import logging
+import uuid
+import zlib
+from datetime import datetime, timedelta
+from typing import AsyncIterator, List, Optional
+
+import bson
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+# Fixed once there is data: a message's bucket is derived from its number
+BUCKET_SIZE = 50
+MIGRATION_ID = "chat_buckets"
+
+
+def bucket_seq(n: int) -> int:
+    return (n - 1) // BUCKET_SIZE
+
+
+def bucket_id(chat_id: str, seq: int) -> str:
+    return f"{chat_id}:{seq}"
+
+
+def pack(bucket: dict) -> dict:
+    """An archive document for a bucket; ``ids`` keeps messages findable."""
+    messages = bucket["messages"]
+    return {
+        "_id": bucket["_id"],
+        "chat_id": bucket["chat_id"],
+        "seq": bucket["seq"],
+        "count": bucket["count"],
+        "first_at": bucket["first_at"],
+        "last_at": bucket["last_at"],
+        "ids": [message["_id"] for message in messages],
+        "data": zlib.compress(bson.encode({"messages": messages})),
+    }
+
+
+def unpack(archived: dict) -> dict:
+    messages = bson.decode(zlib.decompress(archived["data"]))["messages"]
+    bucket = {key: archived[key] for key in ("_id", "chat_id", "seq", "count", "first_at", "last_at")}
+    bucket["messages"] = messages
+    return bucket
+
+
+def _with_chat(message: dict, chat_id: str) -> dict:
+    return {**message, "chat_id": chat_id}
+
+
+class ChatStore:
+    def __init__(self, chats, buckets, archive, legacy=None):
+        self.chats = chats
+        self.buckets = buckets
+        self.archive = archive
+        self.legacy = legacy
+
+    async def open_chat(self, chat_id: str, user_id: str) -> Optional[dict]:
+        """The chat's ``message_count`` if ``user_id`` takes part in it."""
+        query = {"_id": chat_id, "participants": user_id}
+        chat = await self.chats.find_one(query, {"message_count": 1})
+        if chat is not None and "message_count" not in chat:
+            await self.migrate_chat(chat_id)
+            chat = await self.chats.find_one(query, {"message_count": 1})
+        return chat
+
+    async def append(self, chat_id: str, sender_id: str, content: str) -> Optional[dict]:
+        """Add a message from ``sender_id``; None if they are not in the chat."""
+        now = datetime.utcnow()
+        message = {
+            "_id": str(uuid.uuid4()),
+            "sender_id": sender_id,
+            "content": content,
+            # BSON dates have millisecond precision; keep what is returned
+            # identical to what is read back later
+            "created_at": now.replace(microsecond=now.microsecond // 1000 * 1000),
+        }
+        for _ in range(2):
+            chat = await self.chats.find_one_and_update(
+                {"_id": chat_id, "participants": sender_id, "message_count": {"$exists": True}},
+                {"$inc": {"message_count": 1}, "$set": {"last_message": message}},
+                projection={"message_count": 1},
+                return_document=ReturnDocument.AFTER,
+            )
+            if chat is not None:
+                break
+            if await self.open_chat(chat_id, sender_id) is None:
+                return None
+        else:
+            return None
+        message["n"] = chat["message_count"]
+        seq = bucket_seq(message["n"])
+        update = {
+            "$push": {"messages": {"$each": [message], "$sort": {"n": 1}}},
+            "$inc": {"count": 1},
+            "$min": {"first_at": message["created_at"]},
+            "$max": {"last_at": message["created_at"]},
+            "$set": {"last": _with_chat(message, chat_id)},
+            "$setOnInsert": {"chat_id": chat_id, "seq": seq},
+        }
+        for attempt in range(2):
+            try:
+                await self.buckets.update_one({"_id": bucket_id(chat_id, seq)}, update, upsert=True)
+                break
+            except DuplicateKeyError:
+                # Two first messages of a bucket raced to insert it
+                if attempt:
+                    raise
+        return _with_chat(message, chat_id)
+
+    async def find(self, chat_id: str, message_id: str) -> Optional[dict]:
+        bucket = await self.buckets.find_one(
+            {"chat_id": chat_id, "messages._id": message_id},
+            {"messages": {"$elemMatch": {"_id": message_id}}},
+        )
+        if bucket is not None:
+            return _with_chat(bucket["messages"][0], chat_id)
+        archived = await self.archive.find_one({"chat_id": chat_id, "ids": message_id})
+        if archived is not None:
+            for message in unpack(archived)["messages"]:
+                if message["_id"] == message_id:
+                    return _with_chat(message, chat_id)
+        return None
+
+    async def position_before(self, chat: dict, when: datetime) -> int:
+        """Number of the last message created before ``when``."""
+        query = {"chat_id": chat["_id"], "last_at": {"$gte": when}}
+        bucket = await self.buckets.find_one(query, sort=[("last_at", 1)])
+        if bucket is None or (bucket["seq"] > 0 and bucket["first_at"] >= when):
+            # The boundary may fall in an older, archived bucket
+            archived = await self.archive.find_one(query, sort=[("last_at", 1)])
+            if archived is not None and (bucket is None or archived["seq"] < bucket["seq"]):
+                bucket = unpack(archived)
+        if bucket is None:
+            return chat.get("message_count", 0)
+        for message in bucket["messages"]:
+            if message["created_at"] >= when:
+                return message["n"] - 1
+        return bucket["messages"][-1]["n"]
+
+    async def _archived(self, chat_id: str, first: int, last: int, direction: int) -> AsyncIterator[dict]:
+        cursor = self.archive.find({"chat_id": chat_id, "seq": {"$gte": first, "$lte": last}}).sort("seq", direction)
+        async for archived in cursor:
+            yield unpack(archived)
+
+    async def _buckets(self, chat_id: str, first: int, last: int, direction: int = 1) -> AsyncIterator[dict]:
+        """Buckets ``first..last`` in ``direction`` order, live or archived."""
+        # Fetched two at a time: readers usually stop after one or two
+        cursor = (
+            self.buckets.find({"chat_id": chat_id, "seq": {"$gte": first, "$lte": last}}, {"last": 0})
+            .sort("seq", direction)
+            .batch_size(2)
+        )
+        expected = first if direction == 1 else last
+        async for bucket in cursor:
+            if bucket["seq"] != expected:
+                gap = sorted((expected, bucket["seq"] - direction))
+                async for archived in self._archived(chat_id, *gap, direction):
+                    yield archived
+            yield bucket
+            expected = bucket["seq"] + direction
+        if first <= expected <= last:
+            gap = (expected, last) if direction == 1 else (first, expected)
+            async for archived in self._archived(chat_id, *gap, direction):
+                yield archived
+
+    async def messages_after(self, chat: dict, after: int = 0) -> AsyncIterator[dict]:
+        """Messages numbered above ``after``, oldest first."""
+        count = chat.get("message_count", 0)
+        if after >= count:
+            return
+        async for bucket in self._buckets(chat["_id"], bucket_seq(after + 1), bucket_seq(count)):
+            for message in bucket["messages"]:
+                if after < message["n"] <= count:
+                    yield _with_chat(message, chat["_id"])
+
+    async def latest(self, chat: dict, limit: int) -> List[dict]:
+        """The last ``limit`` messages, oldest first."""
+        count = chat.get("message_count", 0)
+        found = []
+        if count:
+            async for bucket in self._buckets(chat["_id"], 0, bucket_seq(count), direction=-1):
+                for message in reversed(bucket["messages"]):
+                    if message["n"] <= count:
+                        found.append(_with_chat(message, chat["_id"]))
+                if len(found) >= limit:
+                    break
+        found = found[:limit]
+        found.reverse()
+        return found
+
+    async def migrate_chat(self, chat_id: str) -> int:
+        """Copy a chat's ``chat_messages`` into buckets and start its counter."""
+        count = 0
+        last = None
+        bucket = None
+        writes = []
+        if self.legacy is not None:
+            cursor = self.legacy.find({"chat_id": chat_id}).sort([("created_at", 1), ("_id", 1)])
+            async for doc in cursor:
+                count += 1
+                last = {key: doc[key] for key in ("_id", "sender_id", "content", "created_at")}
+                seq = bucket_seq(count)
+                if bucket is None or bucket["seq"] != seq:
+                    if bucket is not None:
+                        writes.append(self._migrated(bucket))
+                    bucket = {"chat_id": chat_id, "seq": seq, "messages": []}
+                bucket["messages"].append({**last, "n": count})
+        if bucket is not None:
+            writes.append(self._migrated(bucket))
+        if writes:
+            await self.buckets.bulk_write(writes, ordered=False)
+        update = {"message_count": count}
+        if last is not None:
+            update["last_message"] = last
+        # A concurrent migration may have finished first; new messages may
+        # already be counted on top of it
+        await self.chats.update_one({"_id": chat_id, "message_count": {"$exists": False}}, {"$set": update})
+        return count
+
+    @staticmethod
+    def _migrated(bucket: dict) -> UpdateOne:
+        messages = bucket["messages"]
+        # $setOnInsert: a bucket already written by an earlier copy is
+        # identical, and may since have received new messages
+        return UpdateOne(
+            {"_id": bucket_id(bucket["chat_id"], bucket["seq"])},
+            {"$setOnInsert": {
+                **bucket,
+                "count": len(messages),
+                "first_at": messages[0]["created_at"],
+                "last_at": messages[-1]["created_at"],
+            }},
+            upsert=True,
+        )
+
+    async def archive_bucket(self, bucket: dict) -> bool:
+        # Written before the delete, and replace_one makes a retry harmless,
+        # so a crash in between leaves the bucket readable from both
+        await self.archive.replace_one({"_id": bucket["_id"]}, pack(bucket), upsert=True)
+        # Only if no message arrived since it was read
+        result = await self.buckets.delete_one({"_id": bucket["_id"], "count": bucket["count"]})
+        return result.deleted_count > 0
+
+
+async def migrate_legacy_messages(store: ChatStore, migrations, lease=None) -> int:
+    """Bucket every chat that predates ``message_count``; runs once per
+    database, on whichever worker gets ``lease`` first."""
+    if await migrations.find_one({"_id": MIGRATION_ID}):
+        return 0
+    if lease is not None and not await lease.acquire():
+        # Another worker is on it; chats it has not reached yet are
+        # migrated when first opened
+        return 0
+    try:
+        migrated = 0
+        async for chat in store.chats.find({"message_count": {"$exists": False}}, {"_id": 1}):
+            await store.migrate_chat(chat["_id"])
+            migrated += 1
+        await migrations.update_one(
+            {"_id": MIGRATION_ID}, {"$set": {"completed_at": datetime.utcnow()}}, upsert=True,
+        )
+    finally:
+        if lease is not None:
+            await lease.release()
+    return migrated
+
+
+class ChatArchiver:
+    """Moves full buckets whose newest message is older than ``max_age`` to
+    the archive, every ``interval`` seconds on the worker holding ``lease``."""
+
+    def __init__(self, store: ChatStore, max_age: timedelta, lease=None, interval: float = 3600,
+                 batch_size: int = 100):
+        self.store = store
+        self.max_age = max_age
+        self.lease = lease
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+        self.is_leader = lease is None
+        self.archived = 0
+        self.runs = 0
+        self.last_run: Optional[datetime] = None
+
+    async def start(self):
+        self._task = asyncio.ensure_future(self._run_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self.lease is not None and self.is_leader:
+            await self.lease.release()
+
+    async def _run_forever(self):
+        while True:
+            try:
+                if self.lease is not None:
+                    self.is_leader = await self.lease.acquire()
+                if self.is_leader:
+                    archived = await self.run_once()
+                    if archived:
+                        logger.info("Archived %d chat buckets", archived)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Chat archiver failed")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> int:
+        cutoff = datetime.utcnow() - self.max_age
+        archived = 0
+        while True:
+            cursor = self.store.buckets.find(
+                {"last_at": {"$lt": cutoff}, "count": BUCKET_SIZE}, {"last": 0},
+            ).limit(self.batch_size)
+            buckets = await cursor.to_list(self.batch_size)
+            moved = 0
+            for bucket in buckets:
+                if await self.store.archive_bucket(bucket):
+                    moved += 1
+            archived += moved
+            if len(buckets) < self.batch_size or not moved:
+                break
+        self.archived += archived
+        self.runs += 1
+        self.last_run = datetime.utcnow()
+        return archived
+
+    def stats(self) -> dict:
+        return {
+            "leader": self.is_leader,
+            "runs": self.runs,
+            "archived": self.archived,
+            "last_run": self.last_run.isoformat() if self.last_run else None,
+        }
@@ -0,0 +1,97 @@
+"""Minimal fake of the OpenAI chat completions API for local testing.
+
+Run with ``python fake_openai.py`` and start the API server with
+``OPENAI_BASE_URL=http://localhost:8002/v1``. Responses echo the last user
+message; FAKE_OPENAI_DELAY adds per-token latency to mimic a real model and
+FAKE_OPENAI_FAILURES makes that many initial requests fail with a 503, to
+exercise client retries.
+"""
+import asyncio
+import json
+import os
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI(title="Fake OpenAI")
+
+TOKEN_DELAY = float(os.environ.get('FAKE_OPENAI_DELAY', 0.02))
+FAILURES = int(os.environ.get('FAKE_OPENAI_FAILURES', 0))
+requests_seen = 0
+
+
+def fake_answer(messages):
+    question = messages[-1]["content"] if messages else ""
+    return f"This is a fake answer to: {question}"
+
+
+def tokenize(text):
+    words = text.split(" ")
+    return [word if i == 0 else " " + word for i, word in enumerate(words)]
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    global requests_seen
+    requests_seen += 1
+    if requests_seen <= FAILURES:
+        return JSONResponse(
+            {"error": {"message": "The server is overloaded", "type": "server_error"}},
+            status_code=503,
+        )
+    body = await request.json()
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+    model = body.get("model", "fake-model")
+    answer = fake_answer(body.get("messages", []))
+    tokens = tokenize(answer)
+
+    if not body.get("stream"):
+        await asyncio.sleep(TOKEN_DELAY * len(tokens))
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": answer},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": 10,
+                "completion_tokens": len(tokens),
+                "total_tokens": 10 + len(tokens),
+            },
+        }
+
+    async def events():
+        for token in tokens:
+            await asyncio.sleep(TOKEN_DELAY)
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+        final = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        }
+        yield f"data: {json.dumps(final)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+if __name__ == "__main__":
+    import uvicorn
+    port = int(os.environ.get("FAKE_OPENAI_PORT", 8002))
+    uvicorn.run(app, host="127.0.0.1", port=port)
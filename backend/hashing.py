@@ -0,0 +1,92 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from passlib.context import CryptContext
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing queue is saturated and the caller should back off."""
+
+
+class PasswordHasher:
+    """Runs bcrypt hashing/verification on a bounded thread pool.
+
+    bcrypt releases the GIL, so a small thread pool keeps the event loop free
+    while still using multiple cores. At most ``max_workers`` hashes run at
+    once and at most ``max_queue`` more may wait; anything beyond that is
+    rejected with ``HashingBusy`` so a login storm cannot pile up unbounded.
+    """
+
+    def __init__(self, pwd_context: CryptContext, max_workers: int = 4, max_queue: int = 64):
+        self.pwd_context = pwd_context
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.in_flight = 0
+        self.queued = 0
+        self.rejected = 0
+        self.completed = 0
+        self.rehashed = 0
+
+    def _ensure_started(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="pwd-hash"
+            )
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+
+    async def _run(self, fn, *args):
+        self._ensure_started()
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise HashingBusy()
+
+        self.queued += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queued -= 1
+
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, fn, *args)
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self._semaphore.release()
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.pwd_context.hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run(self.pwd_context.verify, password, hashed_password)
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        # passlib returns a replacement hash when the stored one uses an
+        # outdated scheme or cost factor (pwd_context.needs_update)
+        verified, new_hash = await self._run(
+            self.pwd_context.verify_and_update, password, hashed_password
+        )
+        if verified and new_hash:
+            self.rehashed += 1
+        return verified, new_hash
+
+    def stats(self) -> dict:
+        return {
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "rehashed": self.rehashed,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+            self._semaphore = None
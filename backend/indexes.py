@@ -0,0 +1,202 @@
+"""Declared MongoDB indexes and a reconciler that applies them.
+
+Runs automatically at API startup (disable with ENSURE_INDEXES=0) or from
+the command line::
+
+    python indexes.py            # create missing / changed indexes
+    python indexes.py --prune    # also drop indexes that are not declared
+    python indexes.py --stats    # print $indexStats usage per collection
+"""
+import argparse
+import asyncio
+import logging
+import os
+from typing import Dict, List
+
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+
+logger = logging.getLogger(__name__)
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+    ],
+    "notes": [
+        # Packed BBCCCVVV ids, so any passage is one range (see references.py)
+        IndexModel([("user_id", ASCENDING), ("verse_id", ASCENDING)], name="user_verse_id"),
+        IndexModel([("user_id", ASCENDING), ("version", ASCENDING)], name="user_version"),
+        # Only tombstones, for sync.purge_tombstones
+        IndexModel([("deleted_at", ASCENDING)], name="tombstones", partialFilterExpression={"deleted_at": {"$type": "date"}}),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], name="user_created"),
+        # Per-user full-text search; Mongo maintains it on every write
+        IndexModel(
+            [("user_id", ASCENDING), ("title", TEXT), ("content", TEXT)],
+            name="user_text",
+            weights={"title": 3, "content": 1},
+        ),
+    ],
+    "highlights": [
+        IndexModel([("user_id", ASCENDING), ("verse_id", ASCENDING)], name="user_verse_id"),
+        IndexModel([("user_id", ASCENDING), ("version", ASCENDING)], name="user_version"),
+        IndexModel([("deleted_at", ASCENDING)], name="tombstones", partialFilterExpression={"deleted_at": {"$type": "date"}}),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], name="user_created"),
+        IndexModel([("user_id", ASCENDING), ("text", TEXT)], name="user_text"),
+    ],
+    "bookmarks": [
+        IndexModel([("user_id", ASCENDING), ("verse_id", ASCENDING)], name="user_verse_id"),
+        IndexModel([("user_id", ASCENDING), ("version", ASCENDING)], name="user_version"),
+        IndexModel([("deleted_at", ASCENDING)], name="tombstones", partialFilterExpression={"deleted_at": {"$type": "date"}}),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], name="user_created"),
+    ],
+    "friends": [
+        IndexModel([("friend_id", ASCENDING), ("status", ASCENDING)], name="friend_status"),
+        IndexModel([("user_id", ASCENDING), ("status", ASCENDING)], name="user_status"),
+        IndexModel([("user_id", ASCENDING), ("friend_id", ASCENDING)], name="user_friend"),
+    ],
+    "reminders": [
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], name="user"),
+        # Hydrates reminders.ReminderScheduler in due order
+        IndexModel([("reminder_time", ASCENDING), ("completed", ASCENDING)], name="due"),
+        # Offline sync pulls changes by per-user version (see sync.py)
+        IndexModel([("user_id", ASCENDING), ("version", ASCENDING)], name="user_version"),
+        IndexModel([("deleted_at", ASCENDING)], name="tombstones", partialFilterExpression={"deleted_at": {"$type": "date"}}),
+    ],
+    "notifications": [
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], name="user_created"),
+    ],
+    "chats": [
+        IndexModel([("participants", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], name="participants"),
+    ],
+    # Pre-bucket messages, read once by the migration in chatstore.py
+    "chat_messages": [
+        IndexModel([("chat_id", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)], name="chat_created"),
+    ],
+    "chat_buckets": [
+        IndexModel([("chat_id", ASCENDING), ("seq", ASCENDING)], name="chat_seq"),
+        # Anchors by message id (resume, read markers) and by time
+        IndexModel([("chat_id", ASCENDING), ("messages._id", ASCENDING)], name="chat_message"),
+        IndexModel([("chat_id", ASCENDING), ("last_at", ASCENDING)], name="chat_last"),
+        # realtime.PollingBroker and chatstore.ChatArchiver scan by recency
+        IndexModel([("last_at", ASCENDING)], name="last"),
+    ],
+    "chat_archive": [
+        IndexModel([("chat_id", ASCENDING), ("seq", ASCENDING)], name="chat_seq"),
+        IndexModel([("chat_id", ASCENDING), ("ids", ASCENDING)], name="chat_message"),
+        IndexModel([("chat_id", ASCENDING), ("last_at", ASCENDING)], name="chat_last"),
+    ],
+}
+
+# Options that make two indexes with the same key pattern different
+_SPEC_OPTIONS = ("unique", "sparse", "expireAfterSeconds", "partialFilterExpression")
+
+
+def _spec(document: dict) -> tuple:
+    key = []
+    text_weights = {}
+    for field, direction in document["key"].items():
+        if field == "_fts":
+            # The server reports text indexes as _fts/_ftsx plus weights
+            text_weights.update(document.get("weights", {}))
+        elif direction == TEXT:
+            text_weights[field] = document.get("weights", {}).get(field, 1)
+        elif field != "_ftsx":
+            key.append((field, int(direction) if isinstance(direction, (int, float)) else direction))
+    if text_weights:
+        key.append(("$text", tuple(sorted((f, int(w)) for f, w in text_weights.items()))))
+    options = tuple((option, document.get(option)) for option in _SPEC_OPTIONS if option in document)
+    return tuple(key), options
+
+
+async def reconcile_collection(db, collection_name: str, models: List[IndexModel], prune: bool = False) -> dict:
+    collection = db[collection_name]
+    existing = {}
+    async for index in collection.list_indexes():
+        existing[index["name"]] = index
+
+    report = {"created": [], "rebuilt": [], "dropped": [], "unchanged": []}
+    to_create = []
+    for model in models:
+        declared = model.document
+        name = declared["name"]
+        current = existing.get(name)
+        if current is None:
+            to_create.append(model)
+            report["created"].append(name)
+        elif _spec(current) != _spec(declared):
+            await collection.drop_index(name)
+            to_create.append(model)
+            report["rebuilt"].append(name)
+        else:
+            report["unchanged"].append(name)
+
+    if to_create:
+        await collection.create_indexes(to_create)
+
+    if prune:
+        declared_names = {model.document["name"] for model in models}
+        for name in existing:
+            if name != "_id_" and name not in declared_names:
+                await collection.drop_index(name)
+                report["dropped"].append(name)
+
+    return report
+
+
+async def ensure_indexes(db, prune: bool = False) -> Dict[str, dict]:
+    reports = {}
+    for collection_name, models in INDEXES.items():
+        report = await reconcile_collection(db, collection_name, models, prune=prune)
+        changes = {k: v for k, v in report.items() if v and k != "unchanged"}
+        if changes:
+            logger.info("Indexes for %s: %s", collection_name, changes)
+        reports[collection_name] = report
+    return reports
+
+
+async def index_stats(db) -> Dict[str, List[dict]]:
+    stats = {}
+    for collection_name in INDEXES:
+        cursor = db[collection_name].aggregate([{"$indexStats": {}}])
+        stats[collection_name] = [
+            {
+                "name": entry["name"],
+                "ops": entry["accesses"]["ops"],
+                "since": entry["accesses"]["since"],
+            }
+            async for entry in cursor
+        ]
+    return stats
+
+
+def main():
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from dotenv import load_dotenv
+    from pathlib import Path
+
+    parser = argparse.ArgumentParser(description="Reconcile MongoDB indexes for the Bible Study API")
+    parser.add_argument("--prune", action="store_true", help="drop indexes that are not declared")
+    parser.add_argument("--stats", action="store_true", help="print $indexStats instead of reconciling")
+    args = parser.parse_args()
+
+    load_dotenv(Path(__file__).parent / '.env')
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    client = AsyncIOMotorClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
+    db = client[os.environ.get('DB_NAME', 'bible_study_db')]
+
+    async def run():
+        if args.stats:
+            for collection_name, entries in (await index_stats(db)).items():
+                for entry in entries:
+                    print(f"{collection_name}.{entry['name']}: {entry['ops']} ops since {entry['since']}")
+        else:
+            for collection_name, report in (await ensure_indexes(db, prune=args.prune)).items():
+                print(f"{collection_name}: {report}")
+
+    try:
+        asyncio.run(run())
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
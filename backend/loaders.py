@@ -0,0 +1,73 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional
+
+
+class BatchLoader:
+    """DataLoader-style coalescing of individual lookups into batch calls.
+
+    Every ``load(key)`` issued during the same event loop tick is collected
+    and resolved with a single ``batch_fn(keys)`` call, which must return a
+    mapping of key -> value (missing keys resolve to ``None``). Results are
+    memoized for the lifetime of the loader, so create one per request.
+    """
+
+    def __init__(self, batch_fn: Callable[[List[Hashable]], Awaitable[Dict[Hashable, Any]]]):
+        self.batch_fn = batch_fn
+        self._cache: Dict[Hashable, asyncio.Future] = {}
+        self._queue: List[Hashable] = []
+        self.batches = 0
+
+    def load(self, key: Hashable) -> "asyncio.Future":
+        future = self._cache.get(key)
+        if future is not None:
+            return future
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._cache[key] = future
+        if not self._queue:
+            loop.call_soon(self._dispatch)
+        self._queue.append(key)
+        return future
+
+    async def load_many(self, keys: Iterable[Hashable]) -> List[Optional[Any]]:
+        return list(await asyncio.gather(*(self.load(key) for key in keys)))
+
+    def prime(self, key: Hashable, value: Any):
+        if key not in self._cache:
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(value)
+            self._cache[key] = future
+
+    def clear(self, key: Hashable):
+        self._cache.pop(key, None)
+
+    def _dispatch(self):
+        keys, self._queue = self._queue, []
+        asyncio.ensure_future(self._resolve(keys))
+
+    async def _resolve(self, keys: List[Hashable]):
+        self.batches += 1
+        try:
+            results = await self.batch_fn(keys)
+        except Exception as e:
+            for key in keys:
+                future = self._cache.pop(key, None)
+                if future is not None and not future.done():
+                    future.set_exception(e)
+            return
+        for key in keys:
+            future = self._cache.get(key)
+            if future is not None and not future.done():
+                future.set_result(results.get(key))
+
+
+# Never load the password hash when resolving other users
+USER_PUBLIC_PROJECTION = {"password": 0}
+
+
+def user_batch_fn(db):
+    async def load_users(user_ids):
+        cursor = db.users.find({"_id": {"$in": list(user_ids)}}, USER_PUBLIC_PROJECTION)
+        return {user["_id"]: user async for user in cursor}
+    return load_users
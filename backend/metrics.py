@@ -0,0 +1,364 @@
+"""Process metrics in the Prometheus text format, plus the instrumentation
+that feeds them:
+
+* ``MetricsMiddleware``   per-route latency histogram, status counts and an
+                          in-flight gauge; optionally cProfiles a sample of
+                          requests and dumps the slow ones
+* ``MongoCommandMetrics`` pymongo ``CommandListener`` timing every command
+* ``LoopLagMonitor``      measures event-loop lag and, from a watchdog
+                          thread, logs the stack of whatever is blocking the
+                          loop (a sync bcrypt or HTTP call, say)
+
+Each worker process keeps its own registry; scrape every worker or aggregate
+in Prometheus.
+"""
+import asyncio
+import cProfile
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import traceback
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        # Motor runs pymongo, and so the command listener, on worker threads
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return self.header() + [
+            f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+            for labels, value in values
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value: float, *labels):
+        self._values[labels] = value
+
+
+class CallbackGauge(_Metric):
+    """A gauge read from ``fn()`` at scrape time; ``fn`` returns a number or
+    ``{label_value_tuple: number}``."""
+    kind = "gauge"
+
+    def __init__(self, name, help_text, fn: Callable, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self.fn = fn
+
+    def render(self) -> List[str]:
+        value = self.fn()
+        if value is None:
+            return []
+        values = value if isinstance(value, dict) else {(): value}
+        return self.header() + [
+            f"{self.name}{_labels(self.labelnames, labels)} {_number(v)}"
+            for labels, v in sorted(values.items())
+        ]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        # labels -> [bucket counts..., sum, count]
+        self._series: Dict[tuple, List[float]] = {}
+
+    def observe(self, value: float, *labels):
+        bucket = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            series[bucket] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        with self._lock:
+            snapshot = sorted((labels, list(series)) for labels, series in self._series.items())
+        for labels, series in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(series[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs) -> Counter:
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs) -> Gauge:
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        return self.register(Histogram(*args, **kwargs))
+
+    def callback_gauge(self, *args, **kwargs) -> CallbackGauge:
+        return self.register(CallbackGauge(*args, **kwargs))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception:
+                logger.exception("Could not collect %s", metric.name)
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HTTP_LATENCY = registry.histogram(
+    "http_request_duration_seconds", "Time to serve a request, including streamed bodies",
+    ("method", "route", "status"),
+)
+HTTP_IN_FLIGHT = registry.gauge("http_requests_in_flight", "Requests currently being served")
+MONGO_LATENCY = registry.histogram(
+    "mongo_command_duration_seconds", "MongoDB command round trips",
+    ("command", "collection", "outcome"),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+UPSTREAM_LATENCY = registry.histogram(
+    "upstream_request_duration_seconds", "Calls to external services such as the chatbot model",
+    ("service", "operation", "outcome"),
+)
+LOOP_LAG = registry.histogram(
+    "event_loop_lag_seconds", "How late the event loop ran a scheduled wakeup",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+LOOP_BLOCKED = registry.counter("event_loop_blocked_total", "Times the loop was blocked past the threshold")
+SLOW_PROFILES = registry.counter("slow_request_profiles_total", "cProfile dumps written for slow requests")
+
+
+def stats_gauge(name: str, help_text: str, sources: Dict[str, Callable[[], Optional[dict]]]) -> CallbackGauge:
+    """Expose the numeric fields of components' ``stats()`` dicts as one
+    gauge labelled by component and stat."""
+    def collect():
+        values = {}
+        for component, fn in sources.items():
+            for stat, value in (fn() or {}).items():
+                if isinstance(value, (int, float)):
+                    values[(component, stat)] = int(value) if isinstance(value, bool) else value
+        return values
+    return registry.callback_gauge(name, help_text, collect, ("component", "stat"))
+
+
+@contextmanager
+def track_upstream(service: str, operation: str):
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    except (asyncio.CancelledError, GeneratorExit):
+        # GeneratorExit: a streamed response closed early by the client
+        outcome = "cancelled"
+        raise
+    finally:
+        UPSTREAM_LATENCY.observe(time.perf_counter() - started, service, operation, outcome)
+
+
+class MetricsMiddleware:
+    """ASGI middleware; records after the last body chunk so streamed and
+    SSE responses are measured end to end."""
+
+    def __init__(self, app, profile_rate: float = 0.0, slow_seconds: float = 1.0,
+                 profile_dir: Optional[str] = None):
+        self.app = app
+        self.profile_rate = profile_rate
+        self.slow_seconds = slow_seconds
+        self.profile_dir = profile_dir
+        self._profiling = False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = ["500"]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = str(message["status"])
+            await send(message)
+
+        # cProfile sees every coroutine the loop runs meanwhile, so only one
+        # request is profiled at a time and the dump is a sample, not a trace
+        profiler = None
+        if self.profile_rate and not self._profiling and random.random() < self.profile_rate:
+            self._profiling = True
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+        HTTP_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            HTTP_IN_FLIGHT.dec()
+            route = scope.get("route")
+            # Route templates keep label cardinality bounded
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_LATENCY.observe(elapsed, scope["method"], path, status[0])
+            if profiler is not None:
+                profiler.disable()
+                self._profiling = False
+                if elapsed >= self.slow_seconds and self.profile_dir:
+                    self._dump(profiler, scope["method"], path, elapsed)
+
+    def _dump(self, profiler: cProfile.Profile, method: str, path: str, elapsed: float):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        slug = "".join(c if c.isalnum() else "_" for c in path).strip("_") or "root"
+        filename = os.path.join(self.profile_dir, f"{int(time.time())}-{method}-{slug}-{int(elapsed * 1000)}ms.prof")
+        profiler.dump_stats(filename)
+        SLOW_PROFILES.inc()
+        logger.warning("Slow request %s %s took %.0f ms; profile written to %s", method, path, elapsed * 1000, filename)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    # Completion events do not carry the command, so remember the collection
+    def __init__(self):
+        self._collections: Dict[Tuple[str, int], str] = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        self._collections[(event.connection_id, event.request_id)] = collection if isinstance(collection, str) else ""
+
+    def _finish(self, event, outcome: str):
+        collection = self._collections.pop((event.connection_id, event.request_id), "")
+        MONGO_LATENCY.observe(event.duration_micros / 1e6, event.command_name, collection, outcome)
+
+    def succeeded(self, event):
+        self._finish(event, "ok")
+
+    def failed(self, event):
+        self._finish(event, "error")
+
+
+class LoopLagMonitor:
+    def __init__(self, interval: float = 0.25, threshold: float = 0.1):
+        self.interval = interval
+        self.threshold = threshold
+        self._beat = time.monotonic()
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._loop_thread_id: Optional[int] = None
+
+    async def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._task = asyncio.ensure_future(self._heartbeat())
+        self._thread = threading.Thread(target=self._watchdog, name="loop-lag-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stopping.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            LOOP_LAG.observe(max(0.0, now - expected))
+            self._beat = now
+
+    def _watchdog(self):
+        reported_beat = None
+        while not self._stopping.wait(self.threshold / 2):
+            beat = self._beat
+            stalled = time.monotonic() - beat - self.interval
+            if stalled < self.threshold or beat == reported_beat:
+                continue
+            # Report each stall once, with the stack that is holding the loop
+            reported_beat = beat
+            LOOP_BLOCKED.inc()
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "(no frame)"
+            logger.warning("Event loop blocked for over %.0f ms:\n%s", stalled * 1000, stack)
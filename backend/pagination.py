@@ -0,0 +1,116 @@
+import base64
+import json
+from datetime import datetime
+from typing import AsyncIterator, Callable, Optional, Tuple
+
+from fastapi import HTTPException, Query
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(doc: dict) -> str:
+    raw = json.dumps([doc["created_at"].isoformat(), doc["_id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str) -> Tuple[datetime, str]:
+    padded = token + "=" * (-len(token) % 4)
+    created_at, doc_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    return datetime.fromisoformat(created_at), doc_id
+
+
+class PageParams:
+    """Query parameters for keyset pagination on (created_at, _id)."""
+
+    def __init__(
+        self,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    ):
+        self.limit = limit
+        self.after: Optional[Tuple[datetime, str]] = None
+        if cursor:
+            try:
+                self.after = decode_cursor(cursor)
+            except (ValueError, TypeError):
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_filter(query: dict, after: Optional[Tuple[datetime, str]], descending: bool = True) -> dict:
+    if after is None:
+        return query
+    created_at, doc_id = after
+    op = "$lt" if descending else "$gt"
+    return {
+        **query,
+        "$or": [
+            {"created_at": {op: created_at}},
+            {"created_at": created_at, "_id": {op: doc_id}},
+        ],
+    }
+
+
+def keyset_sort(descending: bool = True) -> list:
+    direction = -1 if descending else 1
+    return [("created_at", direction), ("_id", direction)]
+
+
+def find_page(collection, query: dict, page: PageParams, descending: bool = True, projection: dict = None):
+    # One extra document tells us whether another page exists
+    return (
+        collection.find(keyset_filter(query, page.after, descending), projection)
+        .sort(keyset_sort(descending))
+        .limit(page.limit + 1)
+        .batch_size(page.limit + 1)
+    )
+
+
+async def open_page(cursor, limit: int, serialize: Callable[[dict], bytes]) -> AsyncIterator[bytes]:
+    """Run a ``find_page`` query and return the encoder for its page.
+
+    The first document is awaited here, before any response is started, so
+    a failing query still becomes an error status. ``find_page`` sizes the
+    first batch to hold the whole page, so the rest is already in memory
+    when ``stream_page`` writes it out.
+    """
+    documents = cursor.__aiter__()
+    try:
+        first = await documents.__anext__()
+    except StopAsyncIteration:
+        first = None
+    except BaseException:
+        await cursor.close()
+        raise
+    return stream_page(cursor, documents, first, limit, serialize)
+
+
+async def stream_page(cursor, documents: AsyncIterator[dict], first: Optional[dict], limit: int,
+                      serialize: Callable[[dict], bytes]) -> AsyncIterator[bytes]:
+    """Encode a page as ``{"items": [...], "next_cursor": ...}`` while reading it.
+
+    Items are written as they come off the Motor cursor instead of being
+    collected into a list first.
+    """
+    yield b'{"items":['
+    count = 0
+    last = None
+    next_cursor = None
+    doc = first
+    try:
+        while doc is not None:
+            if count == limit:
+                next_cursor = encode_cursor(last)
+                break
+            if count:
+                yield b","
+            yield serialize(doc)
+            last = doc
+            count += 1
+            try:
+                doc = await documents.__anext__()
+            except StopAsyncIteration:
+                doc = None
+    finally:
+        await cursor.close()
+    yield b'],"next_cursor":' + json.dumps(next_cursor).encode("ascii") + b"}"
@@ -0,0 +1,140 @@
+"""Reading progress: one bitset of read verses per user.
+
+Bit ``o`` is set once verse ordinal ``o`` of ``scripture.VerseTable`` has
+been read. The 31,102 verses fit in 486 64-bit words (about 4 KB of bits),
+kept as an int64 array in one document per user::
+
+    {"_id": user_id, "version": str, "words": [Int64, ...], "updated_at": datetime}
+
+Marking a chapter is a single ``$bit`` update of the few words it covers, so
+events from several devices cannot overwrite each other, and a whole-Bible
+summary is one document read followed by counting set bits per book.
+
+Ordinals only mean something for the table that numbered them, so each
+document records that table's ``version``. A document from another table
+reads as empty; the next mark starts a fresh bitset and keeps the old one
+under ``stale`` for an offline migration. Documents written before
+``version`` existed are claimed by the first table that marks them.
+"""
+from datetime import datetime
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+from bson.int64 import Int64
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+WORD_BITS = 64
+
+
+def word_count(verse_count: int) -> int:
+    return (verse_count + WORD_BITS - 1) // WORD_BITS
+
+
+def _int64(mask: int) -> Int64:
+    # Mongo integers are signed; bit 63 is the sign bit
+    return Int64(mask - (1 << 64) if mask >= 1 << 63 else mask)
+
+
+def word_masks(start: int, stop: int) -> Dict[int, int]:
+    """Bits of ordinals ``[start, stop)`` grouped by word index."""
+    masks = {}
+    for word in range(start // WORD_BITS, (stop - 1) // WORD_BITS + 1):
+        low = max(start, word * WORD_BITS) - word * WORD_BITS
+        high = min(stop, (word + 1) * WORD_BITS) - word * WORD_BITS
+        masks[word] = ((1 << high) - 1) ^ ((1 << low) - 1)
+    return masks
+
+
+def unpack_words(words: Sequence[int]) -> np.ndarray:
+    """int64 words to one uint8 (0/1) per ordinal, bit 0 of word 0 first."""
+    data = np.array(words, dtype="<i8").view(np.uint8)
+    return np.unpackbits(data, bitorder="little")
+
+
+def count_between(bits: np.ndarray, bounds: Sequence[int]) -> np.ndarray:
+    """Set bits in each ``[bounds[i], bounds[i + 1])``."""
+    totals = np.zeros(bits.size + 1, dtype=np.int64)
+    np.cumsum(bits, out=totals[1:])
+    bounds = np.asarray(bounds, dtype=np.int64)
+    return totals[bounds[1:]] - totals[bounds[:-1]]
+
+
+class ProgressStore:
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def _create(self, user_id: str, table):
+        doc = {
+            "_id": user_id,
+            "version": table.version,
+            "words": [Int64(0)] * word_count(table.verse_count),
+            "updated_at": datetime.utcnow(),
+        }
+        try:
+            await self.collection.insert_one(doc)
+            return
+        except DuplicateKeyError:
+            pass
+        existing = await self.collection.find_one({"_id": user_id}, {"version": 1, "words": 1})
+        if existing is None or existing.get("version", table.version) == table.version:
+            return
+        # Only replaced if it is still the stale one
+        await self.collection.replace_one(
+            {"_id": user_id, "version": existing["version"]},
+            {**doc, "stale": {"version": existing["version"], "words": existing["words"]}},
+        )
+
+    async def mark(self, user_id: str, start: int, stop: int, table, read: bool = True,
+                   window: Optional[Tuple[int, int]] = None) -> np.ndarray:
+        """Set (or clear) the bits of ``[start, stop)`` and return the bits of
+        ``window`` (by default the same range) as they are after the update."""
+        masks = word_masks(start, stop)
+        window_start, window_stop = window or (start, stop)
+        first = min(min(masks), window_start // WORD_BITS)
+        last = max(max(masks), (window_stop - 1) // WORD_BITS)
+        operation = {
+            f"words.{word}": {"or": _int64(mask)} if read else {"and": _int64(~mask & (1 << 64) - 1)}
+            for word, mask in masks.items()
+        }
+        for _ in range(2):
+            doc = await self.collection.find_one_and_update(
+                {"_id": user_id, "version": {"$in": [table.version, None]}},
+                {"$bit": operation, "$set": {"version": table.version, "updated_at": datetime.utcnow()}},
+                projection={"words": {"$slice": [first, last - first + 1]}},
+                return_document=ReturnDocument.AFTER,
+            )
+            if doc is not None:
+                break
+            if not read:
+                return np.zeros(window_stop - window_start, dtype=np.uint8)
+            # First progress for this user (or for this table); the retry
+            # applies the update
+            await self._create(user_id, table)
+        bits = unpack_words(doc["words"])
+        return bits[window_start - first * WORD_BITS:window_stop - first * WORD_BITS]
+
+    async def bits(self, user_id: str, table) -> np.ndarray:
+        doc = await self.collection.find_one({"_id": user_id}, {"version": 1, "words": 1})
+        bits = np.zeros(table.verse_count, dtype=np.uint8)
+        if doc and doc.get("version", table.version) == table.version:
+            stored = unpack_words(doc["words"])[:table.verse_count]
+            bits[:stored.size] = stored
+        return bits
+
+    async def reset(self, user_id: str) -> bool:
+        result = await self.collection.delete_one({"_id": user_id})
+        return result.deleted_count > 0
+
+
+def book_bounds(table) -> list:
+    """Ordinal boundaries of every book, for ``count_between``."""
+    return [table.chapter_first[base] for base in table.book_base]
+
+
+def chapter_bounds(table, book: int) -> list:
+    return list(table.chapter_first[table.book_base[book]:table.book_base[book + 1] + 1])
+
+
+def percent(read: int, total: int) -> float:
+    return round(100 * read / total, 1) if total else 0.0
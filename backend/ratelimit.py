@@ -0,0 +1,217 @@
+"""Per-user token-bucket rate limits and daily chatbot token quotas.
+
+Each route class ("chatbot", "chat", "write") has a ``Policy``: a bucket of
+``capacity`` tokens refilled continuously at ``refill_per_second``. A request
+takes one token; when the bucket is empty it is refused with the number of
+seconds until a token is back, which becomes the ``Retry-After`` header.
+
+Buckets live in process (``MemoryBuckets``) or, when several workers serve
+the same users, in a Mongo collection (``MongoBuckets``) where the refill and
+take happen in one pipeline update, timed by the server's ``$$NOW`` so the
+workers' clocks do not matter.
+"""
+import math
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+
+class Policy(NamedTuple):
+    capacity: float
+    refill_per_second: float
+
+    @classmethod
+    def parse(cls, spec: str) -> Optional["Policy"]:
+        """``"10/60"`` is a burst of 10 refilled over 60 seconds; ``"0"``
+        or an empty string disables the limit."""
+        spec = spec.strip()
+        if spec in ("", "0"):
+            return None
+        count, _, seconds = spec.partition("/")
+        capacity = float(count)
+        return cls(capacity, capacity / float(seconds or 1))
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after: float, limit: str):
+        super().__init__(f"{limit} limit exceeded; retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+        self.limit = limit
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class MemoryBuckets:
+    """Buckets for a single worker; the least recently used are dropped past
+    ``max_keys``, which only forgives those users their spent tokens."""
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def take(self, key: str, policy: Policy, cost: float = 1) -> float:
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (policy.capacity, now))
+        tokens = min(policy.capacity, tokens + (now - updated) * policy.refill_per_second)
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / policy.refill_per_second
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+    async def ensure_indexes(self):
+        pass
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class MongoBuckets:
+    """Buckets shared by all workers, one document per key. A TTL index on
+    ``expires_at`` removes buckets once they would be full again."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def take(self, key: str, policy: Policy, cost: float = 1) -> float:
+        elapsed_seconds = {"$divide": [{"$subtract": ["$$NOW", {"$ifNull": ["$updated_at", "$$NOW"]}]}, 1000]}
+        refilled = {"$min": [
+            policy.capacity,
+            {"$add": [{"$ifNull": ["$tokens", policy.capacity]},
+                      {"$multiply": [elapsed_seconds, policy.refill_per_second]}]},
+        ]}
+        pipeline = [
+            {"$set": {"tokens": refilled}},
+            {"$set": {"allowed": {"$gte": ["$tokens", cost]}}},
+            {"$set": {
+                "tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", cost]}, "$tokens"]},
+                "updated_at": "$$NOW",
+            }},
+            {"$set": {"expires_at": {"$add": [
+                "$$NOW",
+                {"$multiply": [{"$subtract": [policy.capacity, "$tokens"]}, 1000 / policy.refill_per_second]},
+            ]}}},
+        ]
+        for attempt in range(2):
+            try:
+                doc = await self.collection.find_one_and_update(
+                    {"_id": key}, pipeline, upsert=True, return_document=ReturnDocument.AFTER,
+                )
+                break
+            except DuplicateKeyError:
+                # Two workers created the same bucket at once; the retry updates it
+                if attempt:
+                    raise
+        if doc["allowed"]:
+            return 0.0
+        return (cost - doc["tokens"]) / policy.refill_per_second
+
+    def __len__(self):
+        return 0
+
+
+class RateLimiter:
+    def __init__(self, buckets, policies: Dict[str, Optional[Policy]]):
+        self.buckets = buckets
+        self.policies = policies
+        self.allowed = 0
+        self.limited = 0
+
+    async def check(self, route_class: str, user_id: str, cost: float = 1):
+        policy = self.policies.get(route_class)
+        if policy is None:
+            return
+        wait = await self.buckets.take(f"{route_class}:{user_id}", policy, cost)
+        if wait > 0:
+            self.limited += 1
+            raise RateLimited(wait, route_class)
+        self.allowed += 1
+
+    def stats(self) -> dict:
+        return {"allowed": self.allowed, "limited": self.limited, "local_buckets": len(self.buckets)}
+
+
+def create_buckets(kind: str, collection=None):
+    if kind == "memory":
+        return MemoryBuckets()
+    if kind == "mongo":
+        return MongoBuckets(collection)
+    raise ValueError(f"Unknown rate limit backend {kind!r}; expected memory or mongo")
+
+
+def estimate_tokens(*texts: Optional[str]) -> int:
+    # Roughly four characters per token for English text
+    return sum(math.ceil(len(text) / 4) for text in texts if text)
+
+
+class DailyQuota:
+    """Tokens used per user per UTC day, in process or in a Mongo collection
+    (one document per user and day, expired by a TTL index)."""
+
+    def __init__(self, limit: int, collection=None):
+        self.limit = limit
+        self.collection = collection
+        self._local: Dict[Tuple[str, str], int] = {}
+        self.exceeded = 0
+
+    @staticmethod
+    def _day(now: datetime) -> str:
+        return now.strftime("%Y-%m-%d")
+
+    @staticmethod
+    def resets_at(now: datetime) -> datetime:
+        return datetime(now.year, now.month, now.day) + timedelta(days=1)
+
+    async def ensure_indexes(self):
+        if self.collection is not None:
+            await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def used(self, user_id: str, now: Optional[datetime] = None) -> int:
+        day = self._day(now or datetime.utcnow())
+        if self.collection is None:
+            return self._local.get((user_id, day), 0)
+        doc = await self.collection.find_one({"_id": f"{user_id}:{day}"}, {"tokens": 1})
+        return doc["tokens"] if doc else 0
+
+    async def check(self, user_id: str):
+        if not self.limit:
+            return
+        now = datetime.utcnow()
+        if await self.used(user_id, now) >= self.limit:
+            self.exceeded += 1
+            raise RateLimited((self.resets_at(now) - now).total_seconds(), "daily token")
+
+    async def record(self, user_id: str, tokens: int):
+        if not tokens:
+            return
+        now = datetime.utcnow()
+        day = self._day(now)
+        if self.collection is None:
+            # Yesterday's counters are of no further use
+            if self._local and next(iter(self._local))[1] != day:
+                self._local = {key: value for key, value in self._local.items() if key[1] == day}
+            self._local[(user_id, day)] = self._local.get((user_id, day), 0) + tokens
+            return
+        await self.collection.update_one(
+            {"_id": f"{user_id}:{day}"},
+            {"$inc": {"tokens": tokens},
+             "$setOnInsert": {"user_id": user_id, "expires_at": self.resets_at(now) + timedelta(days=1)}},
+            upsert=True,
+        )
+
+    def stats(self) -> dict:
+        return {"limit": self.limit, "exceeded": self.exceeded}
@@ -0,0 +1,245 @@
+"""Real-time chat fan-out.
+
+``ChatHub`` keeps the WebSocket subscribers of each chat in this process.
+Messages reach the hub through a ``ChatBroker``:
+
+* ``InProcessBroker``     single worker; publish dispatches directly
+* ``ChangeStreamBroker``  multiple workers; every worker watches writes to
+                          ``chat_buckets`` via a MongoDB change stream
+                          (requires a replica set)
+* ``PollingBroker``       multi-worker stand-in for a standalone mongod; one
+                          query per interval picks up new messages for all chats
+
+Both background brokers read the bucket documents of ``chatstore``: every
+append sets the bucket's ``last`` field to the new message and raises its
+``last_at``.
+"""
+import abc
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class SlowConsumer(Exception):
+    """Raised when a subscriber's send queue overflows."""
+
+
+class Subscriber:
+    def __init__(self, chat_id: str, max_queue: int = 100):
+        self.chat_id = chat_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.overflowed = False
+
+    def offer(self, message: dict):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # A client that cannot keep up is disconnected and resumes from
+            # its last message id instead of buffering without bound.
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+    async def next(self) -> dict:
+        message = await self.queue.get()
+        if message is None and self.overflowed:
+            raise SlowConsumer()
+        return message
+
+
+class ChatHub:
+    def __init__(self, max_queue: int = 100):
+        self.max_queue = max_queue
+        self._subscribers: Dict[str, Set[Subscriber]] = {}
+        self.delivered = 0
+        self.dropped = 0
+
+    def subscribe(self, chat_id: str) -> Subscriber:
+        subscriber = Subscriber(chat_id, self.max_queue)
+        self._subscribers.setdefault(chat_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        subscribers = self._subscribers.get(subscriber.chat_id)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[subscriber.chat_id]
+
+    def has_subscribers(self, chat_id: str) -> bool:
+        return chat_id in self._subscribers
+
+    def dispatch(self, chat_id: str, message: dict):
+        for subscriber in list(self._subscribers.get(chat_id, ())):
+            subscriber.offer(message)
+            if subscriber.overflowed:
+                self.dropped += 1
+            else:
+                self.delivered += 1
+
+    def stats(self) -> dict:
+        return {
+            "chats": len(self._subscribers),
+            "subscribers": sum(len(s) for s in self._subscribers.values()),
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+        }
+
+
+class ChatBroker(abc.ABC):
+    def __init__(self, hub: ChatHub):
+        self.hub = hub
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    @abc.abstractmethod
+    async def publish(self, chat_id: str, message: dict):
+        """Deliver ``message`` to the chat's subscribers on every worker."""
+
+
+class InProcessBroker(ChatBroker):
+    async def publish(self, chat_id: str, message: dict):
+        self.hub.dispatch(chat_id, message)
+
+
+class _BackgroundBroker(ChatBroker):
+    # Delivery happens from a watcher task, so publishing is a no-op: the
+    # write to the chat's bucket is itself the event every worker sees.
+
+    def __init__(self, hub: ChatHub, collection):
+        super().__init__(hub)
+        self.collection = collection
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._task = asyncio.ensure_future(self._run_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def publish(self, chat_id: str, message: dict):
+        pass
+
+    async def _run_forever(self):
+        while True:
+            try:
+                await self._watch()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("%s failed; restarting", type(self).__name__)
+                await asyncio.sleep(1)
+
+    @abc.abstractmethod
+    async def _watch(self):
+        """Dispatch new messages to the hub until cancelled."""
+
+
+class ChangeStreamBroker(_BackgroundBroker):
+    async def _watch(self):
+        # Only the new message: an update event would otherwise carry the
+        # bucket's whole re-sorted messages array
+        pipeline = [
+            {"$match": {"$or": [
+                {"operationType": "insert", "fullDocument.last": {"$exists": True}},
+                {"operationType": "update", "updateDescription.updatedFields.last": {"$exists": True}},
+            ]}},
+            {"$project": {"fullDocument.last": 1, "updateDescription.updatedFields.last": 1}},
+        ]
+        async with self.collection.watch(pipeline) as stream:
+            async for change in stream:
+                if "fullDocument" in change:
+                    doc = change["fullDocument"]["last"]
+                else:
+                    doc = change["updateDescription"]["updatedFields"]["last"]
+                self.hub.dispatch(doc["chat_id"], message_payload(doc))
+
+
+class PollingBroker(_BackgroundBroker):
+    # Messages are numbered per chat, so each chat's last delivered ``n`` is
+    # the watermark; ``created_at`` comes from whichever worker sent the
+    # message and only bounds which buckets are worth reading. A message is
+    # picked up as long as it lands within ``window`` seconds of its
+    # timestamp.
+
+    def __init__(self, hub: ChatHub, collection, interval: float = 0.5, window: float = 5.0):
+        super().__init__(hub, collection)
+        self.interval = interval
+        self.window = timedelta(seconds=window)
+
+    async def _watch(self):
+        started = datetime.utcnow()
+        last_seen: Dict[str, int] = {}
+        while True:
+            await asyncio.sleep(self.interval)
+            now = datetime.utcnow()
+            since = now - self.window
+            # Buckets written to recently, with only their recent messages
+            cursor = self.collection.aggregate([
+                {"$match": {"last_at": {"$gte": since}}},
+                {"$project": {"chat_id": 1, "messages": {"$filter": {
+                    "input": "$messages", "cond": {"$gte": ["$$this.created_at", since]},
+                }}}},
+            ])
+            recent: Dict[str, list] = {}
+            async for bucket in cursor:
+                if bucket["messages"]:
+                    recent.setdefault(bucket["chat_id"], []).extend(bucket["messages"])
+            # A chat with nothing in the window has nothing left to deliver
+            last_seen = {
+                chat_id: self._deliver(chat_id, messages, last_seen.get(chat_id), started, now)
+                for chat_id, messages in recent.items()
+            }
+
+    def _deliver(self, chat_id: str, messages: list, seen: Optional[int], started: datetime,
+                 now: datetime) -> int:
+        """Dispatch the new messages of a chat in order; the new watermark."""
+        messages.sort(key=lambda message: message["n"])
+        if seen is None:
+            # Not in the previous window, so nothing here was delivered yet
+            fresh = [message for message in messages if message["created_at"] >= started]
+            seen = fresh[0]["n"] - 1 if fresh else messages[-1]["n"]
+        for message in messages:
+            if message["n"] <= seen:
+                continue
+            # Two senders can push out of counter order: wait a little for
+            # the missing message before moving past it
+            if message["n"] > seen + 1 and message["created_at"] > now - self.window / 2:
+                break
+            seen = message["n"]
+            if self.hub.has_subscribers(chat_id):
+                self.hub.dispatch(chat_id, message_payload({**message, "chat_id": chat_id}))
+        return seen
+
+
+def message_payload(doc: dict) -> dict:
+    return {
+        "id": doc["_id"],
+        "chat_id": doc["chat_id"],
+        "sender_id": doc["sender_id"],
+        "content": doc["content"],
+        "created_at": doc["created_at"].isoformat(),
+    }
+
+
+def create_broker(kind: str, hub: ChatHub, collection) -> ChatBroker:
+    if kind == "changestream":
+        return ChangeStreamBroker(hub, collection)
+    if kind == "polling":
+        return PollingBroker(hub, collection)
+    return InProcessBroker(hub)
@@ -0,0 +1,283 @@
+"""Bible references: parsing, canonical book names and packed verse ids.
+
+A verse is identified by one integer, ``BBCCCVVV``: book number (1-66),
+chapter and verse, so ``John 3:16`` is ``43003016``. Ids sort in canon order,
+which turns "everything in Romans 5-8" into the single range
+``45005000 <= verse_id < 45009000`` over a ``(user_id, verse_id)`` index.
+Verse ``000`` and chapter ``000`` stand for "before the first", so a whole
+chapter or book is a range too.
+
+``parse`` accepts what people type::
+
+    parse("1 Cor 13:4-7")      # 1 Corinthians 13:4-7
+    parse("Jn 3.16")           # John 3:16
+    parse("Romans 5-8")        # chapters 5 to 8
+    parse("Gen 1:1-2:3")       # across chapters
+    parse("Jude 3")            # single-chapter books take verses directly
+"""
+import re
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+from pymongo import UpdateOne
+
+from scripture import BIBLE_BOOKS
+
+MAX_CHAPTER = 999
+MAX_VERSE = 999
+
+_ALIASES = {
+    "Genesis": "gen ge gn",
+    "Exodus": "exod exo ex",
+    "Leviticus": "lev le lv",
+    "Numbers": "num nu nm nb",
+    "Deuteronomy": "deut de dt",
+    "Joshua": "josh jos jsh",
+    "Judges": "judg jdg jg jdgs",
+    "Ruth": "rth ru",
+    "1 Samuel": "1 sam 1 sa 1 sm",
+    "2 Samuel": "2 sam 2 sa 2 sm",
+    "1 Kings": "1 kgs 1 ki 1 kin",
+    "2 Kings": "2 kgs 2 ki 2 kin",
+    "1 Chronicles": "1 chr 1 chron 1 ch",
+    "2 Chronicles": "2 chr 2 chron 2 ch",
+    "Ezra": "ezr",
+    "Nehemiah": "neh ne",
+    "Esther": "esth est es",
+    "Job": "jb",
+    "Psalms": "psalm ps psa pss psm pslm",
+    "Proverbs": "prov pro prv pr",
+    "Ecclesiastes": "eccl eccles ecc ec qoh",
+    "Song of Solomon": "song song of songs sos sg cant canticles",
+    "Isaiah": "isa is",
+    "Jeremiah": "jer je jr",
+    "Lamentations": "lam la",
+    "Ezekiel": "ezek eze ezk",
+    "Daniel": "dan da dn",
+    "Hosea": "hos ho",
+    "Joel": "jl",
+    "Amos": "am",
+    "Obadiah": "obad ob",
+    "Jonah": "jon jnh",
+    "Micah": "mic mc",
+    "Nahum": "nah na",
+    "Habakkuk": "hab hb",
+    "Zephaniah": "zeph zep zp",
+    "Haggai": "hag hg",
+    "Zechariah": "zech zec zc",
+    "Malachi": "mal ml",
+    "Matthew": "matt mt",
+    "Mark": "mk mrk mar",
+    "Luke": "lk luk",
+    "John": "jn jhn joh",
+    "Acts": "ac act",
+    "Romans": "rom ro rm",
+    "1 Corinthians": "1 cor 1 co",
+    "2 Corinthians": "2 cor 2 co",
+    "Galatians": "gal ga",
+    "Ephesians": "eph ephes",
+    "Philippians": "phil php pp",
+    "Colossians": "col",
+    "1 Thessalonians": "1 thess 1 thes 1 th",
+    "2 Thessalonians": "2 thess 2 thes 2 th",
+    "1 Timothy": "1 tim 1 ti 1 tm",
+    "2 Timothy": "2 tim 2 ti 2 tm",
+    "Titus": "tit",
+    "Philemon": "philem phlm phm",
+    "Hebrews": "heb",
+    "James": "jas jm",
+    "1 Peter": "1 pet 1 pe 1 pt",
+    "2 Peter": "2 pet 2 pe 2 pt",
+    "1 John": "1 jn 1 jhn 1 jo 1 joh",
+    "2 John": "2 jn 2 jhn 2 jo 2 joh",
+    "3 John": "3 jn 3 jhn 3 jo 3 joh",
+    "Jude": "jd",
+    "Revelation": "rev re rv revelations",
+}
+
+SINGLE_CHAPTER_BOOKS = {BIBLE_BOOKS.index(name) for name in ("Obadiah", "Philemon", "2 John", "3 John", "Jude")}
+
+_ORDINAL_PREFIXES = {"i": "1", "ii": "2", "iii": "3", "first": "1", "second": "2", "third": "3",
+                     "1st": "1", "2nd": "2", "3rd": "3"}
+
+# Matches "1 cor" but also "1cor"; the aliases are written with the space
+_PREFIX = re.compile(r"^(\d)\s*(?=[a-z])")
+_REFERENCE = re.compile(
+    r"^\s*(?P<book>(?:[1-3]\s*)?[^\d\s][^\d]*?)\s*"
+    r"(?:(?P<c1>\d+)(?:\s*[:.]\s*(?P<v1>\d+))?"
+    r"(?:\s*[-–—]\s*(?:(?P<c2>\d+)\s*[:.]\s*)?(?P<x2>\d+))?)?\s*$"
+)
+
+
+class InvalidReference(ValueError):
+    pass
+
+
+def normalize_book_name(name: str) -> str:
+    words = name.lower().replace(".", " ").split()
+    if len(words) > 1 and words[0] in _ORDINAL_PREFIXES:
+        words[0] = _ORDINAL_PREFIXES[words[0]]
+    return _PREFIX.sub(r"\1 ", " ".join(words))
+
+
+_BOOK_KEYS = {}
+for _index, _name in enumerate(BIBLE_BOOKS):
+    _BOOK_KEYS[normalize_book_name(_name)] = _index
+    for _alias in re.findall(r"(?:\d )?[a-z]+(?: of [a-z]+)?", _ALIASES[_name]):
+        _BOOK_KEYS[_alias] = _index
+
+
+def book_index(name: str) -> Optional[int]:
+    """Resolve a full name, common abbreviation or unambiguous prefix."""
+    key = normalize_book_name(name)
+    if not key:
+        return None
+    if key in _BOOK_KEYS:
+        return _BOOK_KEYS[key]
+    if len(key) >= 3:
+        matches = {index for candidate, index in _BOOK_KEYS.items() if candidate.startswith(key)}
+        if len(matches) == 1:
+            return matches.pop()
+    return None
+
+
+def verse_id(book: int, chapter: int, verse: int) -> int:
+    """Pack a 0-based book index, chapter and verse as ``BBCCCVVV``."""
+    return (book + 1) * 1_000_000 + chapter * 1000 + verse
+
+
+def unpack(value: int):
+    """Inverse of ``verse_id``: ``(book_index, chapter, verse)``."""
+    return value // 1_000_000 - 1, value // 1000 % 1000, value % 1000
+
+
+class Passage(NamedTuple):
+    book: int
+    chapter: Optional[int] = None
+    verse: Optional[int] = None
+    chapter_end: Optional[int] = None
+    verse_end: Optional[int] = None
+
+    @property
+    def start(self) -> int:
+        return verse_id(self.book, self.chapter or 0, self.verse or 0)
+
+    @property
+    def stop(self) -> int:
+        """First verse id after the passage, for ``$lt``."""
+        if self.chapter is None:
+            return verse_id(self.book + 1, 0, 0)
+        if self.verse_end is None:
+            return verse_id(self.book, self.chapter_end + 1, 0)
+        return verse_id(self.book, self.chapter_end, self.verse_end + 1)
+
+    def id_filter(self) -> dict:
+        return {"$gte": self.start, "$lt": self.stop}
+
+    def __str__(self):
+        name = BIBLE_BOOKS[self.book]
+        if self.chapter is None:
+            return name
+        text = f"{name} {self.chapter}"
+        if self.verse is not None:
+            text += f":{self.verse}"
+        if self.verse_end is not None:
+            if self.chapter_end != self.chapter:
+                text += f"-{self.chapter_end}:{self.verse_end}"
+            elif self.verse_end != self.verse:
+                text += f"-{self.verse_end}"
+        elif self.chapter_end != self.chapter:
+            text += f"-{self.chapter_end}"
+        return text
+
+
+def check(passage: Passage, table=None) -> Passage:
+    """Validate bounds, and against a loaded ``scripture.VerseTable`` if given."""
+    if passage.chapter is None:
+        return passage
+    for value, limit in ((passage.chapter, MAX_CHAPTER), (passage.chapter_end, MAX_CHAPTER),
+                         (passage.verse, MAX_VERSE), (passage.verse_end, MAX_VERSE)):
+        if value is not None and not 1 <= value <= limit:
+            raise InvalidReference(f"{value} is out of range in {passage}")
+    if passage.start >= passage.stop:
+        raise InvalidReference(f"{passage} ends before it starts")
+    if table is not None:
+        chapters = table.chapter_count(passage.book)
+        if passage.chapter_end > chapters:
+            raise InvalidReference(f"{BIBLE_BOOKS[passage.book]} has {chapters} chapters")
+        for chapter, verse in ((passage.chapter, passage.verse), (passage.chapter_end, passage.verse_end)):
+            if verse is not None and verse > table.verse_count_in(passage.book, chapter):
+                raise InvalidReference(f"{BIBLE_BOOKS[passage.book]} {chapter} has no verse {verse}")
+    return passage
+
+
+def parse(text: str, table=None) -> Passage:
+    match = _REFERENCE.match(text or "")
+    if not match:
+        raise InvalidReference(f"Cannot read reference {text!r}")
+    book = book_index(match["book"])
+    if book is None:
+        raise InvalidReference(f"Unknown book {match['book'].strip()!r}")
+    if match["c1"] is None:
+        return Passage(book)
+
+    c1, v1, c2, x2 = (int(match[g]) if match[g] is not None else None for g in ("c1", "v1", "c2", "x2"))
+    if book in SINGLE_CHAPTER_BOOKS and v1 is None and c2 is None:
+        # "Jude 3" and "Jude 3-5" are verses of the only chapter
+        return check(Passage(book, 1, c1, 1, x2 if x2 is not None else c1), table)
+    if v1 is None:
+        if c2 is not None:
+            return check(Passage(book, c1, 1, c2, x2), table)
+        return check(Passage(book, c1, None, x2 if x2 is not None else c1, None), table)
+    if x2 is None:
+        return check(Passage(book, c1, v1, c1, v1), table)
+    return check(Passage(book, c1, v1, c2 if c2 is not None else c1, x2), table)
+
+
+def passage_for(book: str, chapter: int, verse: int, verse_end: Optional[int] = None, table=None) -> Passage:
+    """The passage of a stored note, highlight or bookmark."""
+    index = book_index(book)
+    if index is None:
+        raise InvalidReference(f"Unknown book {book!r}")
+    return check(Passage(index, chapter, verse, chapter, verse if verse_end is None else verse_end), table)
+
+
+def id_fields(passage: Passage) -> dict:
+    return {
+        "verse_id": passage.start,
+        "verse_end_id": verse_id(passage.book, passage.chapter_end, passage.verse_end),
+    }
+
+
+REFERENCE_COLLECTIONS = ("notes", "highlights", "bookmarks")
+MIGRATION_ID = "verse_ids"
+
+
+async def backfill_verse_ids(db, batch_size: int = 1000) -> int:
+    """Add verse ids (and canonical book names) to documents written before
+    they existed. Documents whose reference cannot be read get a null
+    ``verse_id`` and are left otherwise untouched. Runs once."""
+    if await db.migrations.find_one({"_id": MIGRATION_ID}):
+        return 0
+    total = 0
+    for name in REFERENCE_COLLECTIONS:
+        while True:
+            docs = await db[name].find(
+                {"verse_id": {"$exists": False}}, {"book": 1, "chapter": 1, "verse": 1, "verse_end": 1}
+            ).limit(batch_size).to_list(batch_size)
+            if not docs:
+                break
+            operations = []
+            for doc in docs:
+                try:
+                    passage = passage_for(doc["book"], doc["chapter"], doc["verse"], doc.get("verse_end"))
+                    update = {"book": BIBLE_BOOKS[passage.book], **id_fields(passage)}
+                except (InvalidReference, KeyError, TypeError):
+                    update = {"verse_id": None, "verse_end_id": None}
+                operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": update}))
+            await db[name].bulk_write(operations, ordered=False)
+            total += len(docs)
+    await db.migrations.update_one(
+        {"_id": MIGRATION_ID}, {"$set": {"completed_at": datetime.utcnow(), "documents": total}}, upsert=True
+    )
+    return total
@@ -0,0 +1,200 @@
+"""Precomputed related verses.
+
+Every verse gets a TF-IDF vector over the stemmed terms of ``search.tokenize``
+(sublinear tf, smoothed idf, L2-normalised), and its ``k`` nearest verses by
+cosine similarity are stored, so looking up connections at request time is
+one row read with no model call.
+
+Similarities are computed without a dense verse-by-term matrix: verses are
+processed in blocks, and for each block the products are accumulated from
+the postings of the block's terms. Very common terms (over ``max_df`` of all
+verses) and terms found in a single verse cannot discriminate and are
+dropped first, which also bounds the work per block. Verses from the same
+chapter are excluded as neighbours, since the reader already has those on
+screen.
+
+The result is one binary file, memory-mapped at startup::
+
+    python related.py build data/bible.bin data/related.bin [--k 20]
+
+Layout: header, version (the verse table's), then ``uint32[verses * k]``
+neighbour ordinals (``NO_NEIGHBOUR`` padded) and ``float16[verses * k]``
+scores, best first.
+"""
+import argparse
+import mmap
+import struct
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from search import tokenize
+
+_MAGIC = b"BVN1"
+# magic, verse count, k, version length
+_HEADER = struct.Struct("<4sIII")
+
+NO_NEIGHBOUR = 0xFFFFFFFF
+DEFAULT_K = 20
+
+
+def tfidf(texts: Iterable[str], max_df: float = 0.05):
+    """Return ``(indptr, terms, weights)``: rows of a CSR matrix of unit vectors."""
+    rows = [tokenize(text) for text in texts]
+    n = len(rows)
+    vocabulary = {}
+    for tokens in rows:
+        for term in set(tokens):
+            vocabulary[term] = vocabulary.get(term, 0) + 1
+    kept = {term: i for i, term in enumerate(
+        term for term, df in sorted(vocabulary.items()) if 1 < df <= max(2, max_df * n)
+    )}
+    df = np.zeros(len(kept), dtype=np.float32)
+    for term, i in kept.items():
+        df[i] = vocabulary[term]
+    idf = np.log((1 + n) / (1 + df)) + 1
+
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    term_ids, weights = [], []
+    for ordinal, tokens in enumerate(rows):
+        counts = {}
+        for term in tokens:
+            if term in kept:
+                counts[kept[term]] = counts.get(kept[term], 0) + 1
+        ids = np.fromiter(sorted(counts), dtype=np.int32, count=len(counts))
+        row = (1 + np.log(np.array([counts[i] for i in ids], dtype=np.float32))) * idf[ids]
+        norm = float(np.sqrt((row * row).sum()))
+        term_ids.append(ids)
+        weights.append(row / norm if norm else row)
+        indptr[ordinal + 1] = indptr[ordinal] + ids.size
+    empty_ids, empty_weights = np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+    return (indptr, np.concatenate(term_ids) if term_ids else empty_ids,
+            np.concatenate(weights) if weights else empty_weights)
+
+
+def _transpose(indptr, terms, weights, n_terms: int):
+    """CSR (verse -> term) to CSC (term -> verse)."""
+    rows = np.repeat(np.arange(indptr.size - 1, dtype=np.int64), np.diff(indptr))
+    order = np.argsort(terms, kind="stable")
+    col_ptr = np.zeros(n_terms + 1, dtype=np.int64)
+    np.cumsum(np.bincount(terms, minlength=n_terms), out=col_ptr[1:])
+    return col_ptr, rows[order], weights[order]
+
+
+def nearest(indptr, terms, weights, k: int, groups: Optional[np.ndarray] = None,
+            block_size: int = 64) -> Tuple[np.ndarray, np.ndarray]:
+    """Top ``k`` cosine neighbours of every row. Rows sharing a ``groups``
+    value (e.g. a chapter) are never neighbours of each other."""
+    n = indptr.size - 1
+    n_terms = int(terms.max()) + 1 if terms.size else 0
+    col_ptr, col_rows, col_weights = _transpose(indptr, terms, weights, n_terms)
+    neighbours = np.full((n, k), NO_NEIGHBOUR, dtype=np.uint32)
+    scores = np.zeros((n, k), dtype=np.float16)
+
+    for start in range(0, n, block_size):
+        stop = min(n, start + block_size)
+        # Every (block row, term) entry pairs with every posting of its term
+        entry_rows = np.repeat(np.arange(stop - start), np.diff(indptr[start:stop + 1]))
+        entry_terms = terms[indptr[start]:indptr[stop]]
+        entry_weights = weights[indptr[start]:indptr[stop]]
+        lengths = col_ptr[entry_terms + 1] - col_ptr[entry_terms]
+        if not lengths.sum():
+            continue
+        first = np.repeat(col_ptr[entry_terms] - np.cumsum(lengths) + lengths, lengths)
+        postings = first + np.arange(lengths.sum())
+        pair_rows = np.repeat(entry_rows, lengths)
+        products = np.repeat(entry_weights, lengths) * col_weights[postings]
+        block = np.bincount(pair_rows * n + col_rows[postings], weights=products,
+                            minlength=(stop - start) * n).reshape(stop - start, n)
+
+        local = np.arange(stop - start)
+        block[local, np.arange(start, stop)] = 0
+        if groups is not None:
+            block[groups[start:stop, None] == groups[None, :]] = 0
+        count = min(k, n - 1)
+        if count <= 0:
+            continue
+        top = np.argpartition(-block, count - 1, axis=1)[:, :count]
+        top_scores = block[local[:, None], top]
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        top, top_scores = top[local[:, None], order], top_scores[local[:, None], order]
+        found = top_scores > 0
+        neighbours[start:stop, :count] = np.where(found, top, NO_NEIGHBOUR)
+        scores[start:stop, :count] = np.where(found, top_scores, 0)
+    return neighbours, scores
+
+
+class RelatedIndex:
+    def __init__(self, neighbours: np.ndarray, scores: np.ndarray, version: str, _mmap=None):
+        self.neighbours = neighbours
+        self.scores = scores
+        self.version = version
+        self._mmap = _mmap
+
+    @property
+    def verse_count(self) -> int:
+        return int(self.neighbours.shape[0])
+
+    @property
+    def k(self) -> int:
+        return int(self.neighbours.shape[1])
+
+    def related(self, ordinal: int, limit: int = 10) -> List[Tuple[int, float]]:
+        row = self.neighbours[ordinal, :limit]
+        count = int(np.count_nonzero(row != NO_NEIGHBOUR))
+        return [(int(o), float(s)) for o, s in zip(row[:count], self.scores[ordinal, :count])]
+
+    @classmethod
+    def build(cls, texts: List[str], k: int = DEFAULT_K, groups: Optional[np.ndarray] = None,
+              version: str = "", max_df: float = 0.05) -> "RelatedIndex":
+        indptr, terms, weights = tfidf(texts, max_df=max_df)
+        neighbours, scores = nearest(indptr, terms, weights, k, groups=groups)
+        return cls(neighbours, scores, version)
+
+    def save(self, path) -> None:
+        version = self.version.encode("ascii")
+        with open(path, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, self.verse_count, self.k, len(version)))
+            f.write(version)
+            f.write(np.ascontiguousarray(self.neighbours, dtype="<u4").tobytes())
+            f.write(np.ascontiguousarray(self.scores, dtype="<f2").tobytes())
+
+    @classmethod
+    def open(cls, path) -> "RelatedIndex":
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n_verses, k, version_len = _HEADER.unpack_from(buffer, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"{path} is not a compiled related-verses index")
+        offset = _HEADER.size
+        version = bytes(buffer[offset:offset + version_len]).decode("ascii")
+        offset += version_len
+        neighbours = np.frombuffer(buffer, dtype="<u4", count=n_verses * k, offset=offset).reshape(n_verses, k)
+        offset += 4 * n_verses * k
+        scores = np.frombuffer(buffer, dtype="<f2", count=n_verses * k, offset=offset).reshape(n_verses, k)
+        return cls(neighbours, scores, version, _mmap=buffer)
+
+
+def build_for_bible(table, k: int = DEFAULT_K) -> RelatedIndex:
+    texts = [table.verse_text(ordinal) for ordinal in range(table.verse_count)]
+    # Chapter number of each verse, to keep neighbours out of the same chapter
+    chapter_first = np.asarray(table.chapter_first, dtype=np.int64)
+    groups = np.searchsorted(chapter_first, np.arange(table.verse_count), side="right")
+    return RelatedIndex.build(texts, k=k, groups=groups, version=table.version)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute related verses for the Bible Study API")
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument("bible", help="compiled verse table or JSON translation")
+    parser.add_argument("output")
+    parser.add_argument("--k", type=int, default=DEFAULT_K, help="neighbours stored per verse")
+    args = parser.parse_args()
+
+    import time
+    import scripture
+    started = time.perf_counter()
+    index = build_for_bible(scripture.load(args.bible), k=args.k)
+    index.save(args.output)
+    print(f"Related verses for {index.verse_count} verses, k={index.k} -> {args.output} "
+          f"({time.perf_counter() - started:.1f}s)")
@@ -0,0 +1,293 @@
+"""Background dispatch of due reminders.
+
+``ReminderScheduler`` keeps the next upcoming reminders in a heap ordered by
+``reminder_time`` and sleeps until the earliest one is due. It is hydrated
+from the ``due`` index on ``(reminder_time, completed)`` in windows of
+``window_size`` reminders, so memory stays bounded however many are pending.
+
+Dispatch writes one notification per recipient (the owner and the optional
+``friend_id``) with a deterministic ``_id`` and then stamps the reminders with
+``notified_at``. A crash between the two steps only causes the same
+notifications to be written again, which the ``_id`` turns into duplicate-key
+no-ops, so dispatch is idempotent and anything left undelivered is picked up
+on the next hydration. Reminders more than ``max_lateness`` overdue are left
+alone rather than delivered in one burst, e.g. on the first deploy or after a
+long outage. Moving a reminder's time clears ``notified_at`` (see
+``server.sync_study_data``), so it fires again.
+
+When several workers run, only the holder of a lease in ``scheduler_leases``
+dispatches. The lease is renewed every ``lease_seconds / 3``. A worker that
+is not the leader bumps a counter on the lease document when it creates or
+moves a reminder; the leader sees the counter change on its next renewal and
+re-hydrates, which is how it learns about reminders from other workers.
+Otherwise the heap is hydrated only when the lease is acquired and when it
+runs out of reminders below the horizon.
+"""
+import asyncio
+import heapq
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+_DUPLICATE_KEY = 11000
+
+
+def pending_filter(**extra) -> dict:
+    return {"completed": False, "notified_at": None, "deleted_at": None, **extra}
+
+
+def notification_docs(reminder: dict, now: datetime) -> List[dict]:
+    recipients = [reminder["user_id"]]
+    if reminder.get("friend_id") and reminder["friend_id"] != reminder["user_id"]:
+        recipients.append(reminder["friend_id"])
+    return [
+        {
+            "_id": f"reminder:{reminder['_id']}:{recipient}",
+            "user_id": recipient,
+            "type": "reminder",
+            "reminder_id": reminder["_id"],
+            "from_user_id": reminder["user_id"],
+            "title": reminder["title"],
+            "description": reminder["description"],
+            "reminder_time": reminder["reminder_time"],
+            "read": False,
+            "created_at": now,
+        }
+        for recipient in recipients
+    ]
+
+
+class Lease:
+    """A renewable named lock in a Mongo collection."""
+
+    def __init__(self, collection, name: str, ttl_seconds: float):
+        self.collection = collection
+        self.name = name
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.owner = str(uuid.uuid4())
+        # The counter as of the last successful acquire
+        self.signals = 0
+
+    async def acquire(self) -> bool:
+        now = datetime.utcnow()
+        try:
+            doc = await self.collection.find_one_and_update(
+                {"_id": self.name, "$or": [{"owner": self.owner}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"owner": self.owner, "expires_at": now + self.ttl}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # Somebody else holds an unexpired lease
+            return False
+        self.signals = doc.get("signals", 0)
+        return True
+
+    async def signal(self):
+        """Tell the holder that something changed; it reads ``signals`` on renewal."""
+        await self.collection.update_one({"_id": self.name}, {"$inc": {"signals": 1}})
+
+    async def release(self):
+        await self.collection.delete_one({"_id": self.name, "owner": self.owner})
+
+
+class ReminderScheduler:
+    def __init__(self, reminders, notifications, lease: Optional[Lease] = None,
+                 window_size: int = 1000, batch_size: int = 500, lease_seconds: float = 30,
+                 max_lateness: timedelta = timedelta(hours=24)):
+        self.reminders = reminders
+        self.notifications = notifications
+        self.lease = lease
+        self.max_lateness = max_lateness
+        self.window_size = window_size
+        self.batch_size = batch_size
+        self.renew_interval = lease_seconds / 3
+        self._heap: List[Tuple[datetime, str]] = []
+        self._scheduled: Dict[str, datetime] = {}
+        self._in_flight: Set[str] = set()
+        # Everything due up to the horizon is in the heap; None means all of it
+        self._horizon: Optional[datetime] = None
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self.is_leader = lease is None
+        self._signals_seen = 0
+        self.dispatched = 0
+        self.notifications_sent = 0
+
+    async def start(self):
+        if self.lease is None:
+            await self.hydrate()
+        self._tasks = [asyncio.ensure_future(self._run_forever())]
+        if self.lease is not None:
+            self._tasks.append(asyncio.ensure_future(self._keep_lease()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        if self.lease is not None and self.is_leader:
+            await self.lease.release()
+
+    async def schedule(self, reminder: dict):
+        """Add a newly created or moved reminder; a no-op beyond the hydrated
+        window. Off the leader it only signals the lease holder."""
+        if reminder.get("completed"):
+            return
+        if not self.is_leader:
+            if self.lease is not None:
+                await self.lease.signal()
+            return
+        due = reminder["reminder_time"]
+        if due.tzinfo is not None:
+            # The heap holds naive UTC like the documents it is hydrated from;
+            # one aware datetime would break every comparison in it
+            due = due.astimezone(timezone.utc).replace(tzinfo=None)
+        if self._horizon is not None and due > self._horizon:
+            return
+        if due < datetime.utcnow() - self.max_lateness:
+            return
+        self._push(reminder["_id"], due)
+        self._wakeup.set()
+
+    def _push(self, reminder_id: str, due: datetime):
+        if reminder_id in self._in_flight or self._scheduled.get(reminder_id) == due:
+            return
+        # A moved reminder leaves its old entry in the heap; entries that no
+        # longer match _scheduled are skipped when they come up
+        self._scheduled[reminder_id] = due
+        heapq.heappush(self._heap, (due, reminder_id))
+
+    async def hydrate(self):
+        # Walks the due index from the earliest pending reminder, overdue
+        # ones from before a crash included.
+        oldest = datetime.utcnow() - self.max_lateness
+        cursor = (
+            self.reminders.find(pending_filter(reminder_time={"$gte": oldest}), {"reminder_time": 1})
+            .sort("reminder_time", 1)
+            .limit(self.window_size)
+        )
+        docs = await cursor.to_list(self.window_size)
+        for doc in docs:
+            self._push(doc["_id"], doc["reminder_time"])
+        self._horizon = docs[-1]["reminder_time"] if len(docs) == self.window_size else None
+        if self._horizon is not None:
+            # Anything scheduled after the horizon will come back in a later window
+            for due, reminder_id in [entry for entry in self._heap if entry[0] > self._horizon]:
+                if self._scheduled.get(reminder_id) == due:
+                    del self._scheduled[reminder_id]
+            self._heap = [entry for entry in self._heap if entry[0] <= self._horizon]
+            heapq.heapify(self._heap)
+        self._wakeup.set()
+
+    async def _run_forever(self):
+        while True:
+            try:
+                await self._run()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Reminder scheduler failed; restarting")
+                await asyncio.sleep(1)
+                if self.is_leader:
+                    await self.hydrate()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            if not self.is_leader:
+                await self._wakeup.wait()
+                continue
+            if not self._heap:
+                if self._horizon is not None:
+                    await self.hydrate()
+                    continue
+                await self._wakeup.wait()
+                continue
+
+            delay = (self._heap[0][0] - datetime.utcnow()).total_seconds()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            now = datetime.utcnow()
+            due = []
+            while self._heap and self._heap[0][0] <= now and len(due) < self.batch_size:
+                entry_due, reminder_id = heapq.heappop(self._heap)
+                if self._scheduled.get(reminder_id) != entry_due:
+                    continue
+                del self._scheduled[reminder_id]
+                due.append(reminder_id)
+            self._in_flight.update(due)
+            try:
+                await self.dispatch(due)
+            finally:
+                self._in_flight.difference_update(due)
+
+    async def dispatch(self, reminder_ids: List[str]):
+        now = datetime.utcnow()
+        # Re-read so reminders completed, deleted or moved later since they
+        # were scheduled are skipped
+        reminders = await self.reminders.find(
+            pending_filter(_id={"$in": reminder_ids}, reminder_time={"$gte": now - self.max_lateness, "$lte": now})
+        ).to_list(len(reminder_ids))
+        if not reminders:
+            return
+
+        docs = [doc for reminder in reminders for doc in notification_docs(reminder, now)]
+        try:
+            await self.notifications.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            if any(error["code"] != _DUPLICATE_KEY for error in e.details["writeErrors"]):
+                raise
+        await self.reminders.update_many(
+            {"_id": {"$in": [reminder["_id"] for reminder in reminders]}},
+            {"$set": {"notified_at": now}},
+        )
+        self.dispatched += len(reminders)
+        self.notifications_sent += len(docs)
+
+    async def _keep_lease(self):
+        while True:
+            try:
+                leader = await self.lease.acquire()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Could not renew the reminder scheduler lease")
+                leader = False
+            acquired = leader and not self.is_leader
+            if leader != self.is_leader:
+                logger.info("Reminder scheduler %s leadership", "acquired" if leader else "lost")
+                self.is_leader = leader
+                if not leader:
+                    self._heap.clear()
+                    self._scheduled.clear()
+                    self._horizon = None
+                    self._wakeup.set()
+            if acquired or (leader and self.lease.signals != self._signals_seen):
+                # Noted before reading, so a signal raised meanwhile is not lost
+                self._signals_seen = self.lease.signals
+                await self.hydrate()
+            await asyncio.sleep(self.renew_interval)
+
+    def stats(self) -> dict:
+        return {
+            "leader": self.is_leader,
+            "scheduled": len(self._scheduled),
+            "next_due": min(self._scheduled.values()).isoformat() if self._scheduled else None,
+            "dispatched": self.dispatched,
+            "notifications": self.notifications_sent,
+        }
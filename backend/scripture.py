@@ -0,0 +1,203 @@
+"""Server-side Bible text store.
+
+A translation is held as a compact, array-backed verse table:
+
+* ``book_base[b]``      index into ``chapter_first`` of book ``b``'s first chapter
+* ``chapter_first[i]``  global ordinal of the first verse of chapter ``i``
+* ``text_offsets[o]``   byte offset of verse ordinal ``o`` in the UTF-8 text blob
+
+so ``(book, chapter, verse)`` resolves to a verse in O(1) with no per-verse
+Python objects. Tables can be compiled to a single binary file and opened
+with ``mmap``, letting every worker process share one copy through the OS
+page cache::
+
+    python scripture.py build kjv.json data/bible.bin
+"""
+import hashlib
+import json
+import mmap
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+BIBLE_BOOKS = [
+    "Genesis", "Exodus", "Leviticus", "Numbers", "Deuteronomy",
+    "Joshua", "Judges", "Ruth", "1 Samuel", "2 Samuel",
+    "1 Kings", "2 Kings", "1 Chronicles", "2 Chronicles",
+    "Ezra", "Nehemiah", "Esther", "Job", "Psalms", "Proverbs",
+    "Ecclesiastes", "Song of Solomon", "Isaiah", "Jeremiah",
+    "Lamentations", "Ezekiel", "Daniel", "Hosea", "Joel",
+    "Amos", "Obadiah", "Jonah", "Micah", "Nahum", "Habakkuk",
+    "Zephaniah", "Haggai", "Zechariah", "Malachi",
+    "Matthew", "Mark", "Luke", "John", "Acts", "Romans",
+    "1 Corinthians", "2 Corinthians", "Galatians", "Ephesians",
+    "Philippians", "Colossians", "1 Thessalonians", "2 Thessalonians",
+    "1 Timothy", "2 Timothy", "Titus", "Philemon", "Hebrews",
+    "James", "1 Peter", "2 Peter", "1 John", "2 John", "3 John",
+    "Jude", "Revelation"
+]
+
+_MAGIC = b"BVT1"
+# magic, book count, chapter count, verse count, text length
+_HEADER = struct.Struct("<4sIIII")
+
+
+def _uint32_view(buffer, offset: int, count: int):
+    return memoryview(buffer)[offset:offset + 4 * count].cast("I")
+
+
+class VerseTable:
+    def __init__(self, book_base, chapter_first, text_offsets, text, version: str, _mmap=None):
+        self.book_base = book_base
+        self.chapter_first = chapter_first
+        self.text_offsets = text_offsets
+        self.text = text
+        self.version = version
+        self._mmap = _mmap
+
+    @property
+    def verse_count(self) -> int:
+        return len(self.text_offsets) - 1
+
+    def chapter_count(self, book: int) -> int:
+        return self.book_base[book + 1] - self.book_base[book]
+
+    def verse_count_in(self, book: int, chapter: int) -> int:
+        if not 1 <= chapter <= self.chapter_count(book):
+            return 0
+        i = self.book_base[book] + chapter - 1
+        return self.chapter_first[i + 1] - self.chapter_first[i]
+
+    def ordinal(self, book: int, chapter: int, verse: int) -> Optional[int]:
+        if not 1 <= verse <= self.verse_count_in(book, chapter):
+            return None
+        return self.chapter_first[self.book_base[book] + chapter - 1] + verse - 1
+
+    def book_range(self, book: int) -> Tuple[int, int]:
+        # Half-open ordinal range [start, end) covering the whole book
+        return self.chapter_first[self.book_base[book]], self.chapter_first[self.book_base[book + 1]]
+
+    def reference(self, ordinal: int) -> Tuple[int, int, int]:
+        chapter_index = bisect_right(self.chapter_first, ordinal) - 1
+        # bisect_right skips past books with no chapters sharing this base
+        book = bisect_right(self.book_base, chapter_index) - 1
+        chapter = chapter_index - self.book_base[book] + 1
+        return book, chapter, ordinal - self.chapter_first[chapter_index] + 1
+
+    def verse_text(self, ordinal: int) -> str:
+        start, end = self.text_offsets[ordinal], self.text_offsets[ordinal + 1]
+        return bytes(self.text[start:end]).decode("utf-8")
+
+    def verses(self, book: int, chapter: int, start: int = 1, end: Optional[int] = None) -> List[Tuple[int, str]]:
+        count = self.verse_count_in(book, chapter)
+        end = count if end is None else min(end, count)
+        if count == 0 or start > end:
+            return []
+        first = self.chapter_first[self.book_base[book] + chapter - 1]
+        return [(v, self.verse_text(first + v - 1)) for v in range(max(start, 1), end + 1)]
+
+    @classmethod
+    def build(cls, entries: Iterable[Tuple[int, int, int, str]]) -> "VerseTable":
+        """Build from ``(book_index, chapter, verse, text)`` tuples in any order.
+
+        Missing verses or chapters inside a book are stored as empty text so
+        ordinals stay dense.
+        """
+        books = {}
+        for book, chapter, verse, text in entries:
+            books.setdefault(book, {}).setdefault(chapter, {})[verse] = text
+
+        book_base = array("I", [0])
+        chapter_first = array("I")
+        text_offsets = array("I", [0])
+        blob = bytearray()
+        for book in range(len(BIBLE_BOOKS)):
+            chapters = books.get(book, {})
+            for chapter in range(1, max(chapters, default=0) + 1):
+                chapter_first.append(len(text_offsets) - 1)
+                verses = chapters.get(chapter, {})
+                for verse in range(1, max(verses, default=0) + 1):
+                    blob += verses.get(verse, "").encode("utf-8")
+                    text_offsets.append(len(blob))
+            book_base.append(len(chapter_first))
+        chapter_first.append(len(text_offsets) - 1)
+
+        version = hashlib.sha1(bytes(blob) + text_offsets.tobytes()).hexdigest()[:12]
+        return cls(book_base, chapter_first, text_offsets, bytes(blob), version)
+
+    def save(self, path) -> None:
+        with open(path, "wb") as f:
+            f.write(_HEADER.pack(
+                _MAGIC, len(self.book_base), len(self.chapter_first), len(self.text_offsets), len(self.text)
+            ))
+            for table in (self.book_base, self.chapter_first, self.text_offsets):
+                f.write(array("I", table).tobytes())
+            f.write(bytes(self.text))
+
+    @classmethod
+    def open(cls, path, use_mmap: bool = True) -> "VerseTable":
+        with open(path, "rb") as f:
+            if use_mmap:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                buffer = f.read()
+        magic, n_books, n_chapters, n_offsets, text_len = _HEADER.unpack_from(buffer, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"{path} is not a compiled verse table")
+
+        offset = _HEADER.size
+        book_base = _uint32_view(buffer, offset, n_books)
+        offset += 4 * n_books
+        chapter_first = _uint32_view(buffer, offset, n_chapters)
+        offset += 4 * n_chapters
+        text_offsets = _uint32_view(buffer, offset, n_offsets)
+        offset += 4 * n_offsets
+        text = memoryview(buffer)[offset:offset + text_len]
+
+        version = hashlib.sha1(bytes(text) + text_offsets.tobytes()).hexdigest()[:12]
+        return cls(book_base, chapter_first, text_offsets, text, version,
+                   _mmap=buffer if use_mmap else None)
+
+
+def entries_from_json(data) -> Iterable[Tuple[int, int, int, str]]:
+    """Accept either a flat list of ``{book, chapter, verse, text}`` objects or
+    the nested ``{book: {chapters: [{verses: [{text}]}]}}`` shape used by the
+    frontend mock data."""
+    # references imports BIBLE_BOOKS from here
+    from references import book_index
+
+    if isinstance(data, list):
+        for item in data:
+            book = book_index(item["book"])
+            if book is None:
+                raise ValueError(f"Unknown book: {item['book']}")
+            yield book, int(item["chapter"]), int(item["verse"]), item["text"]
+        return
+
+    for name, book_data in data.items():
+        book = book_index(name)
+        if book is None:
+            raise ValueError(f"Unknown book: {name}")
+        for c, chapter in enumerate(book_data["chapters"], start=1):
+            for v, verse in enumerate(chapter["verses"], start=1):
+                yield book, c, v, verse["text"]
+
+
+def load(path, use_mmap: bool = True) -> VerseTable:
+    path = Path(path)
+    if path.suffix == ".json":
+        with open(path, encoding="utf-8") as f:
+            return VerseTable.build(entries_from_json(json.load(f)))
+    return VerseTable.open(path, use_mmap=use_mmap)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] != "build":
+        print("usage: python scripture.py build <translation.json> <output.bin>")
+        sys.exit(1)
+    table = load(sys.argv[2])
+    table.save(sys.argv[3])
+    print(f"Wrote {table.verse_count} verses to {sys.argv[3]} (version {table.version})")
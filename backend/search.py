@@ -0,0 +1,276 @@
+"""Full-text verse search over the scripture verse table.
+
+The inverted index maps each stemmed term to a postings list of verse
+ordinals (the global ordinals used by ``scripture.VerseTable``). Postings are
+delta-encoded LEB128 varints with a parallel uint8 term-frequency array and
+varint token positions, and everything lives in one binary file that is
+memory-mapped at startup::
+
+    python search.py build data/bible.bin data/search.bin
+
+Queries support free terms ranked with BM25 and quoted phrases, which are
+matched by intersecting (ordinal, position) keys of consecutive terms.
+"""
+import mmap
+import os
+import re
+import struct
+import sys
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+_PHRASE_RE = re.compile(r'"([^"]+)"')
+_SUFFIXES = ("ings", "ing", "eth", "edst", "est", "ed", "es", "s", "ly")
+_NO_UNDOUBLE = set("lsz")
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_MAGIC = b"BVS1"
+# Phrase matching packs (ordinal, position) into one integer key
+_POSITION_BITS = 12
+_MAX_POSITION = (1 << _POSITION_BITS) - 1
+
+# magic, verse count, term count, postings bytes, version length
+_HEADER = struct.Struct("<4sIIII")
+
+
+def stem(word: str) -> str:
+    # Light suffix stripper tuned for KJV-style English (loveth, blessed,
+    # believest); it only needs to be consistent between index and query.
+    if word.endswith("'s"):
+        word = word[:-2]
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            if suffix == "s" and word.endswith("ss"):
+                break
+            word = word[:-len(suffix)]
+            if len(word) > 3 and word[-1] == word[-2] and word[-1] not in _NO_UNDOUBLE:
+                word = word[:-1]
+            break
+    if len(word) > 3 and word.endswith("e"):
+        word = word[:-1]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    return [stem(token) for token in _TOKEN_RE.findall(text.lower())]
+
+
+def parse_query(query: str) -> Tuple[List[str], List[List[str]]]:
+    phrases = [tokenize(phrase) for phrase in _PHRASE_RE.findall(query)]
+    terms = tokenize(_PHRASE_RE.sub(" ", query))
+    for phrase in phrases:
+        terms.extend(phrase)
+    return list(dict.fromkeys(terms)), [p for p in phrases if len(p) > 1]
+
+
+def _encode_varints(values: Iterable[int], out: bytearray):
+    for value in values:
+        while value >= 0x80:
+            out.append((value & 0x7F) | 0x80)
+            value >>= 7
+        out.append(value)
+
+
+def decode_varints(buffer) -> np.ndarray:
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    if data.size == 0:
+        return np.zeros(0, dtype=np.int64)
+    ends = data < 0x80
+    group = np.concatenate(([0], np.cumsum(ends)[:-1]))
+    starts = np.flatnonzero(np.concatenate(([True], ends[:-1])))
+    shift = 7 * (np.arange(data.size) - starts[group])
+    values = np.bincount(group, weights=(data & 0x7F).astype(np.float64) * np.exp2(shift))
+    return values.astype(np.int64)
+
+
+class SearchIndex:
+    def __init__(self, terms: Dict[str, int], postings_offsets, tf_offsets, position_offsets, postings,
+                 doc_lengths, version: str, _mmap=None):
+        self.terms = terms
+        self.postings_offsets = postings_offsets
+        self.tf_offsets = tf_offsets
+        self.position_offsets = position_offsets
+        self.postings = postings
+        self.doc_lengths = np.frombuffer(doc_lengths, dtype=np.uint16)
+        self.avg_doc_length = float(self.doc_lengths.mean()) if self.doc_lengths.size else 0.0
+        self.version = version
+        self._mmap = _mmap
+
+    @property
+    def verse_count(self) -> int:
+        return int(self.doc_lengths.size)
+
+    def postings_for(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        index = self.terms.get(term)
+        if index is None:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty
+        # Term i owns three consecutive ranges of the postings blob: varint
+        # ordinal deltas, one tf byte per posting, then varint positions.
+        start, tf_start = self.postings_offsets[index], self.tf_offsets[index]
+        ordinals = np.cumsum(decode_varints(self.postings[start:tf_start]))
+        tfs = np.frombuffer(self.postings[tf_start:self.position_offsets[index]], dtype=np.uint8)
+        return ordinals, tfs
+
+    def position_keys(self, term: str) -> np.ndarray:
+        ordinals, tfs = self.postings_for(term)
+        if ordinals.size == 0:
+            return ordinals
+        index = self.terms[term]
+        positions = decode_varints(self.postings[self.position_offsets[index]:self.postings_offsets[index + 1]])
+        return (np.repeat(ordinals, tfs) << _POSITION_BITS) | positions
+
+    def phrase_ordinals(self, phrase: List[str]) -> np.ndarray:
+        keys = self.position_keys(phrase[0])
+        for offset, term in enumerate(phrase[1:], start=1):
+            if keys.size == 0:
+                break
+            keys = np.intersect1d(keys, self.position_keys(term) - offset, assume_unique=True)
+        return np.unique(keys >> _POSITION_BITS)
+
+    def search(self, query: str, limit: int = 20,
+               ordinal_range: Optional[Tuple[int, int]] = None) -> Tuple[int, List[Tuple[int, float]]]:
+        """Return ``(total_matches, [(ordinal, score), ...])`` for ``query``.
+
+        ``ordinal_range`` optionally restricts matches to ``[start, end)``.
+        """
+        terms, phrases = parse_query(query)
+        if not terms or self.verse_count == 0:
+            return 0, []
+
+        scores = np.zeros(self.verse_count, dtype=np.float32)
+        matched = np.zeros(self.verse_count, dtype=bool)
+        for term in terms:
+            ordinals, tfs = self.postings_for(term)
+            if ordinals.size == 0:
+                continue
+            idf = np.log(1 + (self.verse_count - ordinals.size + 0.5) / (ordinals.size + 0.5))
+            lengths = self.doc_lengths[ordinals]
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / self.avg_doc_length)
+            scores[ordinals] += (idf * tfs * (BM25_K1 + 1) / (tfs + norm)).astype(np.float32)
+            matched[ordinals] = True
+
+        # Every phrase must appear; free terms only add to the score
+        for phrase in phrases:
+            required = np.zeros(self.verse_count, dtype=bool)
+            required[self.phrase_ordinals(phrase)] = True
+            matched &= required
+        if ordinal_range is not None:
+            matched[:ordinal_range[0]] = False
+            matched[ordinal_range[1]:] = False
+
+        candidates = np.flatnonzero(matched)
+
+        total = int(candidates.size)
+        if total == 0:
+            return 0, []
+        candidate_scores = scores[candidates]
+        if total > limit:
+            top = np.argpartition(-candidate_scores, limit)[:limit]
+        else:
+            top = np.arange(total)
+        top = top[np.lexsort((candidates[top], -candidate_scores[top]))]
+        return total, [(int(candidates[i]), float(candidate_scores[i])) for i in top]
+
+    @classmethod
+    def build(cls, verse_texts: Iterable[str], version: str = "") -> "SearchIndex":
+        term_postings: Dict[str, Dict[int, List[int]]] = {}
+        doc_lengths = array("H")
+        for ordinal, text in enumerate(verse_texts):
+            tokens = tokenize(text)[:_MAX_POSITION + 1]
+            doc_lengths.append(len(tokens))
+            for position, token in enumerate(tokens):
+                term_postings.setdefault(token, {}).setdefault(ordinal, []).append(position)
+
+        sorted_terms = sorted(term_postings)
+        postings = bytearray()
+        postings_offsets = array("I")
+        tf_offsets = array("I")
+        position_offsets = array("I")
+        for term in sorted_terms:
+            # tf is stored in a byte, so at most 255 positions per verse
+            occurrences = {o: p[:255] for o, p in term_postings[term].items()}
+            ordinals = sorted(occurrences)
+            postings_offsets.append(len(postings))
+            previous = 0
+            deltas = []
+            for ordinal in ordinals:
+                deltas.append(ordinal - previous)
+                previous = ordinal
+            _encode_varints(deltas, postings)
+            tf_offsets.append(len(postings))
+            postings += bytes(len(occurrences[o]) for o in ordinals)
+            position_offsets.append(len(postings))
+            for ordinal in ordinals:
+                _encode_varints(occurrences[ordinal], postings)
+        postings_offsets.append(len(postings))
+
+        return cls({term: i for i, term in enumerate(sorted_terms)}, postings_offsets, tf_offsets,
+                   position_offsets, bytes(postings), doc_lengths.tobytes(), version)
+
+    def save(self, path) -> None:
+        """Write the index to ``path`` atomically, so a concurrent ``open``
+        sees either the old file or the complete new one."""
+        term_blob = "\n".join(sorted(self.terms, key=self.terms.get)).encode("utf-8")
+        version = self.version.encode("ascii")
+        partial = f"{path}.{os.getpid()}.tmp"
+        with open(partial, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, self.verse_count, len(self.terms), len(self.postings), len(version)))
+            f.write(version)
+            f.write(struct.pack("<I", len(term_blob)))
+            f.write(term_blob)
+            f.write(array("I", self.postings_offsets).tobytes())
+            f.write(array("I", self.tf_offsets).tobytes())
+            f.write(array("I", self.position_offsets).tobytes())
+            f.write(self.doc_lengths.tobytes())
+            f.write(bytes(self.postings))
+        os.replace(partial, path)
+
+    @classmethod
+    def open(cls, path) -> "SearchIndex":
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(buffer)
+        magic, n_verses, n_terms, postings_len, version_len = _HEADER.unpack_from(buffer, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"{path} is not a compiled search index")
+        offset = _HEADER.size
+        version = bytes(view[offset:offset + version_len]).decode("ascii")
+        offset += version_len
+        (terms_len,) = struct.unpack_from("<I", buffer, offset)
+        offset += 4
+        term_list = bytes(view[offset:offset + terms_len]).decode("utf-8").split("\n") if n_terms else []
+        offset += terms_len
+        postings_offsets = view[offset:offset + 4 * (n_terms + 1)].cast("I")
+        offset += 4 * (n_terms + 1)
+        tf_offsets = view[offset:offset + 4 * n_terms].cast("I")
+        offset += 4 * n_terms
+        position_offsets = view[offset:offset + 4 * n_terms].cast("I")
+        offset += 4 * n_terms
+        doc_lengths = view[offset:offset + 2 * n_verses]
+        offset += 2 * n_verses
+        postings = view[offset:offset + postings_len]
+        return cls({term: i for i, term in enumerate(term_list)}, postings_offsets, tf_offsets,
+                   position_offsets, postings, doc_lengths, version, _mmap=buffer)
+
+
+def build_for_bible(table) -> SearchIndex:
+    return SearchIndex.build(
+        (table.verse_text(ordinal) for ordinal in range(table.verse_count)),
+        version=table.version,
+    )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] != "build":
+        print("usage: python search.py build <bible.bin|bible.json> <output.bin>")
+        sys.exit(1)
+    import scripture
+    index = build_for_bible(scripture.load(sys.argv[2]))
+    index.save(sys.argv[3])
+    print(f"Indexed {index.verse_count} verses, {len(index.terms)} terms -> {sys.argv[3]}")
@@ -0,0 +1,52 @@
+"""Fast document-to-JSON mapping for response models.
+
+A ``Projection`` reads the field list of a Pydantic response model once and
+then maps Mongo documents straight to plain dicts (``_id`` becomes ``id``),
+which orjson encodes. Documents come from our own collections, so this skips
+constructing and validating a model per row; the model stays the schema that
+FastAPI documents.
+"""
+from typing import Any, Callable, Dict, Optional, Tuple, Type
+
+import orjson
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+
+_REQUIRED = object()
+
+# Field name in the response -> key in the Mongo document
+_RENAMES = {"id": "_id"}
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+class Projection:
+    def __init__(self, model: Type[BaseModel], overrides: Optional[Dict[str, Callable[[dict], Any]]] = None):
+        self.model = model
+        self.overrides = overrides or {}
+        self._fields: Tuple[Tuple[str, str, Any], ...] = tuple(
+            (name, _RENAMES.get(name, name), _REQUIRED if field.is_required() else field.default)
+            for name, field in model.model_fields.items()
+            if name not in self.overrides
+        )
+
+    def __call__(self, doc: dict) -> dict:
+        out = {}
+        for name, key, default in self._fields:
+            if default is _REQUIRED:
+                out[name] = doc[key]
+            else:
+                out[name] = doc.get(key, default)
+        for name, compute in self.overrides.items():
+            out[name] = compute(doc)
+        return out
+
+    def dumps(self, doc: dict) -> bytes:
+        return dumps(self(doc))
+
+
+def fast_response(content: Any, **kwargs) -> ORJSONResponse:
+    """Return ``content`` as-is, bypassing FastAPI's response_model pass."""
+    return ORJSONResponse(content, **kwargs)
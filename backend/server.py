@@ -1,45 +1,137 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Request, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 from passlib.context import CryptContext
-from datetime import datetime, timedelta
-from typing import List, Optional
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
 import os
 import logging
 import jwt
 from pathlib import Path
-from pydantic import BaseModel, Field, EmailStr
+from pydantic import BaseModel, Field, EmailStr, ValidationError, field_validator, model_validator
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
 import uuid
-import openai
-from openai import OpenAI
+import asyncio
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
+from hashing import PasswordHasher, HashingBusy
+import chatbot
+from cache import PrincipalCache, ResponseCache, prompt_hash, verse_cache_key
+from indexes import ensure_indexes
+from loaders import BatchLoader, USER_PUBLIC_PROJECTION, user_batch_fn
+from pagination import (
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, PageParams, encode_cursor, find_page, open_page
+)
+import scripture
+import references
+import search
+import related
+import realtime
+from serialization import Projection, fast_response
+import reminders
+import sync
+import metrics
+import ratelimit
+import progress
+import chatstore
 
 # Load environment variables
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ.get('DB_NAME', 'bible_study_db')]
+# MongoDB connection. This and the other clients, pools and caches below
+# that start as None are created per worker by startup_clients(), not at import.
+MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
+DB_NAME = os.environ.get('DB_NAME', 'bible_study_db')
+client: Optional[AsyncIOMotorClient] = None
+db = None
 
 # OpenAI configuration
-openai_client = OpenAI(api_key=os.environ.get('OPENAI_API_KEY'))
+openai_client = None
+CHATBOT_CACHE_MONGO = os.environ.get('CHATBOT_CACHE_MONGO', '').lower() in ('1', 'true', 'yes')
+chatbot_cache: Optional[ResponseCache] = None
+
+# Bible text store, loaded at startup (see scripture.py for the file format)
+BIBLE_PATH = os.environ.get('BIBLE_PATH', str(ROOT_DIR / 'data' / 'bible.bin'))
+bible: Optional[scripture.VerseTable] = None
+SEARCH_INDEX_PATH = os.environ.get('SEARCH_INDEX_PATH', str(ROOT_DIR / 'data' / 'search.bin'))
+# Longer than a full index build takes
+SEARCH_BUILD_LEASE_SECONDS = 600
+search_index: Optional[search.SearchIndex] = None
+RELATED_PATH = os.environ.get('RELATED_PATH', str(ROOT_DIR / 'data' / 'related.bin'))
+related_index: Optional[related.RelatedIndex] = None
+# Read verses per user, as bitsets over verse ordinals (see progress.py)
+reading_progress: Optional[progress.ProgressStore] = None
+
+# Real-time chat fan-out; CHAT_BROKER=memory|changestream|polling
+CHAT_BROKER = os.environ.get('CHAT_BROKER', 'memory')
+chat_hub = realtime.ChatHub(max_queue=int(os.environ.get('CHAT_WS_QUEUE', 100)))
+chat_broker: realtime.ChatBroker = realtime.InProcessBroker(chat_hub)
+# Messages live in buckets per chat (see chatstore.py); full buckets older
+# than CHAT_ARCHIVE_AFTER_DAYS move to a compressed archive ("0" disables)
+chat_store: Optional[chatstore.ChatStore] = None
+CHAT_ARCHIVE_AFTER_DAYS = float(os.environ.get('CHAT_ARCHIVE_AFTER_DAYS', 30))
+chat_archiver: Optional[chatstore.ChatArchiver] = None
+
+# Due-reminder dispatch; the lease elects one worker to run it
+REMINDER_SCHEDULER = os.environ.get('REMINDER_SCHEDULER', '1').lower() not in ('0', 'false', 'no')
+reminder_scheduler: Optional[reminders.ReminderScheduler] = None
+
+# Sync tombstones are purged after SYNC_TOMBSTONE_DAYS ("0" keeps them)
+SYNC_TOMBSTONE_DAYS = float(os.environ.get('SYNC_TOMBSTONE_DAYS', 90))
+tombstone_purger: Optional[sync.TombstonePurger] = None
 
 # Security
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+password_hasher: Optional[PasswordHasher] = None
 security = HTTPBearer()
+principal_cache = PrincipalCache(
+    max_entries=int(os.environ.get('PRINCIPAL_CACHE_SIZE', 10000)),
+    ttl_seconds=float(os.environ.get('PRINCIPAL_CACHE_TTL', 60)),
+)
+# Per-user token buckets by route class, "burst/seconds" ("0" disables);
+# RATE_LIMIT_BACKEND=mongo shares them between workers
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+RATE_LIMIT_POLICIES = {
+    "chatbot": ratelimit.Policy.parse(os.environ.get('RATE_LIMIT_CHATBOT', '10/60')),
+    "chat": ratelimit.Policy.parse(os.environ.get('RATE_LIMIT_CHAT', '30/10')),
+    "write": ratelimit.Policy.parse(os.environ.get('RATE_LIMIT_WRITE', '60/60')),
+}
+rate_limiter: Optional[ratelimit.RateLimiter] = None
+chatbot_quota: Optional[ratelimit.DailyQuota] = None
 SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-here-bible-study-2024')
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await startup_clients()
+    for startup in (startup_loop_monitor, startup_bible, startup_chat_broker, startup_indexes,
+                    startup_reminder_scheduler, startup_chat_archiver, startup_tombstone_purger):
+        await startup()
+    try:
+        yield
+    finally:
+        await shutdown_clients()
+
 # Create FastAPI app
-app = FastAPI(title="Bible Study App API", version="1.0.0")
+app = FastAPI(title="Bible Study App API", version="1.0.0", default_response_class=ORJSONResponse, lifespan=lifespan)
 
 # Create API router
 api_router = APIRouter(prefix="/api")
 
+# Request metrics; PROFILE_SAMPLE_RATE > 0 cProfiles that share of requests
+# and writes the ones slower than PROFILE_SLOW_MS to PROFILE_DIR
+app.add_middleware(
+    metrics.MetricsMiddleware,
+    profile_rate=float(os.environ.get('PROFILE_SAMPLE_RATE', 0)),
+    slow_seconds=float(os.environ.get('PROFILE_SLOW_MS', 1000)) / 1000,
+    profile_dir=os.environ.get('PROFILE_DIR', str(ROOT_DIR / 'profiles')),
+)
+loop_monitor = metrics.LoopLagMonitor(threshold=float(os.environ.get('LOOP_LAG_THRESHOLD_MS', 100)) / 1000)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -49,6 +141,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def to_naive_utc(value: datetime) -> datetime:
+    # Mongo returns naive UTC datetimes; compare and store everything that way
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
 # Pydantic Models
 class UserCreate(BaseModel):
     name: str
@@ -69,7 +167,26 @@ class Token(BaseModel):
     access_token: str
     token_type: str
 
-class NoteCreate(BaseModel):
+MAX_BATCH_SIZE = 500
+
+class VerseRangeModel(BaseModel):
+    # A passage is stored as one document spanning verse..verse_end
+    verse_end: Optional[int] = None
+
+    @model_validator(mode="after")
+    def check_reference(self):
+        if self.verse_end is not None:
+            if self.verse_end < self.verse:
+                raise ValueError("verse_end must not be before verse")
+            if self.verse_end == self.verse:
+                self.verse_end = None
+        # Abbreviations are stored under the canonical name; chapter and
+        # verse are checked against the Bible text when it is loaded
+        passage = references.passage_for(self.book, self.chapter, self.verse, self.verse_end, table=bible)
+        self.book = scripture.BIBLE_BOOKS[passage.book]
+        return self
+
+class NoteCreate(VerseRangeModel):
     title: str
     content: str
     book: str
@@ -87,10 +204,11 @@ class NoteResponse(BaseModel):
     book: str
     chapter: int
     verse: int
+    verse_end: Optional[int] = None
     created_at: datetime
     updated_at: datetime
 
-class HighlightCreate(BaseModel):
+class HighlightCreate(VerseRangeModel):
     book: str
     chapter: int
     verse: int
@@ -102,11 +220,12 @@ class HighlightResponse(BaseModel):
     book: str
     chapter: int
     verse: int
+    verse_end: Optional[int] = None
     text: str
     color: str
     created_at: datetime
 
-class BookmarkCreate(BaseModel):
+class BookmarkCreate(VerseRangeModel):
     book: str
     chapter: int
     verse: int
@@ -116,8 +235,27 @@ class BookmarkResponse(BaseModel):
     book: str
     chapter: int
     verse: int
+    verse_end: Optional[int] = None
     created_at: datetime
 
+class NoteBatch(BaseModel):
+    items: List[NoteCreate] = Field(..., min_length=1, max_length=MAX_BATCH_SIZE)
+
+class HighlightBatch(BaseModel):
+    items: List[HighlightCreate] = Field(..., min_length=1, max_length=MAX_BATCH_SIZE)
+
+class BookmarkBatch(BaseModel):
+    items: List[BookmarkCreate] = Field(..., min_length=1, max_length=MAX_BATCH_SIZE)
+
+class BatchItemResult(BaseModel):
+    index: int
+    id: Optional[str] = None
+    error: Optional[str] = None
+
+class BatchWriteResponse(BaseModel):
+    inserted: int
+    results: List[BatchItemResult]
+
 class FriendRequestCreate(BaseModel):
     friend_email: str
 
@@ -133,6 +271,11 @@ class ReminderCreate(BaseModel):
     reminder_time: datetime
     friend_id: Optional[str] = None
 
+    @field_validator("reminder_time")
+    @classmethod
+    def naive_reminder_time(cls, value: datetime) -> datetime:
+        return to_naive_utc(value)
+
 class ReminderResponse(BaseModel):
     id: str
     title: str
@@ -159,14 +302,129 @@ class ChatMessageResponse(BaseModel):
     content: str
     created_at: datetime
 
+class NotePage(BaseModel):
+    items: List[NoteResponse]
+    next_cursor: Optional[str] = None
+
+class HighlightPage(BaseModel):
+    items: List[HighlightResponse]
+    next_cursor: Optional[str] = None
+
+class BookmarkPage(BaseModel):
+    items: List[BookmarkResponse]
+    next_cursor: Optional[str] = None
+
+class ReminderPage(BaseModel):
+    items: List[ReminderResponse]
+    next_cursor: Optional[str] = None
+
+class NotificationResponse(BaseModel):
+    id: str
+    type: str
+    title: str
+    description: str
+    reminder_id: Optional[str] = None
+    from_user_id: Optional[str] = None
+    reminder_time: Optional[datetime] = None
+    read: bool
+    created_at: datetime
+
+class NotificationPage(BaseModel):
+    items: List[NotificationResponse]
+    next_cursor: Optional[str] = None
+
+class ChatPage(BaseModel):
+    items: List[ChatResponse]
+    next_cursor: Optional[str] = None
+
+class ChatMessagePage(BaseModel):
+    items: List[ChatMessageResponse]
+    next_cursor: Optional[str] = None
+
+class ChatMessageDelta(BaseModel):
+    items: List[ChatMessageResponse]
+    has_more: bool
+
+class ChatSummary(BaseModel):
+    id: str
+    participants: List[str]
+    created_at: datetime
+    unread_count: int
+    last_message: Optional[ChatMessageResponse] = None
+
+class ChatReadMarker(BaseModel):
+    message_id: Optional[str] = None
+
+class StudySearchResult(BaseModel):
+    type: str
+    id: str
+    book: str
+    chapter: int
+    verse: int
+    title: Optional[str] = None
+    text: Optional[str] = None
+    score: float
+    created_at: datetime
+
+class StudySearchPage(BaseModel):
+    items: List[StudySearchResult]
+    next_offset: Optional[int] = None
+
+class SyncChange(BaseModel):
+    id: str = Field(..., min_length=1, max_length=64)
+    updated_at: datetime
+    deleted: bool = False
+    # Same fields as the collection's create request; omitted for deletions
+    data: Optional[dict] = None
+
+class SyncRequest(BaseModel):
+    versions: Dict[str, int] = {}
+    changes: Dict[str, List[SyncChange]] = {}
+    limit: int = Field(500, ge=1, le=2000)
+
+class StudyOverlay(BaseModel):
+    book: str
+    chapter: int
+    highlights: List[HighlightResponse]
+    bookmarks: List[BookmarkResponse]
+    notes: List[NoteResponse]
+
 class ChatbotMessage(BaseModel):
     message: str
     context: Optional[str] = None
+    book: Optional[str] = None
+    chapter: Optional[int] = None
+    verse: Optional[int] = None
 
 class ChatbotResponse(BaseModel):
     response: str
     context: Optional[str] = None
 
+class ChatbotQuota(BaseModel):
+    limit: int
+    used: int
+    remaining: Optional[int] = None
+    resets_at: datetime
+
+class ChapterProgress(BaseModel):
+    chapter: int
+    read: int
+    verses: int
+    percent: float
+
+class BookProgress(BaseModel):
+    book: str
+    read: int
+    verses: int
+    percent: float
+    chapters: Optional[List[ChapterProgress]] = None
+
+class ReadingProgressSummary(BaseModel):
+    read: int
+    verses: int
+    percent: float
+    books: List[BookProgress]
+
 # Utility functions
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -179,29 +437,86 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return await authenticate_token(credentials.credentials)
+
+async def authenticate_token(token: str):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
         if user_id is None:
             raise credentials_exception
     except jwt.PyJWTError:
         raise credentials_exception
     
-    user = await db.users.find_one({"_id": user_id})
+    user = await principal_cache.get(user_id, load_principal)
     if user is None:
         raise credentials_exception
     return user
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def load_principal(user_id: str):
+    return await db.users.find_one({"_id": user_id}, USER_PUBLIC_PROJECTION)
+
+def invalidate_user(user_id: str):
+    # Call after any write to a users document
+    principal_cache.invalidate(user_id)
+
+async def paginated_response(cursor, page: PageParams, to_response):
+    return StreamingResponse(
+        await open_page(cursor, page.limit, to_response.dumps),
+        media_type="application/json",
+    )
+
+def get_user_loader() -> BatchLoader:
+    # One loader per request: FastAPI caches dependency results per request,
+    # so every handler dependency asking for it shares the same batches.
+    return BatchLoader(user_batch_fn(db))
+
+def hashing_busy_exception():
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many authentication requests, please retry shortly",
+        headers={"Retry-After": "1"},
+    )
+
+def rate_limited_exception(e: ratelimit.RateLimited):
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail=f"Too many requests: {e}",
+        headers={"Retry-After": e.retry_after_header},
+    )
+
+def rate_limit(route_class: str):
+    async def check_rate_limit(current_user: dict = Depends(get_current_user)):
+        try:
+            await rate_limiter.check(route_class, current_user["_id"])
+        except ratelimit.RateLimited as e:
+            raise rate_limited_exception(e)
+    return check_rate_limit
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def require_chatbot_quota(current_user: dict = Depends(get_current_user)):
+    try:
+        await chatbot_quota.check(current_user["_id"])
+    except ratelimit.RateLimited as e:
+        raise rate_limited_exception(e)
+
+CHATBOT_LIMITS = [Depends(rate_limit("chatbot")), Depends(require_chatbot_quota)]
+
+async def verify_password(plain_password, hashed_password):
+    try:
+        return await password_hasher.verify_and_update(plain_password, hashed_password)
+    except HashingBusy:
+        raise hashing_busy_exception()
+
+async def get_password_hash(password):
+    try:
+        return await password_hasher.hash(password)
+    except HashingBusy:
+        raise hashing_busy_exception()
 
 # Main app endpoints (without /api prefix)
 @app.get("/")
@@ -210,7 +525,35 @@ async def main_root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "message": "Bible Study API is running"}
+    return {
+        "status": "healthy",
+        "message": "Bible Study API is running",
+        "hashing": password_hasher.stats(),
+        "chatbot_cache": chatbot_cache.stats(),
+        "principal_cache": principal_cache.stats(),
+        "chat_realtime": chat_hub.stats(),
+        "reminder_scheduler": reminder_scheduler.stats() if reminder_scheduler is not None else None,
+        "chat_archiver": chat_archiver.stats() if chat_archiver is not None else None,
+        "tombstone_purger": tombstone_purger.stats() if tombstone_purger is not None else None,
+        "rate_limits": rate_limiter.stats(),
+        "chatbot_quota": chatbot_quota.stats(),
+    }
+
+metrics.stats_gauge("app_component_stat", "Counters and sizes reported by /health", {
+    "hashing": lambda: password_hasher.stats(),
+    "chatbot_cache": lambda: chatbot_cache.stats(),
+    "principal_cache": principal_cache.stats,
+    "chat_realtime": chat_hub.stats,
+    "reminder_scheduler": lambda: reminder_scheduler.stats() if reminder_scheduler is not None else None,
+    "chat_archiver": lambda: chat_archiver.stats() if chat_archiver is not None else None,
+    "tombstone_purger": lambda: tombstone_purger.stats() if tombstone_purger is not None else None,
+    "rate_limits": lambda: rate_limiter.stats(),
+    "chatbot_quota": lambda: chatbot_quota.stats(),
+})
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return Response(metrics.registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 # API Router endpoints (with /api prefix)
 @api_router.get("/")
@@ -229,7 +572,7 @@ async def register(user: UserCreate):
         )
     
     # Create new user
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash(user.password)
     user_id = str(uuid.uuid4())
     user_doc = {
         "_id": user_id,
@@ -240,6 +583,7 @@ async def register(user: UserCreate):
     }
     
     await db.users.insert_one(user_doc)
+    invalidate_user(user_id)
     
     return UserResponse(
         id=user_id,
@@ -251,13 +595,21 @@ async def register(user: UserCreate):
 @api_router.post("/auth/login", response_model=Token)
 async def login(user_credentials: UserLogin):
     user = await db.users.find_one({"email": user_credentials.email})
-    if not user or not verify_password(user_credentials.password, user["password"]):
+    verified, new_hash = (False, None)
+    if user:
+        verified, new_hash = await verify_password(user_credentials.password, user["password"])
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    # Transparently upgrade hashes created with an outdated cost factor
+    if new_hash:
+        await db.users.update_one({"_id": user["_id"]}, {"$set": {"password": new_hash}})
+        invalidate_user(user["_id"])
+    
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"sub": user["_id"]}, expires_delta=access_token_expires
@@ -276,234 +628,528 @@ async def read_users_me(current_user: dict = Depends(get_current_user)):
 # Bible endpoints
 @api_router.get("/bible/books")
 async def get_bible_books():
-    books = [
-        "Genesis", "Exodus", "Leviticus", "Numbers", "Deuteronomy",
-        "Joshua", "Judges", "Ruth", "1 Samuel", "2 Samuel",
-        "1 Kings", "2 Kings", "1 Chronicles", "2 Chronicles",
-        "Ezra", "Nehemiah", "Esther", "Job", "Psalms", "Proverbs",
-        "Ecclesiastes", "Song of Solomon", "Isaiah", "Jeremiah",
-        "Lamentations", "Ezekiel", "Daniel", "Hosea", "Joel",
-        "Amos", "Obadiah", "Jonah", "Micah", "Nahum", "Habakkuk",
-        "Zephaniah", "Haggai", "Zechariah", "Malachi",
-        "Matthew", "Mark", "Luke", "John", "Acts", "Romans",
-        "1 Corinthians", "2 Corinthians", "Galatians", "Ephesians",
-        "Philippians", "Colossians", "1 Thessalonians", "2 Thessalonians",
-        "1 Timothy", "2 Timothy", "Titus", "Philemon", "Hebrews",
-        "James", "1 Peter", "2 Peter", "1 John", "2 John", "3 John",
-        "Jude", "Revelation"
-    ]
-    return {"books": books}
+    return {"books": scripture.BIBLE_BOOKS}
 
-# Notes endpoints
-@api_router.get("/notes", response_model=List[NoteResponse])
-async def get_notes(current_user: dict = Depends(get_current_user)):
-    notes = await db.notes.find({"user_id": current_user["_id"]}).to_list(100)
-    return [
-        NoteResponse(
-            id=note["_id"],
-            title=note["title"],
-            content=note["content"],
-            book=note["book"],
-            chapter=note["chapter"],
-            verse=note["verse"],
-            created_at=note["created_at"],
-            updated_at=note["updated_at"]
-        )
-        for note in notes
-    ]
+BIBLE_CACHE_CONTROL = "public, max-age=86400, stale-while-revalidate=604800"
 
-@api_router.post("/notes", response_model=NoteResponse)
-async def create_note(note: NoteCreate, current_user: dict = Depends(get_current_user)):
-    note_id = str(uuid.uuid4())
-    note_doc = {
-        "_id": note_id,
-        "user_id": current_user["_id"],
+def require_bible():
+    if bible is None:
+        raise HTTPException(status_code=503, detail="Bible text is not available on this server")
+    return bible
+
+def resolve_book(book: str):
+    index = references.book_index(book)
+    if index is None:
+        raise HTTPException(status_code=404, detail="Book not found")
+    return index
+
+def not_modified(request: Request, etag: str, cache_control: str = BIBLE_CACHE_CONTROL) -> Optional[Response]:
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+    return None
+
+def cacheable_response(request: Request, etag: str, content: dict, cache_control: str = BIBLE_CACHE_CONTROL):
+    return not_modified(request, etag, cache_control) or ORJSONResponse(
+        content, headers={"ETag": etag, "Cache-Control": cache_control}
+    )
+
+def parse_verse_range(verses: str):
+    start, _, end = verses.partition("-")
+    try:
+        start = int(start)
+        end = int(end) if end else start
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Verses must be N or N-M")
+    if start < 1 or end < start:
+        raise HTTPException(status_code=400, detail="Invalid verse range")
+    return start, end
+
+@api_router.get("/bible/reference")
+async def parse_bible_reference(q: str = Query(..., min_length=1, max_length=100)):
+    try:
+        passage = references.parse(q, table=bible)
+    except references.InvalidReference as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "reference": str(passage),
+        "book": scripture.BIBLE_BOOKS[passage.book],
+        "chapter": passage.chapter,
+        "verse": passage.verse,
+        "chapter_end": passage.chapter_end,
+        "verse_end": passage.verse_end,
+        "start_id": passage.start,
+        "stop_id": passage.stop,
+    }
+
+@api_router.get("/bible/search")
+async def search_bible(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    book: Optional[str] = None,
+):
+    table = require_bible()
+    if search_index is None:
+        raise HTTPException(status_code=503, detail="Search is not available on this server")
+    ordinal_range = table.book_range(resolve_book(book)) if book else None
+    total, hits = search_index.search(q, limit=limit, ordinal_range=ordinal_range)
+    results = []
+    for ordinal, score in hits:
+        book_index, chapter, verse = table.reference(ordinal)
+        results.append({
+            "book": scripture.BIBLE_BOOKS[book_index],
+            "chapter": chapter,
+            "verse": verse,
+            "text": table.verse_text(ordinal),
+            "score": round(score, 4),
+        })
+    return ORJSONResponse(
+        {"query": q, "total": total, "results": results},
+        headers={"Cache-Control": BIBLE_CACHE_CONTROL},
+    )
+
+@api_router.get("/bible/{book}/{chapter}")
+async def get_bible_chapter(book: str, chapter: int, request: Request):
+    table = require_bible()
+    index = resolve_book(book)
+    verses = table.verses(index, chapter)
+    if not verses:
+        raise HTTPException(status_code=404, detail="Chapter not found")
+    return cacheable_response(request, f'"{table.version}-{index}-{chapter}"', {
+        "book": scripture.BIBLE_BOOKS[index],
+        "chapter": chapter,
+        "chapters": table.chapter_count(index),
+        "verses": [{"verse": verse, "text": text} for verse, text in verses],
+    })
+
+@api_router.get("/bible/{book}/{chapter}/{verses}")
+async def get_bible_verses(book: str, chapter: int, verses: str, request: Request):
+    table = require_bible()
+    index = resolve_book(book)
+    start, end = parse_verse_range(verses)
+    selected = table.verses(index, chapter, start, end)
+    if not selected:
+        raise HTTPException(status_code=404, detail="Verses not found")
+    return cacheable_response(request, f'"{table.version}-{index}-{chapter}-{start}-{end}"', {
+        "book": scripture.BIBLE_BOOKS[index],
+        "chapter": chapter,
+        "verses": [{"verse": verse, "text": text} for verse, text in selected],
+    })
+
+@api_router.get("/bible/{book}/{chapter}/{verse}/related")
+async def get_related_verses(book: str, chapter: int, verse: int, request: Request,
+                             limit: int = Query(10, ge=1, le=related.DEFAULT_K)):
+    table = require_bible()
+    if related_index is None:
+        raise HTTPException(status_code=503, detail="Related verses are not available on this server")
+    index = resolve_book(book)
+    ordinal = table.ordinal(index, chapter, verse)
+    if ordinal is None:
+        raise HTTPException(status_code=404, detail="Verse not found")
+    results = []
+    for neighbour, score in related_index.related(ordinal, limit):
+        book_index, neighbour_chapter, neighbour_verse = table.reference(neighbour)
+        results.append({
+            "book": scripture.BIBLE_BOOKS[book_index],
+            "chapter": neighbour_chapter,
+            "verse": neighbour_verse,
+            "text": table.verse_text(neighbour),
+            "score": round(score, 3),
+        })
+    return cacheable_response(request, f'"{table.version}-{ordinal}-related-{limit}"', {
+        "book": scripture.BIBLE_BOOKS[index],
+        "chapter": chapter,
+        "verse": verse,
+        "related": results,
+    })
+
+async def insert_one_stamped(collection_name: str, doc: dict):
+    async with sync.reserve_versions(db.sync_counters, doc["user_id"], collection_name) as version:
+        sync.stamp([doc], version, datetime.utcnow())
+        await db[collection_name].insert_one(doc)
+
+async def insert_batch(collection_name: str, user_id: str, docs: List[dict]) -> BatchWriteResponse:
+    # Unordered, so one failing document does not stop the rest
+    errors = {}
+    try:
+        async with sync.reserve_versions(db.sync_counters, user_id, collection_name, len(docs)) as first:
+            sync.stamp(docs, first, datetime.utcnow())
+            await db[collection_name].insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        errors = {error["index"]: error["errmsg"] for error in e.details["writeErrors"]}
+    return BatchWriteResponse(
+        inserted=len(docs) - len(errors),
+        results=[
+            BatchItemResult(index=i, error=errors[i]) if i in errors else BatchItemResult(index=i, id=doc["_id"])
+            for i, doc in enumerate(docs)
+        ],
+    )
+
+def verse_range_fields(item: VerseRangeModel) -> dict:
+    fields = {"book": item.book, "chapter": item.chapter, "verse": item.verse}
+    if item.verse_end is not None:
+        fields["verse_end"] = item.verse_end
+    fields.update(references.id_fields(references.passage_for(item.book, item.chapter, item.verse, item.verse_end)))
+    return fields
+
+def passage_filter(
+    ref: Optional[str] = Query(None, description='Only items starting in this passage, e.g. "Romans 5-8" or "Jn 3:16"')
+) -> dict:
+    if not ref:
+        return {}
+    try:
+        passage = references.parse(ref)
+    except references.InvalidReference as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"verse_id": passage.id_filter()}
+
+# Notes endpoints
+def note_document(user_id: str, note: NoteCreate, now: datetime) -> dict:
+    return {
+        "_id": str(uuid.uuid4()),
+        "user_id": user_id,
         "title": note.title,
         "content": note.content,
-        "book": note.book,
-        "chapter": note.chapter,
-        "verse": note.verse,
-        "created_at": datetime.utcnow(),
-        "updated_at": datetime.utcnow()
+        **verse_range_fields(note),
+        "created_at": now,
+        "updated_at": now
     }
-    
-    await db.notes.insert_one(note_doc)
-    
-    return NoteResponse(
-        id=note_id,
-        title=note.title,
-        content=note.content,
-        book=note.book,
-        chapter=note.chapter,
-        verse=note.verse,
-        created_at=note_doc["created_at"],
-        updated_at=note_doc["updated_at"]
+
+note_response = Projection(NoteResponse)
+
+@api_router.get("/notes", response_model=NotePage)
+async def get_notes(page: PageParams = Depends(), reference: dict = Depends(passage_filter),
+                    current_user: dict = Depends(get_current_user)):
+    cursor = find_page(db.notes, sync.live({"user_id": current_user["_id"], **reference}), page)
+    return await paginated_response(cursor, page, note_response)
+
+@api_router.post("/notes", response_model=NoteResponse, dependencies=[Depends(rate_limit("write"))])
+async def create_note(note: NoteCreate, current_user: dict = Depends(get_current_user)):
+    note_doc = note_document(current_user["_id"], note, datetime.utcnow())
+    await insert_one_stamped("notes", note_doc)
+    return note_response(note_doc)
+
+@api_router.post("/notes/batch", response_model=BatchWriteResponse, dependencies=[Depends(rate_limit("write"))])
+async def create_notes(batch: NoteBatch, current_user: dict = Depends(get_current_user)):
+    now = datetime.utcnow()
+    return await insert_batch(
+        "notes", current_user["_id"], [note_document(current_user["_id"], note, now) for note in batch.items]
     )
 
 @api_router.put("/notes/{note_id}", response_model=NoteResponse)
 async def update_note(note_id: str, note_update: NoteUpdate, current_user: dict = Depends(get_current_user)):
-    existing_note = await db.notes.find_one({"_id": note_id, "user_id": current_user["_id"]})
-    if not existing_note:
-        raise HTTPException(status_code=404, detail="Note not found")
-    
     update_data = {k: v for k, v in note_update.dict().items() if v is not None}
     update_data["updated_at"] = datetime.utcnow()
     
-    await db.notes.update_one(
-        {"_id": note_id, "user_id": current_user["_id"]},
-        {"$set": update_data}
-    )
-    
-    updated_note = await db.notes.find_one({"_id": note_id, "user_id": current_user["_id"]})
+    async with sync.reserve_versions(db.sync_counters, current_user["_id"], "notes") as version:
+        update_data["version"] = version
+        updated_note = await db.notes.find_one_and_update(
+            sync.live({"_id": note_id, "user_id": current_user["_id"]}),
+            {"$set": update_data},
+            return_document=ReturnDocument.AFTER
+        )
+    if not updated_note:
+        raise HTTPException(status_code=404, detail="Note not found")
     
-    return NoteResponse(
-        id=updated_note["_id"],
-        title=updated_note["title"],
-        content=updated_note["content"],
-        book=updated_note["book"],
-        chapter=updated_note["chapter"],
-        verse=updated_note["verse"],
-        created_at=updated_note["created_at"],
-        updated_at=updated_note["updated_at"]
-    )
+    return note_response(updated_note)
 
 @api_router.delete("/notes/{note_id}")
 async def delete_note(note_id: str, current_user: dict = Depends(get_current_user)):
-    result = await db.notes.delete_one({"_id": note_id, "user_id": current_user["_id"]})
-    if result.deleted_count == 0:
+    if not await sync.tombstone(db.sync_counters, db.notes, "notes", {"_id": note_id, "user_id": current_user["_id"]}):
         raise HTTPException(status_code=404, detail="Note not found")
     return {"message": "Note deleted successfully"}
 
 # Highlights endpoints
-@api_router.get("/highlights", response_model=List[HighlightResponse])
-async def get_highlights(current_user: dict = Depends(get_current_user)):
-    highlights = await db.highlights.find({"user_id": current_user["_id"]}).to_list(100)
-    return [
-        HighlightResponse(
-            id=highlight["_id"],
-            book=highlight["book"],
-            chapter=highlight["chapter"],
-            verse=highlight["verse"],
-            text=highlight["text"],
-            color=highlight["color"],
-            created_at=highlight["created_at"]
-        )
-        for highlight in highlights
-    ]
-
-@api_router.post("/highlights", response_model=HighlightResponse)
-async def create_highlight(highlight: HighlightCreate, current_user: dict = Depends(get_current_user)):
-    highlight_id = str(uuid.uuid4())
-    highlight_doc = {
-        "_id": highlight_id,
-        "user_id": current_user["_id"],
-        "book": highlight.book,
-        "chapter": highlight.chapter,
-        "verse": highlight.verse,
+def highlight_document(user_id: str, highlight: HighlightCreate, now: datetime) -> dict:
+    return {
+        "_id": str(uuid.uuid4()),
+        "user_id": user_id,
+        **verse_range_fields(highlight),
         "text": highlight.text,
         "color": highlight.color,
-        "created_at": datetime.utcnow()
+        "created_at": now
     }
-    
-    await db.highlights.insert_one(highlight_doc)
-    
-    return HighlightResponse(
-        id=highlight_id,
-        book=highlight.book,
-        chapter=highlight.chapter,
-        verse=highlight.verse,
-        text=highlight.text,
-        color=highlight.color,
-        created_at=highlight_doc["created_at"]
+
+highlight_response = Projection(HighlightResponse)
+
+@api_router.get("/highlights", response_model=HighlightPage)
+async def get_highlights(page: PageParams = Depends(), reference: dict = Depends(passage_filter),
+                         current_user: dict = Depends(get_current_user)):
+    cursor = find_page(db.highlights, sync.live({"user_id": current_user["_id"], **reference}), page)
+    return await paginated_response(cursor, page, highlight_response)
+
+@api_router.post("/highlights", response_model=HighlightResponse, dependencies=[Depends(rate_limit("write"))])
+async def create_highlight(highlight: HighlightCreate, current_user: dict = Depends(get_current_user)):
+    highlight_doc = highlight_document(current_user["_id"], highlight, datetime.utcnow())
+    await insert_one_stamped("highlights", highlight_doc)
+    return highlight_response(highlight_doc)
+
+@api_router.post("/highlights/batch", response_model=BatchWriteResponse, dependencies=[Depends(rate_limit("write"))])
+async def create_highlights(batch: HighlightBatch, current_user: dict = Depends(get_current_user)):
+    now = datetime.utcnow()
+    return await insert_batch(
+        "highlights", current_user["_id"], [highlight_document(current_user["_id"], highlight, now) for highlight in batch.items]
     )
 
 @api_router.delete("/highlights/{highlight_id}")
 async def delete_highlight(highlight_id: str, current_user: dict = Depends(get_current_user)):
-    result = await db.highlights.delete_one({"_id": highlight_id, "user_id": current_user["_id"]})
-    if result.deleted_count == 0:
+    query = {"_id": highlight_id, "user_id": current_user["_id"]}
+    if not await sync.tombstone(db.sync_counters, db.highlights, "highlights", query):
         raise HTTPException(status_code=404, detail="Highlight not found")
     return {"message": "Highlight deleted successfully"}
 
 # Bookmarks endpoints
-@api_router.get("/bookmarks", response_model=List[BookmarkResponse])
-async def get_bookmarks(current_user: dict = Depends(get_current_user)):
-    bookmarks = await db.bookmarks.find({"user_id": current_user["_id"]}).to_list(100)
-    return [
-        BookmarkResponse(
-            id=bookmark["_id"],
-            book=bookmark["book"],
-            chapter=bookmark["chapter"],
-            verse=bookmark["verse"],
-            created_at=bookmark["created_at"]
-        )
-        for bookmark in bookmarks
-    ]
+def bookmark_document(user_id: str, bookmark: BookmarkCreate, now: datetime) -> dict:
+    return {
+        "_id": str(uuid.uuid4()),
+        "user_id": user_id,
+        **verse_range_fields(bookmark),
+        "created_at": now
+    }
+
+bookmark_response = Projection(BookmarkResponse)
+
+@api_router.get("/bookmarks", response_model=BookmarkPage)
+async def get_bookmarks(page: PageParams = Depends(), reference: dict = Depends(passage_filter),
+                        current_user: dict = Depends(get_current_user)):
+    cursor = find_page(db.bookmarks, sync.live({"user_id": current_user["_id"], **reference}), page)
+    return await paginated_response(cursor, page, bookmark_response)
 
-@api_router.post("/bookmarks", response_model=BookmarkResponse)
+@api_router.post("/bookmarks", response_model=BookmarkResponse, dependencies=[Depends(rate_limit("write"))])
 async def create_bookmark(bookmark: BookmarkCreate, current_user: dict = Depends(get_current_user)):
-    bookmark_id = str(uuid.uuid4())
-    bookmark_doc = {
-        "_id": bookmark_id,
-        "user_id": current_user["_id"],
-        "book": bookmark.book,
-        "chapter": bookmark.chapter,
-        "verse": bookmark.verse,
-        "created_at": datetime.utcnow()
-    }
-    
-    await db.bookmarks.insert_one(bookmark_doc)
-    
-    return BookmarkResponse(
-        id=bookmark_id,
-        book=bookmark.book,
-        chapter=bookmark.chapter,
-        verse=bookmark.verse,
-        created_at=bookmark_doc["created_at"]
+    bookmark_doc = bookmark_document(current_user["_id"], bookmark, datetime.utcnow())
+    await insert_one_stamped("bookmarks", bookmark_doc)
+    return bookmark_response(bookmark_doc)
+
+@api_router.post("/bookmarks/batch", response_model=BatchWriteResponse, dependencies=[Depends(rate_limit("write"))])
+async def create_bookmarks(batch: BookmarkBatch, current_user: dict = Depends(get_current_user)):
+    now = datetime.utcnow()
+    return await insert_batch(
+        "bookmarks", current_user["_id"], [bookmark_document(current_user["_id"], bookmark, now) for bookmark in batch.items]
     )
 
 @api_router.delete("/bookmarks/{bookmark_id}")
 async def delete_bookmark(bookmark_id: str, current_user: dict = Depends(get_current_user)):
-    result = await db.bookmarks.delete_one({"_id": bookmark_id, "user_id": current_user["_id"]})
-    if result.deleted_count == 0:
+    query = {"_id": bookmark_id, "user_id": current_user["_id"]}
+    if not await sync.tombstone(db.sync_counters, db.bookmarks, "bookmarks", query):
         raise HTTPException(status_code=404, detail="Bookmark not found")
     return {"message": "Bookmark deleted successfully"}
 
+# Study search endpoints
+STUDY_SEARCH_TYPES = ("notes", "highlights", "bookmarks")
+
+def study_reference_filter(book: Optional[str], chapter_start: Optional[int], chapter_end: Optional[int]):
+    if book:
+        index = resolve_book(book)
+        start = references.verse_id(index, chapter_start or 0, 0)
+        stop = references.verse_id(index, chapter_end + 1, 0) if chapter_end else references.verse_id(index + 1, 0, 0)
+        return {"verse_id": {"$gte": start, "$lt": stop}}
+    query = {}
+    if chapter_start is not None or chapter_end is not None:
+        query["chapter"] = {}
+        if chapter_start is not None:
+            query["chapter"]["$gte"] = chapter_start
+        if chapter_end is not None:
+            query["chapter"]["$lte"] = chapter_end
+    return query
+
+async def search_study_collection(collection_name: str, user_id: str, q: str, reference_filter: dict, limit: int):
+    if collection_name == "bookmarks":
+        # Bookmarks have no text of their own, so only a query that reads as
+        # a reference or a book ("Jn 3", "Romans") finds them
+        try:
+            passage = references.parse(q)
+        except references.InvalidReference:
+            return []
+        query = sync.live({"user_id": user_id, "$and": [reference_filter, {"verse_id": passage.id_filter()}]})
+        cursor = db.bookmarks.find(query).sort("created_at", -1).limit(limit)
+        # Matching the whole query: about what a note containing each of its
+        # words once gets from the text index
+        score = float(len(q.split()))
+        return [("bookmark", doc, score) async for doc in cursor]
+
+    query = sync.live({"user_id": user_id, "$text": {"$search": q}, **reference_filter})
+    cursor = (
+        db[collection_name]
+        .find(query, {"score": {"$meta": "textScore"}})
+        .sort([("score", {"$meta": "textScore"})])
+        .limit(limit)
+    )
+    kind = collection_name[:-1]
+    return [(kind, doc, doc["score"]) async for doc in cursor]
+
+@api_router.get("/study/search", response_model=StudySearchPage)
+async def search_study(
+    q: str = Query(..., min_length=1, max_length=200),
+    types: str = Query(",".join(STUDY_SEARCH_TYPES), description="comma-separated: notes,highlights,bookmarks"),
+    book: Optional[str] = None,
+    chapter_start: Optional[int] = Query(None, ge=1),
+    chapter_end: Optional[int] = Query(None, ge=1),
+    reference: dict = Depends(passage_filter),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=1000),
+    current_user: dict = Depends(get_current_user),
+):
+    selected = [t for t in types.split(",") if t in STUDY_SEARCH_TYPES]
+    if not selected:
+        raise HTTPException(status_code=400, detail="No valid types requested")
+    reference_filter = reference or study_reference_filter(book, chapter_start, chapter_end)
+
+    # Each collection returns its own top offset+limit+1; merging those is
+    # enough to produce the requested page of the combined ranking.
+    per_type = offset + limit + 1
+    batches = await asyncio.gather(*(
+        search_study_collection(t, current_user["_id"], q, reference_filter, per_type)
+        for t in selected
+    ))
+    ranked = sorted(
+        (hit for batch in batches for hit in batch),
+        key=lambda hit: (-hit[2], hit[1]["created_at"]),
+    )
+    page = ranked[offset:offset + limit]
+    return fast_response({
+        "items": [
+            {
+                "type": kind,
+                "id": doc["_id"],
+                "book": doc["book"],
+                "chapter": doc["chapter"],
+                "verse": doc["verse"],
+                "title": doc.get("title"),
+                "text": doc.get("content", doc.get("text")),
+                "score": score,
+                "created_at": doc["created_at"],
+            }
+            for kind, doc, score in page
+        ],
+        "next_offset": offset + limit if len(ranked) > offset + limit else None,
+    })
+
+# Per-user data, so shared caches must not store it; browsers revalidate
+STUDY_OVERLAY_CACHE_CONTROL = "private, no-cache"
+
+@api_router.get("/study/overlay/{book}/{chapter}", response_model=StudyOverlay)
+async def get_study_overlay(book: str, chapter: int, request: Request, current_user: dict = Depends(get_current_user)):
+    index = resolve_book(book)
+    # Every write to these collections takes a new version from the user's sync
+    # counters, so the versions identify the overlay without aggregating it. A
+    # pending write may not be visible yet, so no validator is given meanwhile.
+    limits, _ = await sync.pull_state(db.sync_counters, current_user["_id"])
+    versions = [limits[kind] for kind in ("highlights", "bookmarks", "notes")]
+    etag = None
+    if None not in versions:
+        etag = f'W/"{index}.{chapter}.{".".join(map(str, versions))}"'
+        cached = not_modified(request, etag, STUDY_OVERLAY_CACHE_CONTROL)
+        if cached is not None:
+            return cached
+
+    passage = references.Passage(index, chapter, None, chapter)
+    match = {"$match": sync.live({"user_id": current_user["_id"], "verse_id": passage.id_filter()})}
+    order = {"$sort": {"verse_id": 1, "created_at": 1}}
+    # Each $match leads its branch, so all three collections are read through
+    # their (user_id, verse_id) index; $facet then splits them.
+    pipeline = [
+        match,
+        {"$set": {"_kind": "highlights"}},
+        {"$unionWith": {"coll": "bookmarks", "pipeline": [match, {"$set": {"_kind": "bookmarks"}}]}},
+        {"$unionWith": {"coll": "notes", "pipeline": [match, {"$set": {"_kind": "notes"}}]}},
+        {"$facet": {
+            kind: [{"$match": {"_kind": kind}}, order]
+            for kind in ("highlights", "bookmarks", "notes")
+        }},
+    ]
+    facets = (await db.highlights.aggregate(pipeline).to_list(1))[0]
+    overlay = {
+        "book": scripture.BIBLE_BOOKS[index],
+        "chapter": chapter,
+        "highlights": [highlight_response(doc) for doc in facets["highlights"]],
+        "bookmarks": [bookmark_response(doc) for doc in facets["bookmarks"]],
+        "notes": [note_response(doc) for doc in facets["notes"]],
+    }
+    if etag is None:
+        return ORJSONResponse(overlay, headers={"Cache-Control": STUDY_OVERLAY_CACHE_CONTROL})
+    return ORJSONResponse(overlay, headers={"ETag": etag, "Cache-Control": STUDY_OVERLAY_CACHE_CONTROL})
+
+# Reading progress endpoints
+@api_router.get("/progress", response_model=ReadingProgressSummary, response_model_exclude_none=True)
+async def get_reading_progress(current_user: dict = Depends(get_current_user)):
+    table = require_bible()
+    bits = await reading_progress.bits(current_user["_id"], table)
+    bounds = progress.book_bounds(table)
+    counts = progress.count_between(bits, bounds)
+    books = []
+    for index, name in enumerate(scripture.BIBLE_BOOKS):
+        read, verses = int(counts[index]), bounds[index + 1] - bounds[index]
+        books.append({"book": name, "read": read, "verses": verses, "percent": progress.percent(read, verses)})
+    read = int(counts.sum())
+    return {"read": read, "verses": table.verse_count, "percent": progress.percent(read, table.verse_count), "books": books}
+
+@api_router.get("/progress/{book}", response_model=BookProgress)
+async def get_book_progress(book: str, current_user: dict = Depends(get_current_user)):
+    table = require_bible()
+    index = resolve_book(book)
+    bits = await reading_progress.bits(current_user["_id"], table)
+    bounds = progress.chapter_bounds(table, index)
+    counts = progress.count_between(bits, bounds)
+    chapters = [
+        {"chapter": chapter, "read": int(read), "verses": bounds[chapter] - bounds[chapter - 1],
+         "percent": progress.percent(int(read), bounds[chapter] - bounds[chapter - 1])}
+        for chapter, read in enumerate(counts, start=1)
+    ]
+    read, verses = int(counts.sum()), bounds[-1] - bounds[0]
+    return {"book": scripture.BIBLE_BOOKS[index], "read": read, "verses": verses,
+            "percent": progress.percent(read, verses), "chapters": chapters}
+
+async def mark_chapter(book: str, chapter: int, verses: Optional[str], user_id: str, read: bool):
+    table = require_bible()
+    index = resolve_book(book)
+    count = table.verse_count_in(index, chapter)
+    if count == 0:
+        raise HTTPException(status_code=404, detail="Chapter not found")
+    start, end = parse_verse_range(verses) if verses else (1, count)
+    if end > count:
+        raise HTTPException(status_code=404, detail="Verses not found")
+    first = table.ordinal(index, chapter, 1)
+    bits = await reading_progress.mark(user_id, first + start - 1, first + end, table,
+                                       read=read, window=(first, first + count))
+    chapter_read = int(bits.sum())
+    return {"chapter": chapter, "read": chapter_read, "verses": count, "percent": progress.percent(chapter_read, count)}
+
+@api_router.post("/progress/{book}/{chapter}", response_model=ChapterProgress, dependencies=[Depends(rate_limit("write"))])
+async def mark_chapter_read(book: str, chapter: int, verses: Optional[str] = Query(None, description="N or N-M; the whole chapter by default"),
+                            current_user: dict = Depends(get_current_user)):
+    return await mark_chapter(book, chapter, verses, current_user["_id"], read=True)
+
+@api_router.delete("/progress/{book}/{chapter}", response_model=ChapterProgress, dependencies=[Depends(rate_limit("write"))])
+async def mark_chapter_unread(book: str, chapter: int, verses: Optional[str] = Query(None, description="N or N-M; the whole chapter by default"),
+                              current_user: dict = Depends(get_current_user)):
+    return await mark_chapter(book, chapter, verses, current_user["_id"], read=False)
+
 # Friends endpoints
 @api_router.get("/friends", response_model=List[FriendResponse])
-async def get_friends(current_user: dict = Depends(get_current_user)):
-    friends = await db.friends.find({"user_id": current_user["_id"], "status": "accepted"}).to_list(100)
-    friend_users = []
-    for friend in friends:
-        friend_user = await db.users.find_one({"_id": friend["friend_id"]})
-        if friend_user:
-            friend_users.append(
-                FriendResponse(
-                    id=friend_user["_id"],
-                    name=friend_user["name"],
-                    email=friend_user["email"],
-                    status="accepted"
-                )
-            )
-    return friend_users
+async def get_friends(current_user: dict = Depends(get_current_user), user_loader: BatchLoader = Depends(get_user_loader)):
+    friends = await db.friends.find(
+        {"user_id": current_user["_id"], "status": "accepted"}, {"friend_id": 1}
+    ).to_list(100)
+    friend_users = await user_loader.load_many(friend["friend_id"] for friend in friends)
+    return fast_response([
+        {"id": friend_user["_id"], "name": friend_user["name"], "email": friend_user["email"], "status": "accepted"}
+        for friend_user in friend_users
+        if friend_user
+    ])
 
 @api_router.get("/friends/requests", response_model=List[FriendResponse])
-async def get_friend_requests(current_user: dict = Depends(get_current_user)):
-    requests = await db.friends.find({"friend_id": current_user["_id"], "status": "pending"}).to_list(100)
-    request_users = []
-    for request in requests:
-        request_user = await db.users.find_one({"_id": request["user_id"]})
-        if request_user:
-            request_users.append(
-                FriendResponse(
-                    id=request_user["_id"],
-                    name=request_user["name"],
-                    email=request_user["email"],
-                    status="pending"
-                )
-            )
-    return request_users
-
-@api_router.post("/friends/request")
+async def get_friend_requests(current_user: dict = Depends(get_current_user), user_loader: BatchLoader = Depends(get_user_loader)):
+    requests = await db.friends.find(
+        {"friend_id": current_user["_id"], "status": "pending"}, {"user_id": 1}
+    ).to_list(100)
+    request_users = await user_loader.load_many(request["user_id"] for request in requests)
+    return fast_response([
+        {"id": request_user["_id"], "name": request_user["name"], "email": request_user["email"], "status": "pending"}
+        for request_user in request_users
+        if request_user
+    ])
+
+@api_router.post("/friends/request", dependencies=[Depends(rate_limit("write"))])
 async def send_friend_request(request: FriendRequestCreate, current_user: dict = Depends(get_current_user)):
     friend_user = await db.users.find_one({"email": request.friend_email})
     if not friend_user:
@@ -536,173 +1182,579 @@ async def send_friend_request(request: FriendRequestCreate, current_user: dict =
     return {"message": "Friend request sent successfully"}
 
 # Reminders endpoints
-@api_router.get("/reminders", response_model=List[ReminderResponse])
-async def get_reminders(current_user: dict = Depends(get_current_user)):
-    reminders = await db.reminders.find({"user_id": current_user["_id"]}).to_list(100)
-    return [
-        ReminderResponse(
-            id=reminder["_id"],
-            title=reminder["title"],
-            description=reminder["description"],
-            reminder_time=reminder["reminder_time"],
-            completed=reminder["completed"],
-            friend_id=reminder.get("friend_id"),
-            created_at=reminder["created_at"]
-        )
-        for reminder in reminders
-    ]
-
-@api_router.post("/reminders", response_model=ReminderResponse)
-async def create_reminder(reminder: ReminderCreate, current_user: dict = Depends(get_current_user)):
-    reminder_id = str(uuid.uuid4())
-    reminder_doc = {
-        "_id": reminder_id,
-        "user_id": current_user["_id"],
+def reminder_document(user_id: str, reminder: ReminderCreate, now: datetime, completed: bool = False) -> dict:
+    return {
+        "_id": str(uuid.uuid4()),
+        "user_id": user_id,
         "title": reminder.title,
         "description": reminder.description,
         "reminder_time": reminder.reminder_time,
-        "completed": False,
+        "completed": completed,
         "friend_id": reminder.friend_id,
-        "created_at": datetime.utcnow()
+        "created_at": now
     }
-    
-    await db.reminders.insert_one(reminder_doc)
-    
-    return ReminderResponse(
-        id=reminder_id,
-        title=reminder.title,
-        description=reminder.description,
-        reminder_time=reminder.reminder_time,
-        completed=False,
-        friend_id=reminder.friend_id,
-        created_at=reminder_doc["created_at"]
-    )
+
+reminder_response = Projection(ReminderResponse)
+
+@api_router.get("/reminders", response_model=ReminderPage)
+async def get_reminders(page: PageParams = Depends(), current_user: dict = Depends(get_current_user)):
+    cursor = find_page(db.reminders, sync.live({"user_id": current_user["_id"]}), page)
+    return await paginated_response(cursor, page, reminder_response)
+
+@api_router.post("/reminders", response_model=ReminderResponse, dependencies=[Depends(rate_limit("write"))])
+async def create_reminder(reminder: ReminderCreate, current_user: dict = Depends(get_current_user)):
+    reminder_doc = reminder_document(current_user["_id"], reminder, datetime.utcnow())
+    await insert_one_stamped("reminders", reminder_doc)
+    if reminder_scheduler is not None:
+        await reminder_scheduler.schedule(reminder_doc)
+    return reminder_response(reminder_doc)
 
 @api_router.post("/reminders/{reminder_id}/complete")
 async def complete_reminder(reminder_id: str, current_user: dict = Depends(get_current_user)):
-    result = await db.reminders.update_one(
-        {"_id": reminder_id, "user_id": current_user["_id"]},
-        {"$set": {"completed": True}}
-    )
+    async with sync.reserve_versions(db.sync_counters, current_user["_id"], "reminders") as version:
+        result = await db.reminders.update_one(
+            sync.live({"_id": reminder_id, "user_id": current_user["_id"]}),
+            {"$set": {"completed": True, "updated_at": datetime.utcnow(), "version": version}}
+        )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Reminder not found")
     return {"message": "Reminder completed successfully"}
 
-# Chat endpoints
-@api_router.get("/chats", response_model=List[ChatResponse])
-async def get_chats(current_user: dict = Depends(get_current_user)):
-    chats = await db.chats.find({"participants": current_user["_id"]}).to_list(100)
-    return [
-        ChatResponse(
-            id=chat["_id"],
-            participants=chat["participants"],
-            created_at=chat["created_at"]
+@api_router.delete("/reminders/{reminder_id}")
+async def delete_reminder(reminder_id: str, current_user: dict = Depends(get_current_user)):
+    query = {"_id": reminder_id, "user_id": current_user["_id"]}
+    if not await sync.tombstone(db.sync_counters, db.reminders, "reminders", query):
+        raise HTTPException(status_code=404, detail="Reminder not found")
+    return {"message": "Reminder deleted successfully"}
+
+# Offline sync (see sync.py)
+SYNC_SCHEMAS = {
+    "notes": (NoteCreate, note_document, note_response),
+    "highlights": (HighlightCreate, highlight_document, highlight_response),
+    "bookmarks": (BookmarkCreate, bookmark_document, bookmark_response),
+    "reminders": (ReminderCreate, reminder_document, reminder_response),
+}
+# Set by the server on every write, never taken from the client
+SYNC_SERVER_FIELDS = ("_id", "user_id", "created_at", "updated_at", "version", "deleted_at")
+
+def sync_fields(collection_name: str, user_id: str, change: SyncChange) -> dict:
+    model, build_document, _ = SYNC_SCHEMAS[collection_name]
+    item = model(**(change.data or {}))
+    if collection_name == "reminders":
+        doc = build_document(user_id, item, change.updated_at, completed=bool((change.data or {}).get("completed")))
+    else:
+        doc = build_document(user_id, item, change.updated_at)
+    return {k: v for k, v in doc.items() if k not in SYNC_SERVER_FIELDS}
+
+def sync_item(collection_name: str, doc: dict) -> dict:
+    item = SYNC_SCHEMAS[collection_name][2](doc)
+    item["updated_at"] = doc["updated_at"]
+    item["version"] = doc["version"]
+    return item
+
+@api_router.post("/sync", dependencies=[Depends(rate_limit("write"))])
+async def sync_study_data(body: SyncRequest, request: Request, current_user: dict = Depends(get_current_user)):
+    user_id = current_user["_id"]
+    unknown = set(body.versions) | set(body.changes)
+    unknown -= set(sync.SYNC_COLLECTIONS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown collections: {', '.join(sorted(unknown))}")
+
+    # Push: apply offline edits, newest updated_at wins
+    results = {}
+    now = datetime.utcnow()
+    for name, changes in body.changes.items():
+        if len(changes) > MAX_BATCH_SIZE:
+            raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_SIZE} {name} changes per request")
+        statuses = {}
+        valid = []
+        for change in changes:
+            # A fast client clock must not let its edits win forever
+            updated_at = min(to_naive_utc(change.updated_at), now)
+            change = change.model_copy(update={"updated_at": updated_at})
+            try:
+                fields = None if change.deleted else sync_fields(name, user_id, change)
+            except ValidationError as e:
+                problems = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+                statuses[change.id] = f"invalid: {problems}"
+                continue
+            valid.append((change.id, updated_at, fields))
+        if name == "reminders":
+            previous = await db.reminders.find(
+                {"_id": {"$in": [doc_id for doc_id, _, _ in valid]}, "user_id": user_id}, {"reminder_time": 1}
+            ).to_list(None)
+            previous_times = {doc["_id"]: doc["reminder_time"] for doc in previous}
+        statuses.update(await sync.apply_changes(db.sync_counters, db[name], name, user_id, valid))
+        results[name] = statuses
+        if name == "reminders":
+            # fields is what was stored: ReminderCreate has made reminder_time naive UTC
+            for doc_id, updated_at, fields in valid:
+                if fields is None or statuses[doc_id] != "applied":
+                    continue
+                if doc_id in previous_times and previous_times[doc_id] != fields["reminder_time"]:
+                    # Moved: due again at the new time even if it already fired
+                    await db.reminders.update_one(
+                        {"_id": doc_id, "reminder_time": fields["reminder_time"]}, {"$set": {"notified_at": None}}
+                    )
+                if reminder_scheduler is not None:
+                    await reminder_scheduler.schedule({"_id": doc_id, **fields})
+
+    # Pull: everything after the client's version vector, stopping short of
+    # writes that have reserved versions but not committed yet
+    limits, purged = await sync.pull_state(db.sync_counters, user_id)
+    versions = {}
+    changed = {}
+    deleted = {}
+    live_ids = {}
+    has_more = False
+    for name in sync.SYNC_COLLECTIONS:
+        since = body.versions.get(name, 0)
+        if 0 < since < purged.get(name, 0):
+            # Deletions this client has not seen may be purged: list what it
+            # may keep of what it already has
+            live_ids[name] = await sync.live_ids(db[name], user_id, since)
+        if limits[name] is None:
+            docs = []
+        else:
+            docs = await sync.changes_since(db[name], user_id, since, body.limit, until=limits[name])
+        has_more = has_more or len(docs) == body.limit
+        versions[name] = docs[-1]["version"] if docs else since
+        changed[name] = [sync_item(name, doc) for doc in docs if doc.get("deleted_at") is None]
+        deleted[name] = [doc["_id"] for doc in docs if doc.get("deleted_at") is not None]
+
+    payload = {
+        "versions": versions,
+        "changes": changed,
+        "deleted": deleted,
+        "live_ids": live_ids,
+        "results": results,
+        "has_more": has_more,
+    }
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        return Response(
+            sync.gzip_json(payload),
+            media_type="application/json",
+            headers={"Content-Encoding": "gzip", "Vary": "Accept-Encoding"},
         )
-        for chat in chats
-    ]
+    return fast_response(payload)
+
+# Notification endpoints
+notification_response = Projection(NotificationResponse)
+
+@api_router.get("/notifications", response_model=NotificationPage)
+async def get_notifications(page: PageParams = Depends(), current_user: dict = Depends(get_current_user)):
+    cursor = find_page(db.notifications, {"user_id": current_user["_id"]}, page)
+    return await paginated_response(cursor, page, notification_response)
 
-@api_router.post("/chats", response_model=ChatResponse)
+@api_router.post("/notifications/{notification_id}/read")
+async def mark_notification_read(notification_id: str, current_user: dict = Depends(get_current_user)):
+    result = await db.notifications.update_one(
+        {"_id": notification_id, "user_id": current_user["_id"]},
+        {"$set": {"read": True}}
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Notification not found")
+    return {"message": "Notification marked as read"}
+
+# Chat endpoints
+chat_response = Projection(ChatResponse)
+
+@api_router.get("/chats", response_model=ChatPage)
+async def get_chats(page: PageParams = Depends(), current_user: dict = Depends(get_current_user)):
+    cursor = find_page(db.chats, {"participants": current_user["_id"]}, page)
+    return await paginated_response(cursor, page, chat_response)
+
+@api_router.post("/chats", response_model=ChatResponse, dependencies=[Depends(rate_limit("write"))])
 async def create_chat(chat: ChatCreate, current_user: dict = Depends(get_current_user)):
     chat_id = str(uuid.uuid4())
     chat_doc = {
         "_id": chat_id,
         "participants": [current_user["_id"], chat.participant_id],
-        "created_at": datetime.utcnow()
+        "created_at": datetime.utcnow(),
+        "message_count": 0,
     }
     
     await db.chats.insert_one(chat_doc)
     
-    return ChatResponse(
-        id=chat_id,
-        participants=chat_doc["participants"],
-        created_at=chat_doc["created_at"]
+    return chat_response(chat_doc)
+
+chat_message_response = Projection(ChatMessageResponse)
+
+@api_router.get("/chats/summary", response_model=List[ChatSummary])
+async def get_chat_summaries(current_user: dict = Depends(get_current_user)):
+    user_id = current_user["_id"]
+    # One aggregation for the whole chat list. The last message is kept on
+    # the chat document; unread messages are counted in the buckets written
+    # to since the read marker, so archived history never counts as unread.
+    pipeline = [
+        {"$match": {"participants": user_id}},
+        {"$lookup": {
+            "from": "chat_buckets",
+            "let": {"chat_id": "$_id", "read_at": {"$ifNull": [f"$last_read.{user_id}", datetime.min]}},
+            "pipeline": [
+                {"$match": {"$expr": {"$and": [
+                    {"$eq": ["$chat_id", "$$chat_id"]},
+                    {"$gt": ["$last_at", "$$read_at"]},
+                ]}}},
+                {"$unwind": "$messages"},
+                {"$match": {"$expr": {"$and": [
+                    {"$gt": ["$messages.created_at", "$$read_at"]},
+                    {"$ne": ["$messages.sender_id", user_id]},
+                ]}}},
+                {"$count": "count"},
+            ],
+            "as": "unread",
+        }},
+        {"$addFields": {
+            "unread_count": {"$ifNull": [{"$arrayElemAt": ["$unread.count", 0]}, 0]},
+        }},
+        {"$addFields": {"last_activity": {"$ifNull": ["$last_message.created_at", "$created_at"]}}},
+        {"$sort": {"last_activity": -1, "_id": -1}},
+        {"$project": {"last_read": 0, "unread": 0, "message_count": 0}},
+    ]
+    summaries = []
+    async for chat in db.chats.aggregate(pipeline):
+        last_message = chat.get("last_message")
+        summaries.append({
+            "id": chat["_id"],
+            "participants": chat["participants"],
+            "created_at": chat["created_at"],
+            "unread_count": chat["unread_count"],
+            "last_message": chat_message_response(last_message) if last_message else None,
+        })
+    return fast_response(summaries)
+
+@api_router.post("/chats/{chat_id}/read")
+async def mark_chat_read(chat_id: str, marker: ChatReadMarker, current_user: dict = Depends(get_current_user)):
+    read_at = datetime.utcnow()
+    if marker.message_id:
+        message = await chat_store.find(chat_id, marker.message_id)
+        if not message:
+            raise HTTPException(status_code=404, detail="Message not found")
+        read_at = message["created_at"]
+
+    # $max keeps the marker from moving backwards when reads race
+    result = await db.chats.update_one(
+        {"_id": chat_id, "participants": current_user["_id"]},
+        {"$max": {f"last_read.{current_user['_id']}": read_at}}
     )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Chat not found")
+    return {"message": "Chat marked as read"}
 
-@api_router.get("/chats/{chat_id}/messages", response_model=List[ChatMessageResponse])
-async def get_chat_messages(chat_id: str, current_user: dict = Depends(get_current_user)):
-    chat = await db.chats.find_one({"_id": chat_id, "participants": current_user["_id"]})
+async def open_chat(chat_id: str, user_id: str) -> dict:
+    chat = await chat_store.open_chat(chat_id, user_id)
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
-    
-    messages = await db.chat_messages.find({"chat_id": chat_id}).to_list(100)
-    return [
-        ChatMessageResponse(
-            id=message["_id"],
-            sender_id=message["sender_id"],
-            content=message["content"],
-            created_at=message["created_at"]
-        )
-        for message in messages
-    ]
+    return chat
 
-@api_router.post("/chats/{chat_id}/messages", response_model=ChatMessageResponse)
+async def take(messages, limit: int) -> List[dict]:
+    docs = []
+    try:
+        async for doc in messages:
+            docs.append(doc)
+            if len(docs) == limit:
+                break
+    finally:
+        await messages.aclose()
+    return docs
+
+@api_router.get("/chats/{chat_id}/messages/since", response_model=ChatMessageDelta)
+async def sync_chat_messages(
+    chat_id: str,
+    message_id: Optional[str] = Query(None, description="Last message the client already has"),
+    after: Optional[datetime] = Query(None, description="Return messages created after this time"),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: dict = Depends(get_current_user)
+):
+    chat = await open_chat(chat_id, current_user["_id"])
+
+    if message_id:
+        anchor = await chat_store.find(chat_id, message_id)
+        if not anchor:
+            raise HTTPException(status_code=404, detail="Message not found")
+        position = anchor["n"]
+    elif after is not None:
+        position = await chat_store.position_before(chat, to_naive_utc(after))
+    else:
+        position = None
+
+    if position is None:
+        # No anchor: the most recent messages, oldest first
+        docs = await chat_store.latest(chat, limit)
+        has_more = False
+    else:
+        docs = await take(chat_store.messages_after(chat, position), limit + 1)
+        has_more = len(docs) > limit
+        docs = docs[:limit]
+    return fast_response({"items": [chat_message_response(doc) for doc in docs], "has_more": has_more})
+
+@api_router.get("/chats/{chat_id}/messages", response_model=ChatMessagePage)
+async def get_chat_messages(chat_id: str, page: PageParams = Depends(), current_user: dict = Depends(get_current_user)):
+    chat = await open_chat(chat_id, current_user["_id"])
+
+    # Messages page forward in chronological order. Cursors keep their
+    # (created_at, _id) form and are resolved to a message number.
+    position = 0
+    if page.after is not None:
+        created_at, message_id = page.after
+        anchor = await chat_store.find(chat_id, message_id)
+        position = anchor["n"] if anchor else await chat_store.position_before(chat, created_at)
+    docs = await take(chat_store.messages_after(chat, position), page.limit + 1)
+    next_cursor = encode_cursor(docs[page.limit - 1]) if len(docs) > page.limit else None
+    return fast_response({"items": [chat_message_response(doc) for doc in docs[:page.limit]], "next_cursor": next_cursor})
+
+async def create_chat_message(chat_id: str, sender_id: str, content: str) -> Optional[dict]:
+    message_doc = await chat_store.append(chat_id, sender_id, content)
+    if message_doc is not None:
+        await chat_broker.publish(chat_id, realtime.message_payload(message_doc))
+    return message_doc
+
+@api_router.post("/chats/{chat_id}/messages", response_model=ChatMessageResponse, dependencies=[Depends(rate_limit("chat"))])
 async def send_chat_message(chat_id: str, message: ChatMessageCreate, current_user: dict = Depends(get_current_user)):
-    chat = await db.chats.find_one({"_id": chat_id, "participants": current_user["_id"]})
-    if not chat:
+    # The participant check is part of the append
+    message_doc = await create_chat_message(chat_id, current_user["_id"], message.content)
+    if message_doc is None:
         raise HTTPException(status_code=404, detail="Chat not found")
-    
-    message_id = str(uuid.uuid4())
-    message_doc = {
-        "_id": message_id,
-        "chat_id": chat_id,
-        "sender_id": current_user["_id"],
-        "content": message.content,
-        "created_at": datetime.utcnow()
-    }
-    
-    await db.chat_messages.insert_one(message_doc)
-    
-    return ChatMessageResponse(
-        id=message_id,
-        sender_id=current_user["_id"],
-        content=message.content,
-        created_at=message_doc["created_at"]
-    )
+    return chat_message_response(message_doc)
+
+CHAT_RESUME_LIMIT = 500
+
+async def forward_chat_messages(websocket: WebSocket, subscriber: realtime.Subscriber, already_sent: set,
+                                not_before: Optional[datetime]):
+    while True:
+        message = await subscriber.next()
+        if message["id"] in already_sent:
+            continue
+        if not_before is not None and datetime.fromisoformat(message["created_at"]) < not_before:
+            continue
+        await websocket.send_json(message)
+
+async def receive_chat_messages(websocket: WebSocket, chat_id: str, user_id: str):
+    while True:
+        try:
+            data = await websocket.receive_json()
+        except (ValueError, KeyError):
+            # Not JSON, or a binary frame
+            await websocket.send_json({"error": "invalid_message"})
+            continue
+        content = (data.get("content") or "").strip() if isinstance(data, dict) else ""
+        if not content:
+            continue
+        try:
+            await rate_limiter.check("chat", user_id)
+        except ratelimit.RateLimited as e:
+            await websocket.send_json({"error": "rate_limited", "retry_after": e.retry_after})
+            continue
+        await create_chat_message(chat_id, user_id, content)
+
+@api_router.websocket("/chats/{chat_id}/ws")
+async def chat_websocket(websocket: WebSocket, chat_id: str, token: str = Query(...), last_message_id: Optional[str] = None):
+    # Browsers cannot set headers on WebSocket requests, so the JWT comes in
+    # the query string.
+    try:
+        user = await authenticate_token(token)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    chat = await chat_store.open_chat(chat_id, user["_id"])
+    if not chat:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+    # Subscribe before replaying history so nothing falls in between; the
+    # replayed ids are skipped if they also arrive live.
+    subscriber = chat_hub.subscribe(chat_id)
+    tasks = []
+    try:
+        already_sent = set()
+        not_before = None
+        if last_message_id:
+            anchor = await chat_store.find(chat_id, last_message_id)
+            if anchor:
+                already_sent.add(anchor["_id"])
+                not_before = anchor["created_at"]
+                # Everything up to the current count: later messages are
+                # already queued for the subscriber
+                chat = await chat_store.open_chat(chat_id, user["_id"])
+                docs = await take(chat_store.messages_after(chat, anchor["n"]), CHAT_RESUME_LIMIT + 1)
+                for doc in docs[:CHAT_RESUME_LIMIT]:
+                    already_sent.add(doc["_id"])
+                    await websocket.send_json(realtime.message_payload(doc))
+                if len(docs) > CHAT_RESUME_LIMIT:
+                    # The rest is for the client to fetch from /messages/since
+                    await websocket.send_json({"truncated": True, "resume_after": docs[CHAT_RESUME_LIMIT - 1]["_id"]})
+
+        tasks = [
+            asyncio.ensure_future(forward_chat_messages(websocket, subscriber, already_sent, not_before)),
+            asyncio.ensure_future(receive_chat_messages(websocket, chat_id, user["_id"])),
+        ]
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
+    except realtime.SlowConsumer:
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for task in tasks:
+            task.cancel()
+        chat_hub.unsubscribe(subscriber)
 
 # ChatGPT endpoints
-async def get_chatbot_response(message: str, context: str = None):
+def chatbot_error_message(e: Exception):
+    return f"I'm sorry, I'm having trouble connecting to my knowledge base right now. Please try again later. (Error: {str(e)})"
+
+def chatbot_usage(message: str, context: Optional[str], response: str) -> int:
+    return ratelimit.estimate_tokens(chatbot.SYSTEM_PROMPT, context, message, response)
+
+async def complete_chatbot(message: str, context: Optional[str], user_id: Optional[str]):
+    with metrics.track_upstream("openai", "complete"):
+        response = await chatbot.complete(openai_client, message, context)
+    # Only upstream calls count toward the quota, not cache hits
+    if user_id is not None:
+        await chatbot_quota.record(user_id, chatbot_usage(message, context, response))
+    return response
+
+async def get_chatbot_response(message: str, context: str = None, request: Request = None, cache_key: tuple = None,
+                               user_id: str = None):
+    if cache_key is not None:
+        # Cached answers are shared between users, so the upstream call is not
+        # abandoned on disconnect; concurrent identical requests wait on it.
+        try:
+            response = await chatbot_cache.get_or_load(
+                cache_key, lambda: complete_chatbot(message, context, user_id)
+            )
+            return {
+                "response": response,
+                "context": context
+            }
+        except Exception as e:
+            return {
+                "response": chatbot_error_message(e),
+                "context": context
+            }
+
+    completion = asyncio.ensure_future(complete_chatbot(message, context, user_id))
+    disconnected = False
     try:
-        system_prompt = """You are a helpful Bible study assistant. You help people understand Biblical passages, 
-        answer questions about Christian faith, and provide biblical guidance. Always be respectful and grounded in 
-        Biblical truth. If you don't know something, say so rather than making up information."""
-        
-        messages = [
-            {"role": "system", "content": system_prompt}
-        ]
-        
-        if context:
-            messages.append({"role": "user", "content": f"Context: {context}"})
-        
-        messages.append({"role": "user", "content": message})
-        
-        response = openai_client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=messages,
-            max_tokens=500,
-            temperature=0.7
-        )
-        
+        # Abandon the upstream call if the client goes away before it finishes
+        while not completion.done():
+            await asyncio.wait({completion}, timeout=0.5)
+            if request is not None and not completion.done() and await request.is_disconnected():
+                disconnected = True
+                completion.cancel()
+                break
+        response = await completion
         return {
-            "response": response.choices[0].message.content,
+            "response": response,
             "context": context
         }
+    except asyncio.CancelledError:
+        if not disconnected:
+            # We were cancelled ourselves (e.g. shutdown): stop the upstream call too
+            completion.cancel()
+            raise
+        raise HTTPException(status_code=499, detail="Client closed request")
     except Exception as e:
         return {
-            "response": f"I'm sorry, I'm having trouble connecting to my knowledge base right now. Please try again later. (Error: {str(e)})",
+            "response": chatbot_error_message(e),
             "context": context
         }
 
-@api_router.post("/chatbot/ask", response_model=ChatbotResponse)
-async def ask_chatbot(message: ChatbotMessage, current_user: dict = Depends(get_current_user)):
-    response = await get_chatbot_response(message.message, message.context)
+async def stream_chatbot_response(message: str, context: str, request: Request, cache_key: tuple = None,
+                                  user_id: str = None):
+    tokens = []
+    try:
+        if cache_key is not None:
+            cached = await chatbot_cache.get(cache_key)
+            if cached is not None:
+                yield chatbot.sse_event({"token": cached})
+                yield chatbot.sse_event({"context": context, "cached": True}, event="done")
+                return
+
+        with metrics.track_upstream("openai", "stream"):
+            upstream = chatbot.stream(openai_client, message, context)
+            try:
+                async for token in upstream:
+                    if await request.is_disconnected():
+                        return
+                    tokens.append(token)
+                    yield chatbot.sse_event({"token": token})
+            finally:
+                # Release the upstream connection now, not when the generator is collected
+                await upstream.aclose()
+
+        if cache_key is not None:
+            await chatbot_cache.set(cache_key, "".join(tokens))
+        yield chatbot.sse_event({"context": context}, event="done")
+    except Exception as e:
+        yield chatbot.sse_event({"response": chatbot_error_message(e)}, event="error")
+    finally:
+        # Charge what was generated, even if the client left part way
+        if tokens and user_id is not None:
+            await chatbot_quota.record(user_id, chatbot_usage(message, context, "".join(tokens)))
+
+def explain_verse_context(message: ChatbotMessage):
+    return f"Please explain this Bible verse: {message.context}" if message.context else None
+
+def explain_verse_cache_key(message: ChatbotMessage, context: Optional[str]):
+    if not message.book or message.chapter is None or message.verse is None:
+        return None
+    return verse_cache_key(
+        message.book,
+        message.chapter,
+        message.verse,
+        prompt_hash(chatbot.SYSTEM_PROMPT, message.message, context),
+        chatbot.CHATBOT_MODEL,
+    )
+
+@api_router.post("/chatbot/ask", response_model=ChatbotResponse, dependencies=CHATBOT_LIMITS)
+async def ask_chatbot(message: ChatbotMessage, request: Request, current_user: dict = Depends(get_current_user)):
+    response = await get_chatbot_response(message.message, message.context, request, user_id=current_user["_id"])
     return response
 
-@api_router.post("/chatbot/explain-verse", response_model=ChatbotResponse)
-async def explain_verse(message: ChatbotMessage, current_user: dict = Depends(get_current_user)):
-    context = f"Please explain this Bible verse: {message.context}" if message.context else None
-    response = await get_chatbot_response(message.message, context)
+@api_router.post("/chatbot/ask/stream", dependencies=CHATBOT_LIMITS)
+async def ask_chatbot_stream(message: ChatbotMessage, request: Request, current_user: dict = Depends(get_current_user)):
+    return StreamingResponse(
+        stream_chatbot_response(message.message, message.context, request, user_id=current_user["_id"]),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@api_router.post("/chatbot/explain-verse", response_model=ChatbotResponse, dependencies=CHATBOT_LIMITS)
+async def explain_verse(message: ChatbotMessage, request: Request, current_user: dict = Depends(get_current_user)):
+    context = explain_verse_context(message)
+    response = await get_chatbot_response(
+        message.message, context, request, cache_key=explain_verse_cache_key(message, context),
+        user_id=current_user["_id"],
+    )
     return response
 
+@api_router.post("/chatbot/explain-verse/stream", dependencies=CHATBOT_LIMITS)
+async def explain_verse_stream(message: ChatbotMessage, request: Request, current_user: dict = Depends(get_current_user)):
+    context = explain_verse_context(message)
+    return StreamingResponse(
+        stream_chatbot_response(
+            message.message, context, request, cache_key=explain_verse_cache_key(message, context),
+            user_id=current_user["_id"],
+        ),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@api_router.get("/chatbot/quota", response_model=ChatbotQuota)
+async def get_chatbot_quota(current_user: dict = Depends(get_current_user)):
+    now = datetime.utcnow()
+    used = await chatbot_quota.used(current_user["_id"], now)
+    return {
+        "limit": chatbot_quota.limit,
+        "used": used,
+        "remaining": max(0, chatbot_quota.limit - used) if chatbot_quota.limit else None,
+        "resets_at": chatbot_quota.resets_at(now),
+    }
+
 # Include the API router
 app.include_router(api_router)
 
@@ -713,11 +1765,181 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
+async def startup_clients():
+    global client, db, openai_client, chatbot_cache, reading_progress, chat_store, password_hasher, rate_limiter, \
+        chatbot_quota
+    # A harness may have supplied its own client (see benchmarks/load_test.py)
+    if client is None:
+        client = AsyncIOMotorClient(MONGO_URL, event_listeners=[metrics.MongoCommandMetrics()])
+    db = client[DB_NAME]
+    openai_client = chatbot.create_openai_client()
+    chatbot_cache = ResponseCache(
+        collection=db.chatbot_cache if CHATBOT_CACHE_MONGO else None,
+        max_entries=int(os.environ.get('CHATBOT_CACHE_SIZE', 2048)),
+        ttl_seconds=int(os.environ.get('CHATBOT_CACHE_TTL', 7 * 24 * 3600)),
+    )
+    reading_progress = progress.ProgressStore(db.reading_progress)
+    chat_store = chatstore.ChatStore(db.chats, db.chat_buckets, db.chat_archive, legacy=db.chat_messages)
+    password_hasher = PasswordHasher(
+        CryptContext(schemes=["bcrypt"], deprecated="auto"),
+        max_workers=int(os.environ.get('HASH_WORKERS', 4)),
+        max_queue=int(os.environ.get('HASH_MAX_QUEUE', 64)),
+    )
+    rate_limiter = ratelimit.RateLimiter(
+        ratelimit.create_buckets(RATE_LIMIT_BACKEND, db.rate_limits), RATE_LIMIT_POLICIES,
+    )
+    chatbot_quota = ratelimit.DailyQuota(
+        int(os.environ.get('CHATBOT_DAILY_TOKENS', 50000)),
+        collection=db.chatbot_usage if RATE_LIMIT_BACKEND == 'mongo' else None,
+    )
+
+async def startup_loop_monitor():
+    await loop_monitor.start()
+
+async def startup_bible():
+    global bible, search_index, related_index
+    if not os.path.exists(BIBLE_PATH):
+        logger.warning("No Bible text at %s; /api/bible/{book}/{chapter} is disabled", BIBLE_PATH)
+        return
+    bible = scripture.load(BIBLE_PATH)
+    logger.info("Loaded %d verses from %s", bible.verse_count, BIBLE_PATH)
+
+    search_index = await load_search_index(bible)
+
+    # Too slow to build at startup; see related.py for the offline build
+    if os.path.exists(RELATED_PATH):
+        related_index = related.RelatedIndex.open(RELATED_PATH)
+        if related_index.version != bible.version:
+            logger.warning("Related verses at %s were built for another text; rebuild them", RELATED_PATH)
+            related_index = None
+    else:
+        logger.warning("No related verses at %s; /api/bible/{book}/{chapter}/{verse}/related is disabled", RELATED_PATH)
+
+def open_search_index(version: str) -> Optional[search.SearchIndex]:
+    if not os.path.exists(SEARCH_INDEX_PATH):
+        return None
+    index = search.SearchIndex.open(SEARCH_INDEX_PATH)
+    return index if index.version == version else None
+
+async def load_search_index(table, poll_seconds: float = 1.0) -> search.SearchIndex:
+    """Open the compiled search index, building it to disk first if it is
+    missing or stale. One worker builds under a lease while the others wait
+    for the file, so every worker maps the same pages rather than each
+    building its own copy in memory."""
+    lease = reminders.Lease(db.scheduler_leases, "search_index", ttl_seconds=SEARCH_BUILD_LEASE_SECONDS)
+    while True:
+        index = open_search_index(table.version)
+        if index is not None:
+            return index
+        if not await lease.acquire():
+            await asyncio.sleep(poll_seconds)
+            continue
+        try:
+            # Another worker may have finished while we waited
+            index = open_search_index(table.version)
+            if index is not None:
+                return index
+            logger.warning("Search index at %s is missing or stale; building it", SEARCH_INDEX_PATH)
+            index = search.build_for_bible(table)
+            try:
+                index.save(SEARCH_INDEX_PATH)
+            except OSError:
+                logger.exception("Could not write the search index to %s; serving it from memory", SEARCH_INDEX_PATH)
+                return index
+        finally:
+            await lease.release()
+
+async def startup_chat_broker():
+    global chat_broker
+    chat_broker = realtime.create_broker(CHAT_BROKER, chat_hub, db.chat_buckets)
+    await chat_broker.start()
+
+async def startup_indexes():
+    if os.environ.get('ENSURE_INDEXES', '1').lower() not in ('0', 'false', 'no'):
+        try:
+            await ensure_indexes(db)
+        except Exception:
+            # e.g. duplicate emails blocking the unique index; keep serving
+            logger.exception("Index reconciliation failed")
+    await chatbot_cache.ensure_indexes()
+    await rate_limiter.buckets.ensure_indexes()
+    await chatbot_quota.ensure_indexes()
+    try:
+        backfilled = await sync.backfill_versions(db)
+        if backfilled:
+            logger.info("Stamped sync versions on %d existing documents", backfilled)
+    except Exception:
+        logger.exception("Sync version backfill failed")
+    try:
+        migrated = await references.backfill_verse_ids(db)
+        if migrated:
+            logger.info("Added verse ids to %d existing documents", migrated)
+    except Exception:
+        logger.exception("Verse id backfill failed")
+    try:
+        # Held for longer than the copy should take; a worker that dies
+        # mid-copy leaves it to the next startup after the lease expires
+        lease = reminders.Lease(db.scheduler_leases, "chat_migration", ttl_seconds=3600)
+        migrated = await chatstore.migrate_legacy_messages(chat_store, db.migrations, lease=lease)
+        if migrated:
+            logger.info("Moved the messages of %d chats into buckets", migrated)
+    except Exception:
+        # Chats left over are migrated when first opened
+        logger.exception("Chat bucket migration failed")
+
+async def startup_reminder_scheduler():
+    global reminder_scheduler
+    if not REMINDER_SCHEDULER:
+        return
+    reminder_scheduler = reminders.ReminderScheduler(
+        db.reminders,
+        db.notifications,
+        lease=reminders.Lease(db.scheduler_leases, "reminders", ttl_seconds=30),
+        max_lateness=timedelta(hours=float(os.environ.get('REMINDER_MAX_LATENESS_HOURS', 24))),
+    )
+    await reminder_scheduler.start()
+
+async def startup_chat_archiver():
+    global chat_archiver
+    if not CHAT_ARCHIVE_AFTER_DAYS:
+        return
+    interval = float(os.environ.get('CHAT_ARCHIVE_INTERVAL', 3600))
+    chat_archiver = chatstore.ChatArchiver(
+        chat_store,
+        max_age=timedelta(days=CHAT_ARCHIVE_AFTER_DAYS),
+        lease=reminders.Lease(db.scheduler_leases, "chat_archiver", ttl_seconds=interval),
+        interval=interval,
+    )
+    await chat_archiver.start()
+
+async def startup_tombstone_purger():
+    global tombstone_purger
+    if not SYNC_TOMBSTONE_DAYS:
+        return
+    interval = float(os.environ.get('SYNC_PURGE_INTERVAL', 24 * 3600))
+    tombstone_purger = sync.TombstonePurger(
+        db,
+        retention=timedelta(days=SYNC_TOMBSTONE_DAYS),
+        lease=reminders.Lease(db.scheduler_leases, "sync_purge", ttl_seconds=interval),
+        interval=interval,
+    )
+    await tombstone_purger.start()
+
+async def shutdown_clients():
+    # Background tasks first: they still talk to Mongo, OpenAI and the hasher
+    await loop_monitor.stop()
+    if chat_archiver is not None:
+        await chat_archiver.stop()
+    if tombstone_purger is not None:
+        await tombstone_purger.stop()
+    if reminder_scheduler is not None:
+        await reminder_scheduler.stop()
+    await chat_broker.stop()
+    await openai_client.close()
+    password_hasher.shutdown()
     client.close()
 
-# Server startup
+# Development server: one process with no import budget check; see serve.py
 if __name__ == "__main__":
     import uvicorn
     port = int(os.environ.get("PORT", 8001))
@@ -0,0 +1,306 @@
+"""Offline sync for notes, highlights, bookmarks and reminders.
+
+Every write stamps the document with ``version``, taken from a per-user
+counter for that collection in ``sync_counters``, so a client can describe
+what it already has as a version vector (``{"notes": 41, "reminders": 7}``)
+and fetch only what changed since. Deletes are soft: the document stays as a
+tombstone with ``deleted_at`` set and a new version, and every regular read
+filters on ``LIVE``.
+
+Offline edits are uploaded with the client's ``updated_at`` and applied with
+last-writer-wins: a change only replaces the stored document when it is newer.
+
+Versions are reserved before the write that uses them, so two writes can
+commit out of version order. Each reservation is listed under ``pending`` on
+the counter document until its write has finished, and a pull returns
+nothing newer for a collection that has a pending write. A client therefore
+never moves its cursor past a version that has yet to commit. Reservations
+left by a worker that died mid-write stop counting after ``PENDING_TIMEOUT``.
+
+Tombstones older than the retention period are purged by ``TombstonePurger``,
+which first records the highest purged version per user as ``purged``. A
+client whose cursor is below it may have missed deletions, so its pull also
+lists the ids of every live document at or below its cursor (``live_ids``):
+anything else it holds from before was deleted.
+"""
+import asyncio
+import gzip
+import logging
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import orjson
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+
+SYNC_COLLECTIONS = ("notes", "highlights", "bookmarks", "reminders")
+
+# Matches documents without a tombstone, including ones written before sync
+LIVE = {"deleted_at": None}
+
+_DUPLICATE_KEY = 11000
+PENDING_TIMEOUT = timedelta(seconds=30)
+
+logger = logging.getLogger(__name__)
+
+
+def live(query: dict) -> dict:
+    return {**query, **LIVE}
+
+
+async def allocate_versions(counters, user_id: str, collection: str, count: int = 1) -> int:
+    """Reserve ``count`` consecutive versions and return the first."""
+    doc = await counters.find_one_and_update(
+        {"_id": user_id},
+        {"$inc": {collection: count}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return doc[collection] - count + 1
+
+
+@asynccontextmanager
+async def reserve_versions(counters, user_id: str, collection: str, count: int = 1) -> AsyncIterator[int]:
+    """Reserve ``count`` consecutive versions for a write made inside the
+    block, which holds back pulls of ``collection`` until it exits."""
+    token = uuid.uuid4().hex
+    doc = await counters.find_one_and_update(
+        {"_id": user_id},
+        {"$inc": {collection: count}, "$set": {f"pending.{collection}.{token}": datetime.utcnow()}},
+        projection={collection: 1},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    try:
+        yield doc[collection] - count + 1
+    finally:
+        await counters.update_one({"_id": user_id}, {"$unset": {f"pending.{collection}.{token}": ""}})
+
+
+async def pull_state(counters, user_id: str) -> Tuple[Dict[str, Optional[int]], Dict[str, int]]:
+    """``(limits, purged)`` per collection: the highest version a pull may
+    return now (None while a write is pending), and the highest version
+    whose tombstones were purged."""
+    doc = await counters.find_one({"_id": user_id}) or {}
+    expired_before = datetime.utcnow() - PENDING_TIMEOUT
+    limits = {}
+    expired = {}
+    for name in SYNC_COLLECTIONS:
+        waiting = False
+        for token, reserved_at in ((doc.get("pending") or {}).get(name) or {}).items():
+            if reserved_at < expired_before:
+                expired[f"pending.{name}.{token}"] = ""
+            else:
+                waiting = True
+        # Versions above the counter are reserved after this read, so they
+        # are held back as well
+        limits[name] = None if waiting else doc.get(name, 0)
+    if expired:
+        await counters.update_one({"_id": user_id}, {"$unset": expired})
+    return limits, dict(doc.get("purged") or {})
+
+
+async def live_ids(collection, user_id: str, through: int) -> List[str]:
+    cursor = collection.find(live({"user_id": user_id, "version": {"$lte": through}}), {"_id": 1})
+    return [doc["_id"] async for doc in cursor]
+
+
+def stamp(docs: List[dict], first: int, now: datetime):
+    for offset, doc in enumerate(docs):
+        doc["version"] = first + offset
+        doc["updated_at"] = now
+
+
+async def tombstone(counters, collection, collection_name: str, query: dict) -> bool:
+    now = datetime.utcnow()
+    async with reserve_versions(counters, query["user_id"], collection_name) as version:
+        result = await collection.update_one(
+            live(query), {"$set": {"deleted_at": now, "updated_at": now, "version": version}}
+        )
+    return result.matched_count > 0
+
+
+async def apply_changes(counters, collection, collection_name: str, user_id: str,
+                        changes: List[Tuple[str, datetime, Optional[dict]]]) -> Dict[str, str]:
+    """Apply ``(id, updated_at, fields)`` changes with last-writer-wins.
+
+    ``fields`` is None for a deletion. Returns ``{id: "applied" | "conflict"}``.
+    """
+    if not changes:
+        return {}
+    async with reserve_versions(counters, user_id, collection_name, len(changes)) as first:
+        return await _apply_changes(collection, user_id, changes, first)
+
+
+async def _apply_changes(collection, user_id: str, changes: List[Tuple[str, datetime, Optional[dict]]],
+                         first: int) -> Dict[str, str]:
+    operations = []
+    for offset, (doc_id, updated_at, fields) in enumerate(changes):
+        update = {"version": first + offset, "updated_at": updated_at}
+        if fields is None:
+            update["deleted_at"] = updated_at
+        else:
+            update.update(fields)
+            update["deleted_at"] = None
+        # The upsert inserts when the id is new; when it exists but is newer
+        # (or belongs to someone else) the filter misses and the insert fails
+        # with a duplicate key, which is the conflict case.
+        operations.append(UpdateOne(
+            {"_id": doc_id, "user_id": user_id,
+             "$or": [{"updated_at": {"$lt": updated_at}}, {"updated_at": None}]},
+            {"$set": update, "$setOnInsert": {"created_at": updated_at}},
+            upsert=True,
+        ))
+
+    conflicts = set()
+    try:
+        await collection.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        for error in e.details["writeErrors"]:
+            if error["code"] != _DUPLICATE_KEY:
+                raise
+            conflicts.add(error["index"])
+    return {
+        doc_id: "conflict" if i in conflicts else "applied"
+        for i, (doc_id, _, _) in enumerate(changes)
+    }
+
+
+async def changes_since(collection, user_id: str, since: int, limit: int,
+                        until: Optional[int] = None) -> List[dict]:
+    """Changes after version ``since`` up to ``until`` (see ``pull_state``)."""
+    if until is not None and until <= since:
+        return []
+    version = {"$gt": since}
+    if until is not None:
+        version["$lte"] = until
+    cursor = (
+        collection.find({"user_id": user_id, "version": version})
+        .sort("version", 1)
+        .limit(limit)
+    )
+    return await cursor.to_list(limit)
+
+
+def gzip_json(content) -> bytes:
+    return gzip.compress(orjson.dumps(content), compresslevel=6)
+
+
+BACKFILL_MARKER = "__backfill__"
+
+
+async def backfill_versions(db, batch_size: int = 1000) -> int:
+    """Stamp versions on documents written before sync existed. Runs once."""
+    if await db.sync_counters.find_one({"_id": BACKFILL_MARKER}):
+        return 0
+    total = 0
+    for name in SYNC_COLLECTIONS:
+        while True:
+            docs = await db[name].find(
+                {"version": None}, {"user_id": 1, "created_at": 1, "updated_at": 1}
+            ).limit(batch_size).to_list(batch_size)
+            if not docs:
+                break
+            by_user: Dict[str, List[dict]] = {}
+            for doc in docs:
+                by_user.setdefault(doc["user_id"], []).append(doc)
+            operations = []
+            for user_id, user_docs in by_user.items():
+                first = await allocate_versions(db.sync_counters, user_id, name, len(user_docs))
+                for offset, doc in enumerate(user_docs):
+                    operations.append(UpdateOne(
+                        {"_id": doc["_id"], "version": None},
+                        {"$set": {"version": first + offset, "updated_at": doc.get("updated_at") or doc["created_at"]}},
+                    ))
+            await db[name].bulk_write(operations, ordered=False)
+            total += len(docs)
+    await db.sync_counters.update_one(
+        {"_id": BACKFILL_MARKER}, {"$set": {"completed_at": datetime.utcnow(), "documents": total}}, upsert=True
+    )
+    return total
+
+
+async def purge_tombstones(db, older_than: datetime, batch_size: int = 1000) -> int:
+    """Delete tombstones from before ``older_than``. The highest purged version
+    per user is recorded first, so a crash in between only over-resets."""
+    total = 0
+    query = {"deleted_at": {"$type": "date", "$lt": older_than}}
+    for name in SYNC_COLLECTIONS:
+        while True:
+            docs = await db[name].find(query, {"user_id": 1, "version": 1}).limit(batch_size).to_list(batch_size)
+            if not docs:
+                break
+            highest: Dict[str, int] = {}
+            for doc in docs:
+                highest[doc["user_id"]] = max(highest.get(doc["user_id"], 0), doc.get("version") or 0)
+            await db.sync_counters.bulk_write([
+                UpdateOne({"_id": user_id}, {"$max": {f"purged.{name}": version}}, upsert=True)
+                for user_id, version in highest.items()
+            ], ordered=False)
+            # Re-checked: a sync may have revived a document since it was read
+            result = await db[name].delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}, **query})
+            total += result.deleted_count
+            if len(docs) < batch_size:
+                break
+    return total
+
+
+class TombstonePurger:
+    """Runs ``purge_tombstones`` for tombstones older than ``retention`` every
+    ``interval`` seconds on the worker holding ``lease``."""
+
+    def __init__(self, db, retention: timedelta, lease=None, interval: float = 24 * 3600):
+        self.db = db
+        self.retention = retention
+        self.lease = lease
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self.is_leader = lease is None
+        self.purged = 0
+        self.runs = 0
+        self.last_run: Optional[datetime] = None
+
+    async def start(self):
+        self._task = asyncio.ensure_future(self._run_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self.lease is not None and self.is_leader:
+            await self.lease.release()
+
+    async def _run_forever(self):
+        while True:
+            try:
+                if self.lease is not None:
+                    self.is_leader = await self.lease.acquire()
+                if self.is_leader:
+                    await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Tombstone purge failed")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> int:
+        purged = await purge_tombstones(self.db, datetime.utcnow() - self.retention)
+        if purged:
+            logger.info("Purged %d sync tombstones", purged)
+        self.purged += purged
+        self.runs += 1
+        self.last_run = datetime.utcnow()
+        return purged
+
+    def stats(self) -> dict:
+        return {
+            "leader": self.is_leader,
+            "runs": self.runs,
+            "purged": self.purged,
+            "last_run": self.last_run.isoformat() if self.last_run else None,
+        }
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+# The backend modules import each other as top-level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """The app against an in-memory Mongo, with background tasks off."""
+    from fastapi.testclient import TestClient
+    from mongomock_motor import AsyncMongoMockClient
+
+    import server
+
+    monkeypatch.setattr(server, "client", AsyncMongoMockClient())
+    monkeypatch.setattr(server, "RATE_LIMIT_POLICIES", {})
+    monkeypatch.setattr(server, "REMINDER_SCHEDULER", False)
+    monkeypatch.setattr(server, "CHAT_ARCHIVE_AFTER_DAYS", 0)
+    monkeypatch.setattr(server, "SYNC_TOMBSTONE_DAYS", 0)
+    with TestClient(server.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def login(client):
+    """Register and log in ``name``; returns auth headers and the user id."""
+    def login(name):
+        client.post("/api/auth/register", json={"name": name, "email": f"{name}@example.com", "password": "pw"})
+        token = client.post("/api/auth/login", json={"email": f"{name}@example.com", "password": "pw"}).json()
+        headers = {"Authorization": f"Bearer {token['access_token']}"}
+        return headers, client.get("/api/auth/me", headers=headers).json()["id"]
+    return login
@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from cache import LRUCache, ResponseCache, verse_cache_key
+
+
+def test_verse_keys_use_the_canonical_book():
+    keys = {verse_cache_key(book, 3, 16, "digest", "model") for book in ("John", "jn", "JOHN", " john ")}
+    assert keys == {(43003016, "digest", "model")}
+    assert verse_cache_key("1 Cor", 13, 4, "d", "m") == verse_cache_key("1 Corinthians", 13, 4, "d", "m")
+    assert verse_cache_key("Hezekiah", 1, 1, "d", "m") is None
+
+
+def test_lru_evicts_oldest():
+    cache = LRUCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
+    assert cache.evictions == 1
+
+
+def test_concurrent_misses_share_one_load():
+    cache = ResponseCache()
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    async def run():
+        return await asyncio.gather(*(cache.get_or_load(("k",), loader) for _ in range(3)))
+
+    assert asyncio.run(run()) == ["answer"] * 3
+    assert len(calls) == 1
+    assert cache.stats()["coalesced"] == 2
+
+
+def test_waiters_survive_the_first_caller_being_cancelled():
+    cache = ResponseCache()
+    release = None
+
+    async def loader():
+        await release.wait()
+        return "answer"
+
+    async def run():
+        nonlocal release
+        release = asyncio.Event()
+        first = asyncio.ensure_future(cache.get_or_load(("k",), loader))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(cache.get_or_load(("k",), loader))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second, await cache.get(("k",))
+
+    assert asyncio.run(run()) == ("answer", "answer")
+
+
+def test_failed_load_reaches_every_waiter_and_is_not_cached():
+    cache = ResponseCache()
+
+    async def loader():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream down")
+
+    async def run():
+        results = await asyncio.gather(*(cache.get_or_load(("k",), loader) for _ in range(2)),
+                                       return_exceptions=True)
+        return results, await cache.get(("k",))
+
+    results, cached = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert cached is None
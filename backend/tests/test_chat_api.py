@@ -0,0 +1,63 @@
+from datetime import timedelta, timezone
+
+import pytest
+
+import server
+
+
+@pytest.fixture
+def chat(client, login):
+    alice, _ = login("alice")
+    bob, bob_id = login("bob")
+    chat_id = client.post("/api/chats", json={"participant_id": bob_id}, headers=alice).json()["id"]
+    return chat_id, alice, bob
+
+
+def send(client, chat_id, headers, content):
+    response = client.post(f"/api/chats/{chat_id}/messages", json={"content": content}, headers=headers)
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_since_after_converts_offsets_to_utc(client, chat):
+    chat_id, alice, bob = chat
+    first = send(client, chat_id, alice, "one")
+    send(client, chat_id, bob, "two")
+    send(client, chat_id, alice, "three")
+
+    naive = first["created_at"]
+    local = server.datetime.fromisoformat(naive).replace(tzinfo=timezone.utc).astimezone(timezone(timedelta(hours=2)))
+    for after in (naive, local.isoformat()):
+        response = client.get(f"/api/chats/{chat_id}/messages/since", params={"after": after}, headers=bob)
+        assert [m["content"] for m in response.json()["items"]] == ["one", "two", "three"]
+
+
+def socket_url(chat_id, headers, **params):
+    token = headers["Authorization"].split()[1]
+    query = "&".join(f"{key}={value}" for key, value in {"token": token, **params}.items())
+    return f"/api/chats/{chat_id}/ws?{query}"
+
+
+def test_socket_survives_non_json_frames(client, chat):
+    chat_id, alice, _ = chat
+    with client.websocket_connect(socket_url(chat_id, alice)) as websocket:
+        websocket.send_text("not json")
+        assert websocket.receive_json() == {"error": "invalid_message"}
+        websocket.send_bytes(b"\x00")
+        assert websocket.receive_json() == {"error": "invalid_message"}
+        websocket.send_json({"content": "still here"})
+        assert websocket.receive_json()["content"] == "still here"
+
+
+def test_socket_replay_marks_truncation(client, chat, monkeypatch):
+    monkeypatch.setattr(server, "CHAT_RESUME_LIMIT", 2)
+    chat_id, alice, bob = chat
+    anchor = send(client, chat_id, alice, "seen")
+    sent = [send(client, chat_id, alice, str(i)) for i in range(3)]
+
+    with client.websocket_connect(socket_url(chat_id, bob, last_message_id=anchor["id"])) as websocket:
+        assert [websocket.receive_json()["content"] for _ in range(2)] == ["0", "1"]
+        assert websocket.receive_json() == {"truncated": True, "resume_after": sent[1]["id"]}
+
+    rest = client.get(f"/api/chats/{chat_id}/messages/since", params={"message_id": sent[1]["id"]}, headers=bob)
+    assert [m["content"] for m in rest.json()["items"]] == ["2"]
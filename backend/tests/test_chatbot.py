@@ -0,0 +1,133 @@
+import asyncio
+import functools
+import socket
+import threading
+import time
+
+import openai
+import pytest
+import uvicorn
+from fastapi import HTTPException
+
+import chatbot
+import fake_openai
+import server
+
+
+@pytest.fixture(scope="module")
+def fake_openai_url():
+    """fake_openai.py served on a local port, as in manual testing."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    fake = uvicorn.Server(uvicorn.Config(fake_openai.app, host="127.0.0.1", port=port, log_level="warning",
+                                         timeout_graceful_shutdown=0))
+    thread = threading.Thread(target=fake.run, daemon=True)
+    thread.start()
+    while not fake.started:
+        time.sleep(0.01)
+    yield f"http://127.0.0.1:{port}/v1"
+    fake.should_exit = True
+    thread.join()
+
+
+@pytest.fixture
+def upstream(fake_openai_url, monkeypatch):
+    monkeypatch.setenv("OPENAI_BASE_URL", fake_openai_url)
+    monkeypatch.setattr(fake_openai, "TOKEN_DELAY", 0.01)
+    monkeypatch.setattr(fake_openai, "FAILURES", 0)
+    monkeypatch.setattr(fake_openai, "requests_seen", 0)
+    return fake_openai
+
+
+class FakeRequest:
+    """Reports a disconnect once ``is_disconnected`` has been polled ``after`` times."""
+
+    def __init__(self, after):
+        self.after = after
+        self.polls = 0
+
+    async def is_disconnected(self):
+        self.polls += 1
+        return self.polls > self.after
+
+
+def with_client(coroutine_function):
+    async def run():
+        server.openai_client = chatbot.create_openai_client()
+        try:
+            return await coroutine_function()
+        finally:
+            await server.openai_client.close()
+            server.openai_client = None
+    return asyncio.run(run())
+
+
+def test_failed_request_is_retried(upstream):
+    upstream.FAILURES = 1
+
+    result = with_client(lambda: server.get_chatbot_response("Who wrote Romans?"))
+
+    assert result["response"] == "This is a fake answer to: Who wrote Romans?"
+    assert upstream.requests_seen == 2
+
+
+def test_timeout_becomes_an_error_answer(upstream, monkeypatch):
+    upstream.TOKEN_DELAY = 1
+    monkeypatch.setattr(chatbot, "complete", functools.partial(chatbot.complete, timeout=0.2))
+
+    result = with_client(lambda: server.get_chatbot_response("Who wrote Romans?"))
+
+    assert result["response"] == server.chatbot_error_message(openai.APITimeoutError(request=None))
+    # The client retries once before giving up
+    assert upstream.requests_seen == 2
+
+
+def test_disconnect_abandons_the_completion(upstream):
+    upstream.TOKEN_DELAY = 1
+
+    async def ask():
+        return await server.get_chatbot_response("Who wrote Romans?", request=FakeRequest(after=0))
+
+    with pytest.raises(HTTPException) as raised:
+        with_client(ask)
+    assert raised.value.status_code == 499
+
+
+def test_cancellation_without_disconnect_propagates(upstream):
+    upstream.TOKEN_DELAY = 1
+
+    async def ask():
+        task = asyncio.ensure_future(server.get_chatbot_response("Who wrote Romans?", request=FakeRequest(after=10)))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    with_client(ask)
+
+
+def test_stream_closes_upstream_on_disconnect(upstream, monkeypatch):
+    closed = []
+    stream = chatbot.stream
+
+    async def tracked_stream(*args):
+        try:
+            async for token in stream(*args):
+                yield token
+        finally:
+            closed.append(True)
+
+    monkeypatch.setattr(chatbot, "stream", tracked_stream)
+
+    async def consume():
+        events = [event async for event in server.stream_chatbot_response(
+            "Who wrote Romans?", None, FakeRequest(after=2))]
+        # Closed as soon as the response ends, not whenever it is collected
+        return events, list(closed)
+
+    events, closed_by_then = with_client(consume)
+
+    assert len(events) == 2
+    assert all(event.startswith("data: ") and '"token"' in event for event in events)
+    assert closed_by_then == [True]
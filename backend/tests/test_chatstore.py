@@ -0,0 +1,162 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+import chatstore
+import realtime
+from reminders import Lease
+
+
+def open_store():
+    db = AsyncMongoMockClient()["test"]
+    store = chatstore.ChatStore(db.chats, db.chat_buckets, db.chat_archive, legacy=db.chat_messages)
+    return db, store
+
+
+async def new_chat(db, chat_id="c1", **extra):
+    await db.chats.insert_one({"_id": chat_id, "participants": ["u1"], **extra})
+
+
+def test_bucket_numbering():
+    assert [chatstore.bucket_seq(n) for n in (1, chatstore.BUCKET_SIZE, chatstore.BUCKET_SIZE + 1)] == [0, 0, 1]
+    assert chatstore.bucket_id("c1", 3) == "c1:3"
+
+    db, store = open_store()
+
+    async def run():
+        await new_chat(db, message_count=0)
+        for i in range(chatstore.BUCKET_SIZE + 2):
+            await store.append("c1", "u1", str(i))
+        return await db.chat_buckets.find().sort("seq", 1).to_list(None)
+
+    buckets = asyncio.run(run())
+    assert [(b["_id"], b["count"]) for b in buckets] == [("c1:0", chatstore.BUCKET_SIZE), ("c1:1", 2)]
+    assert [m["n"] for m in buckets[1]["messages"]] == [chatstore.BUCKET_SIZE + 1, chatstore.BUCKET_SIZE + 2]
+    assert buckets[1]["last"]["content"] == str(chatstore.BUCKET_SIZE + 1)
+
+
+def test_append_refuses_outsiders():
+    db, store = open_store()
+
+    async def run():
+        await new_chat(db, message_count=0)
+        return await store.append("c1", "nobody", "hi")
+
+    assert asyncio.run(run()) is None
+
+
+def test_reads_fall_back_to_archive():
+    db, store = open_store()
+    size = chatstore.BUCKET_SIZE
+
+    async def run():
+        await new_chat(db, message_count=0)
+        sent = [await store.append("c1", "u1", str(i)) for i in range(2 * size + 1)]
+        archiver = chatstore.ChatArchiver(store, max_age=timedelta(0))
+        archived = await archiver.run_once()
+        chat = await store.open_chat("c1", "u1")
+        after = [m["n"] async for m in store.messages_after(chat, size - 2)]
+        latest = [m["n"] for m in await store.latest(chat, size + 2)]
+        found = await store.find("c1", sent[0]["_id"])
+        return archived, after, latest, found, sent
+
+    archived, after, latest, found, sent = asyncio.run(run())
+    # Only full buckets are moved
+    assert archived == 2
+    assert asyncio.run(db.chat_buckets.count_documents({})) == 1
+    assert after == list(range(size - 1, 2 * size + 2))
+    assert latest == list(range(size, 2 * size + 2))
+    assert found["content"] == sent[0]["content"]
+
+
+def test_pack_round_trips():
+    now = datetime(2026, 1, 1)
+    bucket = {
+        "_id": "c1:0", "chat_id": "c1", "seq": 0, "count": 1, "first_at": now, "last_at": now,
+        "messages": [{"_id": "m1", "n": 1, "sender_id": "u1", "content": "hi", "created_at": now}],
+    }
+    packed = chatstore.pack(bucket)
+    assert packed["ids"] == ["m1"]
+    assert chatstore.unpack(packed) == bucket
+
+
+def test_legacy_migration_runs_once_under_lease():
+    db, store = open_store()
+    now = datetime(2026, 1, 1)
+
+    async def run():
+        await new_chat(db)
+        for i in range(3):
+            await db.chat_messages.insert_one({
+                "_id": f"m{i}", "chat_id": "c1", "sender_id": "u1", "content": str(i),
+                "created_at": now + timedelta(seconds=i),
+            })
+        holder = Lease(db.scheduler_leases, "chat_migration", ttl_seconds=60)
+        await holder.acquire()
+        blocked = await chatstore.migrate_legacy_messages(
+            store, db.migrations, lease=Lease(db.scheduler_leases, "chat_migration", ttl_seconds=60))
+        await holder.release()
+        lease = Lease(db.scheduler_leases, "chat_migration", ttl_seconds=60)
+        first = await chatstore.migrate_legacy_messages(store, db.migrations, lease=lease)
+        second = await chatstore.migrate_legacy_messages(store, db.migrations, lease=lease)
+        chat = await store.open_chat("c1", "u1")
+        return blocked, first, second, [m["content"] async for m in store.messages_after(chat)]
+
+    blocked, first, second, contents = asyncio.run(run())
+    assert (blocked, first, second) == (0, 1, 0)
+    assert contents == ["0", "1", "2"]
+    assert asyncio.run(db.scheduler_leases.count_documents({})) == 0
+
+
+def polled(n, created_at):
+    return {"_id": f"m{n}", "n": n, "sender_id": "u1", "content": str(n), "created_at": created_at}
+
+
+def test_polling_broker_orders_by_message_number():
+    hub = realtime.ChatHub()
+    subscriber = hub.subscribe("c1")
+    broker = realtime.PollingBroker(hub, None, window=10)
+    now = datetime(2026, 1, 1, 12)
+    started = now - timedelta(minutes=1)
+
+    # A sender with a slow clock: message 2 is stamped before message 1
+    seen = broker._deliver("c1", [polled(2, now - timedelta(seconds=3)), polled(1, now)], None, started, now)
+    assert seen == 2
+    # Message 4 is pushed before 3; hold it until 3 shows up
+    seen = broker._deliver("c1", [polled(2, now), polled(4, now)], seen, started, now)
+    assert seen == 2
+    seen = broker._deliver("c1", [polled(3, now), polled(4, now)], seen, started, now)
+    assert seen == 4
+    # ...but not forever
+    later = now + timedelta(seconds=6)
+    seen = broker._deliver("c1", [polled(6, now)], seen, started, later)
+    assert seen == 6
+
+    delivered = []
+    while not subscriber.queue.empty():
+        delivered.append(subscriber.queue.get_nowait()["id"])
+    assert delivered == ["m1", "m2", "m3", "m4", "m6"]
+
+
+def test_polling_broker_skips_messages_from_before_start():
+    hub = realtime.ChatHub()
+    subscriber = hub.subscribe("c1")
+    broker = realtime.PollingBroker(hub, None)
+    now = datetime(2026, 1, 1, 12)
+
+    seen = broker._deliver("c1", [polled(1, now - timedelta(seconds=2))], None, now - timedelta(seconds=1), now)
+    assert seen == 1
+    assert subscriber.queue.empty()
+
+
+def test_brokers_must_implement_delivery():
+    class Incomplete(realtime._BackgroundBroker):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete(realtime.ChatHub(), None)
+    with pytest.raises(TypeError):
+        realtime.ChatBroker(realtime.ChatHub())
+    assert isinstance(realtime.create_broker("polling", realtime.ChatHub(), None), realtime.PollingBroker)
@@ -0,0 +1,111 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+from mongomock_motor import AsyncMongoMockClient
+
+import pagination
+from serialization import dumps
+
+
+def doc(i, created_at):
+    return {"_id": f"d{i}", "created_at": created_at}
+
+
+def test_cursor_round_trips():
+    created_at = datetime(2026, 1, 2, 3, 4, 5, 678000)
+    token = pagination.encode_cursor(doc(1, created_at))
+    assert "=" not in token
+    assert pagination.decode_cursor(token) == (created_at, "d1")
+
+
+def test_bad_cursor_is_a_400():
+    with pytest.raises(HTTPException) as error:
+        pagination.PageParams(limit=10, cursor="not a cursor")
+    assert error.value.status_code == 400
+
+
+async def read_page(cursor, limit):
+    chunks = [chunk async for chunk in await pagination.open_page(cursor, limit, serialize)]
+    return json.loads(b"".join(chunks))
+
+
+def serialize(d):
+    return dumps({"id": d["_id"]})
+
+
+def test_pages_cover_ties_exactly_once():
+    db = AsyncMongoMockClient()["test"]
+    now = datetime(2026, 1, 1)
+    # Several documents share a timestamp, so _id breaks the tie
+    docs = [doc(i, now - timedelta(seconds=i // 3)) for i in range(10)]
+
+    async def run():
+        await db.items.insert_many(docs)
+        seen = []
+        token = None
+        while True:
+            page = pagination.PageParams(limit=4, cursor=token)
+            body = await read_page(pagination.find_page(db.items, {}, page), page.limit)
+            seen.append([item["id"] for item in body["items"]])
+            token = body["next_cursor"]
+            if token is None:
+                return seen
+
+    pages = asyncio.run(run())
+    assert [len(page) for page in pages] == [4, 4, 2]
+    expected = sorted(docs, key=lambda d: (d["created_at"], d["_id"]), reverse=True)
+    assert sum(pages, []) == [d["_id"] for d in expected]
+
+
+def test_empty_page():
+    db = AsyncMongoMockClient()["test"]
+    page = pagination.PageParams(limit=4, cursor=None)
+    body = asyncio.run(read_page(pagination.find_page(db.items, {}, page), page.limit))
+    assert body == {"items": [], "next_cursor": None}
+
+
+class FailingCursor:
+    def __init__(self, docs):
+        self.docs = docs
+        self.closed = False
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for item in self.docs:
+            yield item
+        raise RuntimeError("cursor killed")
+
+    async def close(self):
+        self.closed = True
+
+
+def test_failing_query_raises_before_any_output():
+    cursor = FailingCursor([])
+    with pytest.raises(RuntimeError):
+        asyncio.run(pagination.open_page(cursor, 5, serialize))
+    assert cursor.closed
+
+
+def test_stream_closes_the_cursor():
+    cursor = FailingCursor([doc(i, datetime(2026, 1, 1)) for i in range(3)])
+    body = asyncio.run(read_page(cursor, 2))
+    assert [item["id"] for item in body["items"]] == ["d0", "d1"]
+    assert pagination.decode_cursor(body["next_cursor"]) == (datetime(2026, 1, 1), "d1")
+    assert cursor.closed
+
+
+def test_list_endpoint_pages(client, login):
+    headers, _ = login("reader")
+    for verse in range(1, 4):
+        client.post("/api/bookmarks", json={"book": "John", "chapter": 3, "verse": verse}, headers=headers)
+    first = client.get("/api/bookmarks", params={"limit": 2}, headers=headers)
+    assert first.headers["content-type"] == "application/json"
+    assert [b["verse"] for b in first.json()["items"]] == [3, 2]
+    rest = client.get("/api/bookmarks", params={"limit": 2, "cursor": first.json()["next_cursor"]}, headers=headers)
+    assert rest.json() == {"items": [rest.json()["items"][0]], "next_cursor": None}
+    assert rest.json()["items"][0]["verse"] == 1
@@ -0,0 +1,77 @@
+import asyncio
+
+import numpy as np
+from bson.int64 import Int64
+from mongomock_motor import AsyncMongoMockClient
+
+import progress
+import scripture
+
+
+def small_table(text="x"):
+    # Genesis 1:1-3, 2:1-70 and Exodus 1:1-2
+    entries = [(0, 1, v, text) for v in range(1, 4)]
+    entries += [(0, 2, v, text) for v in range(1, 71)]
+    entries += [(1, 1, v, text) for v in range(1, 3)]
+    return scripture.VerseTable.build(entries)
+
+
+def test_word_masks_split_at_word_boundaries():
+    assert progress.word_count(64) == 1
+    assert progress.word_count(65) == 2
+    assert progress.word_masks(0, 3) == {0: 0b111}
+    assert progress.word_masks(62, 66) == {0: 0b11 << 62, 1: 0b11}
+    assert progress.word_masks(64, 128) == {1: (1 << 64) - 1}
+
+
+def test_int64_keeps_the_sign_bit():
+    assert progress._int64(1 << 63) == Int64(-(1 << 63))
+    assert progress._int64((1 << 64) - 1) == Int64(-1)
+    bits = progress.unpack_words([progress._int64(1 << 63), progress._int64(1)])
+    assert np.flatnonzero(bits).tolist() == [63, 64]
+
+
+def test_counts_by_book_and_chapter():
+    table = small_table()
+    bits = np.zeros(table.verse_count, dtype=np.uint8)
+    bits[[0, 2, 3, 72, 73]] = 1
+    assert progress.count_between(bits, progress.book_bounds(table))[:2].tolist() == [4, 1]
+    assert progress.count_between(bits, progress.chapter_bounds(table, 0)).tolist() == [2, 2]
+    assert progress.percent(1, 3) == 33.3
+    assert progress.percent(0, 0) == 0.0
+
+
+def test_progress_from_another_table_reads_as_empty():
+    db = AsyncMongoMockClient()["test"]
+    store = progress.ProgressStore(db.reading_progress)
+    table = small_table()
+    words = [progress._int64((1 << 64) - 1)] * progress.word_count(table.verse_count)
+
+    async def run():
+        await db.reading_progress.insert_one({"_id": "legacy", "words": words})
+        await db.reading_progress.insert_one({"_id": "current", "version": table.version, "words": words})
+        await db.reading_progress.insert_one({"_id": "stale", "version": "other", "words": words})
+        return {user: int((await store.bits(user, table)).sum()) for user in ("legacy", "current", "stale", "new")}
+
+    assert asyncio.run(run()) == {"legacy": table.verse_count, "current": table.verse_count, "stale": 0, "new": 0}
+
+
+def test_create_sets_stale_progress_aside():
+    db = AsyncMongoMockClient()["test"]
+    store = progress.ProgressStore(db.reading_progress)
+    old, new = small_table("old"), small_table("new")
+    words = [Int64(7), Int64(0)]
+
+    async def run():
+        await db.reading_progress.insert_one({"_id": "u1", "version": old.version, "words": words})
+        await store._create("u1", new)
+        doc = await db.reading_progress.find_one({"_id": "u1"})
+        # Not for a document this table already owns
+        await store._create("u1", new)
+        return doc, await db.reading_progress.find_one({"_id": "u1"})
+
+    doc, again = asyncio.run(run())
+    assert doc["version"] == new.version
+    assert doc["words"] == [0, 0]
+    assert doc["stale"] == {"version": old.version, "words": words}
+    assert again == doc
@@ -0,0 +1,84 @@
+import pytest
+
+import references
+import scripture
+from references import InvalidReference, Passage, parse
+
+
+def book(name):
+    return scripture.BIBLE_BOOKS.index(name)
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("John", "John"),
+    ("jn", "John"),
+    ("1 Cor", "1 Corinthians"),
+    ("1cor", "1 Corinthians"),
+    ("I Corinthians", "1 Corinthians"),
+    ("First Corinthians", "1 Corinthians"),
+    ("Song of Solomon", "Song of Solomon"),
+    ("Revelations", "Revelation"),
+    ("Phil", "Philippians"),
+])
+def test_book_names(name, expected):
+    assert references.book_index(name) == book(expected)
+
+
+@pytest.mark.parametrize("name", ["", "Jo", "Hezekiah", "J"])
+def test_unknown_or_ambiguous_books(name):
+    assert references.book_index(name) is None
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("John 3:16", Passage(book("John"), 3, 16, 3, 16)),
+    ("Jn 3.16", Passage(book("John"), 3, 16, 3, 16)),
+    ("1 Cor 13:4-7", Passage(book("1 Corinthians"), 13, 4, 13, 7)),
+    ("Romans 5-8", Passage(book("Romans"), 5, None, 8, None)),
+    ("Gen 1:1-2:3", Passage(book("Genesis"), 1, 1, 2, 3)),
+    ("Jude 3-5", Passage(book("Jude"), 1, 3, 1, 5)),
+    ("Psalm 23", Passage(book("Psalms"), 23, None, 23, None)),
+    ("Obadiah", Passage(book("Obadiah"))),
+])
+def test_parse(text, expected):
+    assert parse(text) == expected
+
+
+@pytest.mark.parametrize("text", ["", "3:16", "John 3:0", "John 5-3", "John 3:16-2:1", "Nowhere 1:1", "John 1000"])
+def test_parse_rejects(text):
+    with pytest.raises(InvalidReference):
+        parse(text)
+
+
+def test_verse_ids_pack_and_sort_in_canon_order():
+    assert references.verse_id(book("John"), 3, 16) == 43003016
+    assert references.unpack(43003016) == (book("John"), 3, 16)
+    assert references.verse_id(book("Malachi"), 4, 6) < references.verse_id(book("Matthew"), 1, 1)
+
+
+def test_ranges_are_half_open():
+    assert parse("Romans 5-8").id_filter() == {"$gte": 45005000, "$lt": 45009000}
+    assert parse("John 3:16").id_filter() == {"$gte": 43003016, "$lt": 43003017}
+    assert parse("Gen 1:1-2:3").id_filter() == {"$gte": 1001001, "$lt": 1002004}
+    # A whole book runs up to the next book's "verse zero"
+    assert parse("Jude").id_filter() == {"$gte": 65000000, "$lt": 66000000}
+
+
+def test_str_round_trips():
+    for text in ("John 3:16", "1 Corinthians 13:4-7", "Romans 5-8", "Genesis 1:1-2:3", "Psalms 23", "Jude"):
+        assert str(parse(text)) == text
+
+
+def test_check_against_a_table():
+    table = scripture.VerseTable.build([(book("John"), c, v, "x") for c in (1, 2) for v in range(1, 4)])
+    assert parse("John 2:3", table) == Passage(book("John"), 2, 3, 2, 3)
+    with pytest.raises(InvalidReference):
+        parse("John 3:1", table)
+    with pytest.raises(InvalidReference):
+        parse("John 2:4", table)
+
+
+def test_id_fields_for_stored_passages():
+    passage = references.passage_for("john", 3, 16, 18)
+    assert references.id_fields(passage) == {"verse_id": 43003016, "verse_end_id": 43003018}
+    with pytest.raises(InvalidReference):
+        references.passage_for("Nowhere", 1, 1)
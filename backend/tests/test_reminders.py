@@ -0,0 +1,173 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from mongomock_motor import AsyncMongoMockClient
+
+from reminders import Lease, ReminderScheduler
+
+
+def reminder(reminder_id, due, **extra):
+    return {
+        "_id": reminder_id,
+        "user_id": "u1",
+        "title": reminder_id,
+        "description": "",
+        "reminder_time": due,
+        "completed": False,
+        "notified_at": None,
+        "deleted_at": None,
+        **extra,
+    }
+
+
+def test_schedule_mixes_aware_and_naive_times():
+    db = AsyncMongoMockClient()["test"]
+    scheduler = ReminderScheduler(db.reminders, db.notifications)
+    now = datetime.utcnow()
+
+    async def schedule():
+        await scheduler.schedule(reminder("aware", (now + timedelta(hours=2)).replace(tzinfo=timezone.utc)))
+        await scheduler.schedule(reminder("naive", now + timedelta(hours=1)))
+        await scheduler.schedule(reminder("offset", datetime(2030, 1, 1, 2, tzinfo=timezone(timedelta(hours=2)))))
+
+    asyncio.run(schedule())
+
+    assert all(due.tzinfo is None for due, _ in scheduler._heap)
+    assert scheduler._scheduled["offset"] == datetime(2030, 1, 1)
+    assert sorted(scheduler._heap)[0][1] == "naive"
+
+
+def test_dispatches_aware_and_naive_reminders():
+    async def run():
+        db = AsyncMongoMockClient()["test"]
+        scheduler = ReminderScheduler(db.reminders, db.notifications)
+        await scheduler.start()
+        try:
+            now = datetime.utcnow().replace(microsecond=0)
+            docs = [
+                reminder("aware", (now - timedelta(seconds=1)).replace(tzinfo=timezone.utc)),
+                reminder("naive", now - timedelta(seconds=2)),
+            ]
+            for doc in docs:
+                stored = {**doc, "reminder_time": doc["reminder_time"].replace(tzinfo=None)}
+                await db.reminders.insert_one(stored)
+                await scheduler.schedule(doc)
+            for _ in range(50):
+                if scheduler.dispatched == 2:
+                    break
+                await asyncio.sleep(0.02)
+        finally:
+            await scheduler.stop()
+        return scheduler.dispatched, await db.notifications.count_documents({})
+
+    assert asyncio.run(run()) == (2, 2)
+
+
+def test_moved_reminder_is_rescheduled():
+    db = AsyncMongoMockClient()["test"]
+    scheduler = ReminderScheduler(db.reminders, db.notifications)
+    now = datetime.utcnow()
+
+    async def schedule():
+        await scheduler.schedule(reminder("r", now + timedelta(hours=1)))
+        await scheduler.schedule(reminder("r", now + timedelta(hours=3)))
+
+    asyncio.run(schedule())
+    assert scheduler.stats()["scheduled"] == 1
+    assert scheduler._scheduled["r"] == now + timedelta(hours=3)
+
+
+def test_leader_hydrates_on_acquire_and_on_signal_only():
+    async def run():
+        db = AsyncMongoMockClient()["test"]
+        leader = ReminderScheduler(db.reminders, db.notifications, lease=Lease(db.leases, "reminders", 30),
+                                   lease_seconds=0.15)
+        follower = ReminderScheduler(db.reminders, db.notifications, lease=Lease(db.leases, "reminders", 30),
+                                     lease_seconds=0.15)
+        hydrations = []
+        hydrate = leader.hydrate
+
+        async def counting_hydrate():
+            hydrations.append(datetime.utcnow())
+            await hydrate()
+
+        leader.hydrate = counting_hydrate
+        await leader.start()
+        await asyncio.sleep(0.05)
+        await follower.start()
+        try:
+            await asyncio.sleep(0.3)
+            idle = len(hydrations)
+            doc = reminder("remote", datetime.utcnow() + timedelta(hours=1))
+            await db.reminders.insert_one(doc)
+            await follower.schedule(doc)
+            await asyncio.sleep(0.2)
+            return idle, len(hydrations), "remote" in leader._scheduled, follower.is_leader
+        finally:
+            await follower.stop()
+            await leader.stop()
+
+    idle, after_signal, scheduled, follower_leads = asyncio.run(run())
+    assert idle == 1
+    assert after_signal == 2
+    assert scheduled
+    assert not follower_leads
+
+
+def test_long_overdue_reminders_are_not_sent():
+    async def run():
+        db = AsyncMongoMockClient()["test"]
+        now = datetime.utcnow()
+        await db.reminders.insert_many([
+            reminder("ancient", now - timedelta(days=30)),
+            reminder("recent", now - timedelta(minutes=5)),
+        ])
+        scheduler = ReminderScheduler(db.reminders, db.notifications, max_lateness=timedelta(hours=1))
+        await scheduler.start()
+        try:
+            await scheduler.schedule(reminder("ancient", now - timedelta(days=30)))
+            for _ in range(50):
+                if scheduler.dispatched:
+                    break
+                await asyncio.sleep(0.02)
+            await asyncio.sleep(0.05)
+        finally:
+            await scheduler.stop()
+        notified = await db.reminders.find({"notified_at": {"$ne": None}}).distinct("_id")
+        return scheduler.dispatched, notified, "ancient" in scheduler._scheduled
+
+    assert asyncio.run(run()) == (1, ["recent"], False)
+
+
+def test_moving_a_fired_reminder_through_sync_rearms_it(client, login):
+    import server
+
+    headers, user_id = login("reader")
+    fired = datetime(2026, 1, 1, 9)
+
+    def push(when, title="pray"):
+        change = {"id": "r1", "updated_at": datetime.utcnow().isoformat(),
+                  "data": {"title": title, "description": "", "reminder_time": when}}
+        response = client.post("/api/sync", json={"changes": {"reminders": [change]}}, headers=headers)
+        assert response.json()["results"]["reminders"]["r1"] == "applied"
+
+    def stored():
+        async def find():
+            return await server.db.reminders.find_one({"_id": "r1"})
+        return client.portal.call(find)
+
+    def mark_fired():
+        async def update():
+            await server.db.reminders.update_one({"_id": "r1"}, {"$set": {"notified_at": fired}})
+        client.portal.call(update)
+
+    push(fired.isoformat())
+    mark_fired()
+    # Same time, other fields: still delivered
+    push(fired.isoformat(), title="pray more")
+    assert stored()["notified_at"] == fired
+    # Moved, given with an offset: due again
+    push("2026-01-02T10:00:00+01:00")
+    doc = stored()
+    assert doc["reminder_time"] == datetime(2026, 1, 2, 9)
+    assert doc["notified_at"] is None
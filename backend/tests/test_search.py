@@ -0,0 +1,114 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+import search
+import server
+
+VERSES = [
+    "In the beginning God created the heaven and the earth.",
+    "For God so loved the world, that he gave his only begotten Son.",
+    "The world was made by him, and the world knew him not.",
+    "God is love.",
+    "He that loveth not knoweth not God; for God is love.",
+]
+
+
+@pytest.fixture(params=["memory", "file"])
+def index(request, tmp_path):
+    built = search.SearchIndex.build(VERSES, version="v1")
+    if request.param == "memory":
+        return built
+    path = tmp_path / "search.bin"
+    built.save(path)
+    return search.SearchIndex.open(path)
+
+
+def test_stemming_is_consistent():
+    assert search.stem("loveth") == search.stem("loved") == search.stem("love")
+    assert search.stem("believest") == search.stem("believe")
+    assert search.stem("glass") == "glass"
+    assert search.tokenize("God's World") == ["god", "world"]
+
+
+def test_parse_query_splits_phrases():
+    terms, phrases = search.parse_query('"God is love" world "earth"')
+    assert terms == ["world", "god", "is", "lov", "earth"]
+    # A one-word phrase is just a term
+    assert phrases == [["god", "is", "lov"]]
+
+
+def test_varints_round_trip():
+    values = [0, 1, 127, 128, 300, 2 ** 21, 2 ** 35]
+    encoded = bytearray()
+    search._encode_varints(values, encoded)
+    assert search.decode_varints(bytes(encoded)).tolist() == values
+    assert search.decode_varints(b"").size == 0
+
+
+def test_postings(index):
+    ordinals, tfs = index.postings_for("world")
+    assert ordinals.tolist() == [1, 2]
+    assert tfs.tolist() == [1, 2]
+    assert index.postings_for("missing")[0].size == 0
+    assert index.version == "v1"
+
+
+def test_bm25_prefers_frequent_terms_in_short_verses(index):
+    total, hits = index.search("world")
+    assert total == 2
+    assert [ordinal for ordinal, _ in hits] == [2, 1]
+
+    total, hits = index.search("love")
+    assert total == 3
+    # Same term frequency: the shorter verse wins
+    assert hits[0][0] == 3
+    assert hits[0][1] > hits[-1][1]
+
+
+def test_phrases_must_match_in_order(index):
+    total, hits = index.search('"god is love"')
+    assert (total, sorted(o for o, _ in hits)) == (2, [3, 4])
+    assert index.search('"love is god"') == (0, [])
+    np.testing.assert_array_equal(index.phrase_ordinals(["knew", "him"]), [2])
+
+
+def test_limit_and_range(index):
+    total, hits = index.search("god", limit=2)
+    assert total == 4
+    assert len(hits) == 2
+    total, hits = index.search("god", ordinal_range=(1, 4))
+    assert (total, sorted(o for o, _ in hits)) == (2, [1, 3])
+    assert index.search("") == (0, [])
+
+
+class Table:
+    version = "v1"
+    verse_count = len(VERSES)
+
+    def verse_text(self, ordinal):
+        return VERSES[ordinal]
+
+
+def test_workers_build_the_index_to_disk_once(client, tmp_path, monkeypatch):
+    builds = []
+
+    def build_for_bible(table):
+        builds.append(table.version)
+        return search.SearchIndex.build(VERSES, version=table.version)
+
+    monkeypatch.setattr(server, "SEARCH_INDEX_PATH", str(tmp_path / "search.bin"))
+    monkeypatch.setattr(search, "build_for_bible", build_for_bible)
+
+    async def start_workers():
+        return await asyncio.gather(*(server.load_search_index(Table(), poll_seconds=0.01) for _ in range(3)))
+
+    indexes = client.portal.call(start_workers)
+
+    assert builds == ["v1"]
+    assert all(index.search("love") == indexes[0].search("love") for index in indexes)
+    # A stale file is rebuilt in place
+    monkeypatch.setattr(Table, "version", "v2")
+    assert client.portal.call(server.load_search_index, Table()).version == "v2"
+    assert builds == ["v1", "v2"]
@@ -0,0 +1,67 @@
+import server
+
+
+def bookmark(client, headers, book, chapter, verse):
+    response = client.post("/api/bookmarks", json={"book": book, "chapter": chapter, "verse": verse}, headers=headers)
+    assert response.status_code == 200
+    return response.json()["id"]
+
+
+def search(client, headers, **params):
+    response = client.get("/api/study/search", params={"types": "bookmarks", **params}, headers=headers)
+    assert response.status_code == 200
+    return response.json()["items"]
+
+
+def test_bookmarks_match_references_not_words(client, login):
+    headers, _ = login("reader")
+    john3 = bookmark(client, headers, "John", 3, 16)
+    john4 = bookmark(client, headers, "John", 4, 14)
+    romans = bookmark(client, headers, "Romans", 5, 8)
+
+    # A word search must not drag in every bookmark of the filtered range
+    assert search(client, headers, q="grace", book="John") == []
+    assert search(client, headers, q="grace") == []
+
+    assert {hit["id"] for hit in search(client, headers, q="John")} == {john3, john4}
+    assert [hit["id"] for hit in search(client, headers, q="Jn 3")] == [john3]
+    assert [hit["id"] for hit in search(client, headers, q="Rom 5:8")] == [romans]
+    # Both the query and the filter apply
+    assert search(client, headers, q="John 3", book="Romans") == []
+    assert [hit["id"] for hit in search(client, headers, q="John", chapter_start=4)] == [john4]
+
+
+def test_bookmark_scores_follow_the_query_length(client, login):
+    headers, _ = login("reader")
+    bookmark(client, headers, "John", 3, 16)
+    assert [hit["score"] for hit in search(client, headers, q="John 3:16")] == [2.0]
+
+
+def test_overlay_revalidates_before_aggregating(client, login, monkeypatch):
+    headers, _ = login("alice")
+    aggregations = []
+
+    class Cursor:
+        async def to_list(self, length):
+            return [{"highlights": [], "bookmarks": [], "notes": []}]
+
+    def aggregate(collection, pipeline):
+        aggregations.append(pipeline)
+        return Cursor()
+
+    # mongomock has no $unionWith, and only the number of aggregations matters
+    monkeypatch.setattr(type(server.db.highlights), "aggregate", aggregate)
+
+    first = client.get("/api/study/overlay/John/3", headers=headers)
+    etag = first.headers["etag"]
+    assert first.status_code == 200 and len(aggregations) == 1
+
+    revalidated = client.get("/api/study/overlay/John/3", headers={**headers, "If-None-Match": etag})
+    assert revalidated.status_code == 304 and revalidated.headers["etag"] == etag
+    assert len(aggregations) == 1
+
+    client.post("/api/highlights", json={"book": "John", "chapter": 3, "verse": 16, "text": "For God",
+                                         "color": "yellow"}, headers=headers)
+    changed = client.get("/api/study/overlay/John/3", headers={**headers, "If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["etag"] != etag
+    assert len(aggregations) == 2
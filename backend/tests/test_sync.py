@@ -0,0 +1,117 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from mongomock_motor import AsyncMongoMockClient
+
+import sync
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def database():
+    return AsyncMongoMockClient()["test"]
+
+
+def test_last_writer_wins():
+    async def scenario():
+        db = database()
+        t0 = datetime(2030, 1, 1)
+        first = await sync.apply_changes(db.sync_counters, db.notes, "notes", "u1",
+                                         [("n1", t0, {"title": "a"}), ("n2", t0, {"title": "b"})])
+        later = await sync.apply_changes(db.sync_counters, db.notes, "notes", "u1",
+                                         [("n1", t0 + timedelta(seconds=1), {"title": "newer"}),
+                                          ("n2", t0 - timedelta(seconds=1), {"title": "older"})])
+        stolen = await sync.apply_changes(db.sync_counters, db.notes, "notes", "u2",
+                                          [("n1", t0 + timedelta(hours=1), {"title": "mine"})])
+        docs = {doc["_id"]: doc async for doc in db.notes.find()}
+        return first, later, stolen, docs
+
+    first, later, stolen, docs = run(scenario())
+    assert first == {"n1": "applied", "n2": "applied"}
+    assert later == {"n1": "applied", "n2": "conflict"}
+    assert stolen == {"n1": "conflict"}
+    assert docs["n1"]["title"] == "newer" and docs["n1"]["version"] == 3
+    assert docs["n2"]["title"] == "b" and docs["n2"]["version"] == 2
+
+
+def test_deletion_leaves_tombstone_with_new_version():
+    async def scenario():
+        db = database()
+        t0 = datetime(2030, 1, 1)
+        await sync.apply_changes(db.sync_counters, db.notes, "notes", "u1", [("n1", t0, {"title": "a"})])
+        await sync.apply_changes(db.sync_counters, db.notes, "notes", "u1", [("n1", t0 + timedelta(seconds=1), None)])
+        return await sync.changes_since(db.notes, "u1", 1, 10)
+
+    [doc] = run(scenario())
+    assert doc["version"] == 2
+    assert doc["deleted_at"] == datetime(2030, 1, 1, 0, 0, 1)
+
+
+def test_pull_waits_for_versions_committed_out_of_order():
+    async def scenario():
+        db = database()
+        now = datetime.utcnow()
+        slow = sync.reserve_versions(db.sync_counters, "u1", "notes")
+        slow_version = await slow.__aenter__()
+        async with sync.reserve_versions(db.sync_counters, "u1", "notes") as fast_version:
+            await db.notes.insert_one({"_id": "fast", "user_id": "u1", "version": fast_version, "updated_at": now})
+        held, _ = await sync.pull_state(db.sync_counters, "u1")
+        await db.notes.insert_one({"_id": "slow", "user_id": "u1", "version": slow_version, "updated_at": now})
+        await slow.__aexit__(None, None, None)
+        limits, _ = await sync.pull_state(db.sync_counters, "u1")
+        docs = await sync.changes_since(db.notes, "u1", 0, 10, until=limits["notes"])
+        return held, limits, [doc["_id"] for doc in docs]
+
+    held, limits, ids = run(scenario())
+    assert held["notes"] is None
+    assert held["bookmarks"] == 0
+    assert limits["notes"] == 2
+    assert ids == ["slow", "fast"]
+
+
+def test_expired_reservations_stop_holding_pulls():
+    async def scenario():
+        db = database()
+        stale = datetime.utcnow() - sync.PENDING_TIMEOUT - timedelta(seconds=1)
+        await db.sync_counters.insert_one({"_id": "u1", "notes": 4, "pending": {"notes": {"dead": stale}}})
+        limits, _ = await sync.pull_state(db.sync_counters, "u1")
+        return limits, await db.sync_counters.find_one({"_id": "u1"})
+
+    limits, counters = run(scenario())
+    assert limits["notes"] == 4
+    assert counters["pending"]["notes"] == {}
+
+
+def test_changes_since_stops_at_limit():
+    async def scenario():
+        db = database()
+        await db.notes.insert_many([{"_id": f"n{v}", "user_id": "u1", "version": v} for v in range(1, 6)])
+        return ([d["version"] for d in await sync.changes_since(db.notes, "u1", 1, 10, until=3)],
+                await sync.changes_since(db.notes, "u1", 3, 10, until=3))
+
+    capped, empty = run(scenario())
+    assert capped == [2, 3]
+    assert empty == []
+
+
+def test_purge_records_watermark_and_keeps_live_documents():
+    async def scenario():
+        db = database()
+        old = datetime(2020, 1, 1)
+        await db.notes.insert_many([
+            {"_id": "live", "user_id": "u1", "version": 1, "deleted_at": None},
+            {"_id": "gone", "user_id": "u1", "version": 2, "deleted_at": old},
+            {"_id": "recent", "user_id": "u1", "version": 3, "deleted_at": datetime.utcnow()},
+        ])
+        purged = await sync.purge_tombstones(db, datetime.utcnow() - timedelta(days=1))
+        _, watermarks = await sync.pull_state(db.sync_counters, "u1")
+        remaining = sorted([doc["_id"] async for doc in db.notes.find()])
+        return purged, watermarks, remaining, await sync.live_ids(db.notes, "u1", 3)
+
+    purged, watermarks, remaining, live = run(scenario())
+    assert purged == 1
+    assert watermarks == {"notes": 2}
+    assert remaining == ["live", "recent"]
+    assert live == ["live"]
@@ -20,21 +20,26 @@ import {
     Bot,
     Lightbulb,
     Send,
-    Loader2
+    Loader2,
+    Link2,
+    CheckCircle2
 } from 'lucide-react';
 import { mockBibleData } from '../mock/bibleMock';
-import { bibleAPI, chatbotAPI } from '../services/api';
+import { bibleAPI, chatbotAPI, progressAPI, studyAPI } from '../services/api';
 import { useToast } from '../hooks/use-toast';
+import { usePagedList } from '../hooks/use-paged-list';
 import BottomNavigation from './BottomNavigation';
 
 const BibleReader = ({ user }) => {
     const [currentBook, setCurrentBook] = useState('Genesis');
     const [currentChapter, setCurrentChapter] = useState(1);
     const [selectedVerse, setSelectedVerse] = useState(null);
-    const [highlights, setHighlights] = useState([]);
-    const [bookmarks, setBookmarks] = useState([]);
+    const [overlay, setOverlay] = useState({ highlights: [], bookmarks: [], notes: [] });
+    const bookmarks = usePagedList(bibleAPI.getBookmarksPage);
     const [searchQuery, setSearchQuery] = useState('');
     const [searchResults, setSearchResults] = useState([]);
+    const [activeTab, setActiveTab] = useState('read');
+    const [chapterProgress, setChapterProgress] = useState({});
     const [chatbotOpen, setChatbotOpen] = useState(false);
     const [chatbotMessage, setChatbotMessage] = useState('');
     const [chatbotResponse, setChatbotResponse] = useState('');
@@ -47,23 +52,51 @@ const BibleReader = ({ user }) => {
     const verses = chapters[currentChapter - 1]?.verses || [];
 
     useEffect(() => {
-        loadHighlights();
         loadBookmarks();
     }, []);
 
-    const loadHighlights = async () => {
+    useEffect(() => {
+        loadOverlay();
+    }, [currentBook, currentChapter]);
+
+    useEffect(() => {
+        loadProgress();
+    }, [currentBook]);
+
+    const loadProgress = async () => {
+        try {
+            const data = await progressAPI.getBook(currentBook);
+            setChapterProgress(Object.fromEntries(data.chapters.map((item) => [item.chapter, item])));
+        } catch (error) {
+            console.error('Error loading reading progress:', error);
+        }
+    };
+
+    const chapterRead = chapterProgress[currentChapter]?.percent === 100;
+
+    const handleToggleRead = async () => {
         try {
-            const data = await bibleAPI.getHighlights();
-            setHighlights(data);
+            const data = chapterRead
+                ? await progressAPI.markUnread(currentBook, currentChapter)
+                : await progressAPI.markRead(currentBook, currentChapter);
+            setChapterProgress((previous) => ({ ...previous, [data.chapter]: data }));
         } catch (error) {
-            console.error('Error loading highlights:', error);
+            console.error('Error updating reading progress:', error);
+        }
+    };
+
+    const loadOverlay = async () => {
+        try {
+            const data = await studyAPI.getOverlay(currentBook, currentChapter);
+            setOverlay(data);
+        } catch (error) {
+            console.error('Error loading study overlay:', error);
         }
     };
 
     const loadBookmarks = async () => {
         try {
-            const data = await bibleAPI.getBookmarks();
-            setBookmarks(data);
+            await bookmarks.reload();
         } catch (error) {
             console.error('Error loading bookmarks:', error);
         }
@@ -79,7 +112,7 @@ const BibleReader = ({ user }) => {
             };
 
             await bibleAPI.createHighlight(highlightData);
-            await loadHighlights();
+            await loadOverlay();
 
             toast({
                 title: "Verse highlighted",
@@ -104,7 +137,7 @@ const BibleReader = ({ user }) => {
             };
 
             await bibleAPI.createBookmark(bookmarkData);
-            await loadBookmarks();
+            await Promise.all([loadOverlay(), loadBookmarks()]);
 
             toast({
                 title: "Verse bookmarked",
@@ -146,9 +179,18 @@ const BibleReader = ({ user }) => {
         }
     };
 
-    const handleSearch = () => {
+    const handleSearch = async () => {
         if (!searchQuery.trim()) return;
 
+        try {
+            const data = await bibleAPI.search(searchQuery.trim());
+            setSearchResults(data.results);
+            return;
+        } catch (error) {
+            // Fall back to searching the bundled text when the server index is unavailable
+            console.error('Error searching verses:', error);
+        }
+
         const results = [];
         Object.entries(mockBibleData).forEach(([book, bookData]) => {
             bookData.chapters.forEach((chapter, chapterIndex) => {
@@ -168,14 +210,31 @@ const BibleReader = ({ user }) => {
         setSearchResults(results.slice(0, 20));
     };
 
+    const handleRelated = async (verseNumber) => {
+        try {
+            const data = await bibleAPI.getRelated(currentBook, currentChapter, verseNumber);
+            setSearchResults(data.related);
+            setActiveTab('search');
+        } catch (error) {
+            console.error('Error loading related verses:', error);
+            toast({
+                title: "Related verses unavailable",
+                description: "Could not load related verses right now",
+                variant: "destructive",
+            });
+        }
+    };
+
     const handleChatbotAsk = async () => {
         if (!chatbotMessage.trim()) return;
 
         setChatbotLoading(true);
+        setChatbotResponse('');
         try {
-            const response = await chatbotAPI.askQuestion(chatbotMessage);
-            setChatbotResponse(response.response);
-            setSuggestedVerses(response.suggested_verses || []);
+            await chatbotAPI.askQuestionStream(chatbotMessage, (token, text) => {
+                setChatbotResponse(text);
+            });
+            setSuggestedVerses([]);
 
             toast({
                 title: "Bible study assistant",
@@ -194,16 +253,17 @@ const BibleReader = ({ user }) => {
         setChatbotOpen(true);
         setChatbotLoading(true);
         setChatbotMessage(`Please explain ${currentBook} ${currentChapter}:${verseId}`);
+        setChatbotResponse('');
 
         try {
-            const response = await chatbotAPI.explainVerse(
+            await chatbotAPI.explainVerseStream(
                 currentBook,
                 currentChapter,
                 verseId,
-                verseText
+                verseText,
+                (token, text) => setChatbotResponse(text)
             );
-            setChatbotResponse(response.response);
-            setSuggestedVerses(response.suggested_verses || []);
+            setSuggestedVerses([]);
         } catch (error) {
             console.error('Error explaining verse:', error);
             setChatbotResponse("Sorry, I'm having trouble explaining this verse right now. Please try again later.");
@@ -213,17 +273,18 @@ const BibleReader = ({ user }) => {
         }
     };
 
+    // Passages are stored as one item covering verse..verse_end
+    const coversVerse = (item, verseId) =>
+        item.book === currentBook && item.chapter === currentChapter &&
+        item.verse <= verseId && verseId <= (item.verse_end || item.verse);
+
     const getVerseHighlight = (verseId) => {
-        const highlight = highlights.find(h =>
-            h.book === currentBook && h.chapter === currentChapter && h.verse === verseId
-        );
+        const highlight = overlay.highlights.find(h => coversVerse(h, verseId));
         return highlight ? highlight.color : null;
     };
 
     const isBookmarked = (verseId) => {
-        return bookmarks.some(b =>
-            b.book === currentBook && b.chapter === currentChapter && b.verse === verseId
-        );
+        return overlay.bookmarks.some(b => coversVerse(b, verseId));
     };
 
     return (
@@ -324,7 +385,7 @@ const BibleReader = ({ user }) => {
                 </div>
             </div>
 
-            <Tabs defaultValue="read" className="px-4 mt-4">
+            <Tabs value={activeTab} onValueChange={setActiveTab} className="px-4 mt-4">
                 <TabsList className="grid w-full grid-cols-3">
                     <TabsTrigger value="read">Read</TabsTrigger>
                     <TabsTrigger value="search">Search</TabsTrigger>
@@ -333,10 +394,18 @@ const BibleReader = ({ user }) => {
 
                 <TabsContent value="read" className="mt-4">
                     <Card>
-                        <CardHeader>
+                        <CardHeader className="flex flex-row items-center justify-between space-y-0">
                             <CardTitle className="text-lg">
                                 {currentBook} Chapter {currentChapter}
                             </CardTitle>
+                            <Button
+                                size="sm"
+                                variant={chapterRead ? "secondary" : "outline"}
+                                onClick={handleToggleRead}
+                            >
+                                <CheckCircle2 className="w-4 h-4 mr-1" />
+                                {chapterRead ? 'Read' : 'Mark as read'}
+                            </Button>
                         </CardHeader>
                         <CardContent>
                             <ScrollArea className="h-96">
@@ -403,6 +472,14 @@ const BibleReader = ({ user }) => {
                                                                 >
                                                                     <Lightbulb className="w-4 h-4" />
                                                                 </Button>
+                                                                <Button
+                                                                    size="sm"
+                                                                    variant="ghost"
+                                                                    onClick={() => handleRelated(verseNumber)}
+                                                                    className="h-8 px-2"
+                                                                >
+                                                                    <Link2 className="w-4 h-4" />
+                                                                </Button>
                                                             </div>
                                                         </div>
                                                     </div>
@@ -468,7 +545,7 @@ const BibleReader = ({ user }) => {
                         <CardContent>
                             <ScrollArea className="h-80">
                                 <div className="space-y-3">
-                                    {bookmarks.map((bookmark) => (
+                                    {bookmarks.items.map((bookmark) => (
                                         <div key={bookmark.id} className="p-3 bg-gray-50 rounded-lg">
                                             <div className="flex items-center gap-2 mb-2">
                                                 <Badge variant="secondary">
@@ -500,6 +577,11 @@ const BibleReader = ({ user }) => {
                                             </div>
                                         </div>
                                     ))}
+                                    {bookmarks.hasMore && (
+                                        <Button variant="outline" className="w-full" disabled={bookmarks.loading} onClick={bookmarks.loadMore}>
+                                            {bookmarks.loading ? 'Loading...' : 'Load more'}
+                                        </Button>
+                                    )}
                                 </div>
                             </ScrollArea>
                         </CardContent>
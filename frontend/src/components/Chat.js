@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { Card, CardContent, CardHeader, CardTitle } from './ui/card';
 import { Button } from './ui/button';
 import { Input } from './ui/input';
@@ -20,6 +20,8 @@ const Chat = ({ user }) => {
     const [createChatOpen, setCreateChatOpen] = useState(false);
     const [selectedFriends, setSelectedFriends] = useState([]);
     const [chatName, setChatName] = useState('');
+    const socketRef = useRef(null);
+    const lastMessageIdRef = useRef(null);
     const { toast } = useToast();
 
     useEffect(() => {
@@ -28,14 +30,73 @@ const Chat = ({ user }) => {
     }, []);
 
     useEffect(() => {
-        if (currentChat) {
-            loadMessages(currentChat.id);
-        }
+        if (!currentChat) return undefined;
+
+        let closed = false;
+        let reconnectTimer = null;
+
+        const appendMessages = (items) => {
+            if (!items.length) return;
+            setMessages(prev => {
+                const seen = new Set(prev.map(m => m.id));
+                // Live frames can land while older history is still being paged in
+                const merged = [...prev, ...items.filter(m => !seen.has(m.id))]
+                    .sort((a, b) => new Date(a.created_at) - new Date(b.created_at));
+                lastMessageIdRef.current = merged[merged.length - 1].id;
+                return merged;
+            });
+        };
+
+        const fetchRest = async (afterId) => {
+            // The server stops replaying after a cap; page the remainder over REST
+            try {
+                let after = afterId;
+                for (;;) {
+                    const page = await chatAPI.getMessagesSince(currentChat.id, after);
+                    if (closed) return;
+                    appendMessages(page.items);
+                    if (!page.has_more || !page.items.length) return;
+                    after = page.items[page.items.length - 1].id;
+                }
+            } catch (error) {
+                console.error('Error loading messages:', error);
+            }
+        };
+
+        const handleFrame = (frame) => {
+            if (frame.error) {
+                console.error('Chat socket error:', frame.error);
+            } else if (frame.truncated) {
+                fetchRest(frame.resume_after);
+            } else {
+                appendMessages([frame]);
+            }
+        };
+
+        const connect = () => {
+            socketRef.current = chatAPI.connect(currentChat.id, {
+                lastMessageId: lastMessageIdRef.current,
+                onMessage: handleFrame,
+                onClose: () => {
+                    // Reconnect and resume from the last message we saw
+                    if (!closed) reconnectTimer = setTimeout(connect, 1000);
+                },
+            });
+        };
+
+        loadMessages(currentChat.id).then(connect);
+
+        return () => {
+            closed = true;
+            clearTimeout(reconnectTimer);
+            if (socketRef.current) socketRef.current.close();
+            socketRef.current = null;
+        };
     }, [currentChat]);
 
     const loadChats = async () => {
         try {
-            const data = await chatAPI.getChats();
+            const data = await chatAPI.getChatSummaries();
             setChats(data);
         } catch (error) {
             console.error('Error loading chats:', error);
@@ -53,8 +114,13 @@ const Chat = ({ user }) => {
 
     const loadMessages = async (chatId) => {
         try {
-            const data = await chatAPI.getChatMessages(chatId);
-            setMessages(data);
+            const { items } = await chatAPI.getMessagesSince(chatId);
+            setMessages(items);
+            lastMessageIdRef.current = items.length ? items[items.length - 1].id : null;
+            if (items.length) {
+                await chatAPI.markChatRead(chatId, lastMessageIdRef.current);
+                setChats(prev => prev.map(c => (c.id === chatId ? { ...c, unread_count: 0 } : c)));
+            }
         } catch (error) {
             console.error('Error loading messages:', error);
         }
@@ -65,9 +131,14 @@ const Chat = ({ user }) => {
         if (!newMessage.trim() || !currentChat) return;
 
         try {
-            await chatAPI.sendMessage(currentChat.id, newMessage);
+            const socket = socketRef.current;
+            if (socket && socket.readyState === WebSocket.OPEN) {
+                // The server echoes the message back over the socket
+                socket.send(JSON.stringify({ content: newMessage }));
+            } else {
+                await chatAPI.sendMessage(currentChat.id, newMessage);
+            }
             setNewMessage('');
-            await loadMessages(currentChat.id);
         } catch (error) {
             console.error('Error sending message:', error);
             toast({
@@ -216,10 +287,15 @@ const Chat = ({ user }) => {
                                                 </Avatar>
                                                 <div className="flex-1 min-w-0">
                                                     <div className="font-medium truncate">{chat.name}</div>
-                                                    <div className="text-sm text-gray-500">
-                                                        {chat.type === 'group' ? `${chat.participants.length} members` : 'Direct message'}
+                                                    <div className="text-sm text-gray-500 truncate">
+                                                        {chat.last_message
+                                                            ? chat.last_message.content
+                                                            : chat.type === 'group' ? `${chat.participants.length} members` : 'Direct message'}
                                                     </div>
                                                 </div>
+                                                {chat.unread_count > 0 && (
+                                                    <Badge className="text-xs">{chat.unread_count}</Badge>
+                                                )}
                                             </div>
                                         </div>
                                     ))}
@@ -10,10 +10,12 @@ import { Label } from './ui/label';
 import { Plus, Edit, Trash2, Search, Tag, FileText, Book } from 'lucide-react';
 import { notesAPI } from '../services/api';
 import { useToast } from '../hooks/use-toast';
+import { usePagedList } from '../hooks/use-paged-list';
 import BottomNavigation from './BottomNavigation';
 
 const Notes = ({ user }) => {
-    const [notes, setNotes] = useState([]);
+    const noteList = usePagedList(notesAPI.getNotesPage);
+    const notes = noteList.items;
     const [searchQuery, setSearchQuery] = useState('');
     const [selectedCategory, setSelectedCategory] = useState('all');
     const [noteDialogOpen, setNoteDialogOpen] = useState(false);
@@ -43,8 +45,7 @@ const Notes = ({ user }) => {
 
     const loadNotes = async () => {
         try {
-            const data = await notesAPI.getNotes();
-            setNotes(data);
+            await noteList.reload();
         } catch (error) {
             console.error('Error loading notes:', error);
         }
@@ -353,6 +354,11 @@ const Notes = ({ user }) => {
                                 </CardContent>
                             </Card>
                         ))}
+                        {noteList.hasMore && (
+                            <Button variant="outline" className="w-full" disabled={noteList.loading} onClick={noteList.loadMore}>
+                                {noteList.loading ? 'Loading...' : 'Load more'}
+                            </Button>
+                        )}
                     </div>
                 )}
             </div>
@@ -11,10 +11,12 @@ import { Badge } from './ui/badge';
 import { Plus, Bell, Clock, Users, Check, Edit, Trash2 } from 'lucide-react';
 import { remindersAPI, friendsAPI } from '../services/api';
 import { useToast } from '../hooks/use-toast';
+import { usePagedList } from '../hooks/use-paged-list';
 import BottomNavigation from './BottomNavigation';
 
 const Reminders = ({ user }) => {
-    const [reminders, setReminders] = useState([]);
+    const reminderList = usePagedList(remindersAPI.getRemindersPage);
+    const reminders = reminderList.items;
     const [friends, setFriends] = useState([]);
     const [reminderDialogOpen, setReminderDialogOpen] = useState(false);
     const [editingReminder, setEditingReminder] = useState(null);
@@ -40,8 +42,7 @@ const Reminders = ({ user }) => {
 
     const loadReminders = async () => {
         try {
-            const data = await remindersAPI.getReminders();
-            setReminders(data);
+            await reminderList.reload();
         } catch (error) {
             console.error('Error loading reminders:', error);
         }
@@ -355,6 +356,11 @@ const Reminders = ({ user }) => {
                                 </CardContent>
                             </Card>
                         ))}
+                        {reminderList.hasMore && (
+                            <Button variant="outline" className="w-full" disabled={reminderList.loading} onClick={reminderList.loadMore}>
+                                {reminderList.loading ? 'Loading...' : 'Load more'}
+                            </Button>
+                        )}
                     </div>
                 )}
             </div>
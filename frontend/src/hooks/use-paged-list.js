@@ -0,0 +1,43 @@
+import { useCallback, useRef, useState } from 'react';
+
+// One cursor-paginated list: the first page on reload(), the next one on
+// loadMore(). fetchPage(cursor, limit) resolves to { items, nextCursor }.
+export function usePagedList(fetchPage, limit = 50) {
+    const [items, setItems] = useState([]);
+    const [nextCursor, setNextCursor] = useState(null);
+    const [loading, setLoading] = useState(false);
+    // Bumped by reload() so a late loadMore() cannot append to a fresh list
+    const generation = useRef(0);
+
+    const reload = useCallback(async () => {
+        const current = ++generation.current;
+        setLoading(true);
+        try {
+            const page = await fetchPage(undefined, limit);
+            if (current !== generation.current) return;
+            setItems(page.items);
+            setNextCursor(page.nextCursor);
+        } finally {
+            if (current === generation.current) setLoading(false);
+        }
+    }, [fetchPage, limit]);
+
+    const loadMore = useCallback(async () => {
+        if (!nextCursor || loading) return;
+        const current = generation.current;
+        setLoading(true);
+        try {
+            const page = await fetchPage(nextCursor, limit);
+            if (current !== generation.current) return;
+            setItems(previous => [...previous, ...page.items]);
+            setNextCursor(page.nextCursor);
+        } catch (error) {
+            // Called from click handlers; the button stays for a retry
+            console.error('Error loading more items:', error);
+        } finally {
+            if (current === generation.current) setLoading(false);
+        }
+    }, [fetchPage, limit, nextCursor, loading]);
+
+    return { items, hasMore: Boolean(nextCursor), loading, reload, loadMore };
+}
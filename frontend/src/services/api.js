@@ -40,6 +40,23 @@ api.interceptors.response.use(
     }
 );
 
+// List endpoints are cursor-paginated and return { items, next_cursor }.
+// ref narrows study lists to a passage, e.g. "Romans 5-8"
+const fetchPage = async (path, { limit, cursor, ref } = {}) => {
+    const response = await api.get(path, { params: { limit, cursor, ref } });
+    return { items: response.data.items, nextCursor: response.data.next_cursor };
+};
+
+// Lazily walks a paginated list, yielding one page of items at a time.
+export async function* iteratePages(path, limit = 50) {
+    let cursor;
+    do {
+        const page = await fetchPage(path, { limit, cursor });
+        yield page.items;
+        cursor = page.nextCursor;
+    } while (cursor);
+}
+
 // Authentication API
 export const authAPI = {
     register: async (userData) => {
@@ -65,31 +82,66 @@ export const bibleAPI = {
         return response.data;
     },
 
-    getHighlights: async () => {
-        const response = await api.get('/highlights');
+    parseReference: async (q) => {
+        const response = await api.get('/bible/reference', { params: { q } });
+        return response.data;
+    },
+
+    getChapter: async (book, chapter) => {
+        const response = await api.get(`/bible/${encodeURIComponent(book)}/${chapter}`);
         return response.data;
     },
 
+    search: async (query, limit = 20, book) => {
+        const response = await api.get('/bible/search', { params: { q: query, limit, book } });
+        return response.data;
+    },
+
+    getVerses: async (book, chapter, verseStart, verseEnd = verseStart) => {
+        const response = await api.get(
+            `/bible/${encodeURIComponent(book)}/${chapter}/${verseStart}-${verseEnd}`
+        );
+        return response.data;
+    },
+
+    getRelated: async (book, chapter, verse, limit = 10) => {
+        const response = await api.get(
+            `/bible/${encodeURIComponent(book)}/${chapter}/${verse}/related`, { params: { limit } }
+        );
+        return response.data;
+    },
+
+    getHighlightsPage: (cursor, limit, ref) => fetchPage('/highlights', { cursor, limit, ref }),
+
     createHighlight: async (highlight) => {
         const response = await api.post('/highlights', highlight);
         return response.data;
     },
 
-    deleteHighlight: async (highlightId) => {
-        const response = await api.delete(`/highlights/${highlightId}`);
+    // Several highlights in one request; returns per-item ids or errors.
+    // A passage can also be sent as one item with verse and verse_end.
+    createHighlights: async (highlights) => {
+        const response = await api.post('/highlights/batch', { items: highlights });
         return response.data;
     },
 
-    getBookmarks: async () => {
-        const response = await api.get('/bookmarks');
+    deleteHighlight: async (highlightId) => {
+        const response = await api.delete(`/highlights/${highlightId}`);
         return response.data;
     },
 
+    getBookmarksPage: (cursor, limit, ref) => fetchPage('/bookmarks', { cursor, limit, ref }),
+
     createBookmark: async (bookmark) => {
         const response = await api.post('/bookmarks', bookmark);
         return response.data;
     },
 
+    createBookmarks: async (bookmarks) => {
+        const response = await api.post('/bookmarks/batch', { items: bookmarks });
+        return response.data;
+    },
+
     deleteBookmark: async (bookmarkId) => {
         const response = await api.delete(`/bookmarks/${bookmarkId}`);
         return response.data;
@@ -98,16 +150,18 @@ export const bibleAPI = {
 
 // Notes API
 export const notesAPI = {
-    getNotes: async () => {
-        const response = await api.get('/notes');
-        return response.data;
-    },
+    getNotesPage: (cursor, limit, ref) => fetchPage('/notes', { cursor, limit, ref }),
 
     createNote: async (note) => {
         const response = await api.post('/notes', note);
         return response.data;
     },
 
+    createNotes: async (notes) => {
+        const response = await api.post('/notes/batch', { items: notes });
+        return response.data;
+    },
+
     updateNote: async (noteId, note) => {
         const response = await api.put(`/notes/${noteId}`, note);
         return response.data;
@@ -119,6 +173,58 @@ export const notesAPI = {
     },
 };
 
+// Study search API (notes, highlights and bookmarks together)
+export const studyAPI = {
+    // The user's highlights, bookmarks and notes for one chapter. The browser
+    // revalidates with the ETag, so unchanged chapters come back as 304s.
+    getOverlay: async (book, chapter) => {
+        const response = await api.get(`/study/overlay/${encodeURIComponent(book)}/${chapter}`);
+        return response.data;
+    },
+
+    search: async (query, { types, book, chapterStart, chapterEnd, limit, offset } = {}) => {
+        const response = await api.get('/study/search', {
+            params: {
+                q: query,
+                types,
+                book,
+                chapter_start: chapterStart,
+                chapter_end: chapterEnd,
+                limit,
+                offset,
+            },
+        });
+        return response.data;
+    },
+};
+
+// Reading progress API: read verses per chapter, book and the whole Bible
+export const progressAPI = {
+    getSummary: async () => {
+        const response = await api.get('/progress');
+        return response.data;
+    },
+
+    getBook: async (book) => {
+        const response = await api.get(`/progress/${encodeURIComponent(book)}`);
+        return response.data;
+    },
+
+    markRead: async (book, chapter, verses) => {
+        const response = await api.post(
+            `/progress/${encodeURIComponent(book)}/${chapter}`, null, { params: { verses } }
+        );
+        return response.data;
+    },
+
+    markUnread: async (book, chapter, verses) => {
+        const response = await api.delete(
+            `/progress/${encodeURIComponent(book)}/${chapter}`, { params: { verses } }
+        );
+        return response.data;
+    },
+};
+
 // Friends API
 export const friendsAPI = {
     getFriends: async () => {
@@ -149,10 +255,7 @@ export const friendsAPI = {
 
 // Reminders API
 export const remindersAPI = {
-    getReminders: async () => {
-        const response = await api.get('/reminders');
-        return response.data;
-    },
+    getRemindersPage: (cursor, limit) => fetchPage('/reminders', { cursor, limit }),
 
     createReminder: async (reminder) => {
         const response = await api.post('/reminders', reminder);
@@ -175,10 +278,54 @@ export const remindersAPI = {
     },
 };
 
+// Offline sync API. `versions` is the vector returned by the previous sync
+// (start with {}); `changes` maps a collection to offline edits of the form
+// { id, updated_at, deleted, data }. Pages until the server has sent everything.
+// `live_ids` appears when deletions the client had not seen were purged: of the
+// documents it held before this sync, it keeps only the listed ones.
+export const syncAPI = {
+    sync: async (versions = {}, changes = {}) => {
+        const merged = { changes: {}, deleted: {}, results: {}, live_ids: {} };
+        let body = { versions, changes };
+        for (;;) {
+            const response = await api.post('/sync', body);
+            const page = response.data;
+            for (const name of Object.keys(page.changes)) {
+                merged.changes[name] = [...(merged.changes[name] || []), ...page.changes[name]];
+                merged.deleted[name] = [...(merged.deleted[name] || []), ...page.deleted[name]];
+            }
+            Object.assign(merged.results, page.results);
+            // The first page's list is the one taken at the client's cursor
+            merged.live_ids = { ...(page.live_ids || {}), ...merged.live_ids };
+            merged.versions = page.versions;
+            if (!page.has_more) return merged;
+            body = { versions: page.versions };
+        }
+    },
+};
+
+// Notifications API
+export const notificationsAPI = {
+    getNotificationsPage: (cursor, limit) => fetchPage('/notifications', { cursor, limit }),
+
+    markRead: async (notificationId) => {
+        const response = await api.post(`/notifications/${notificationId}/read`);
+        return response.data;
+    },
+};
+
 // Chat API
 export const chatAPI = {
-    getChats: async () => {
-        const response = await api.get('/chats');
+    getChatsPage: (cursor, limit) => fetchPage('/chats', { cursor, limit }),
+
+    // Every chat with its unread count and last message, most recent first
+    getChatSummaries: async () => {
+        const response = await api.get('/chats/summary');
+        return response.data;
+    },
+
+    markChatRead: async (chatId, messageId) => {
+        const response = await api.post(`/chats/${chatId}/read`, { message_id: messageId || null });
         return response.data;
     },
 
@@ -187,8 +334,15 @@ export const chatAPI = {
         return response.data;
     },
 
-    getChatMessages: async (chatId) => {
-        const response = await api.get(`/chats/${chatId}/messages`);
+    getChatMessagesPage: (chatId, cursor, limit) =>
+        fetchPage(`/chats/${chatId}/messages`, { cursor, limit }),
+
+    // Messages after messageId (or the latest ones when omitted), oldest first
+    getMessagesSince: async (chatId, messageId, limit) => {
+        const params = {};
+        if (messageId) params.message_id = messageId;
+        if (limit) params.limit = limit;
+        const response = await api.get(`/chats/${chatId}/messages/since`, { params });
         return response.data;
     },
 
@@ -196,6 +350,73 @@ export const chatAPI = {
         const response = await api.post(`/chats/${chatId}/messages`, { content: message });
         return response.data;
     },
+
+    // Opens the real-time channel for a chat. Pass the id of the last message
+    // already shown to have anything missed while disconnected replayed first.
+    connect: (chatId, { lastMessageId, onMessage, onClose } = {}) => {
+        const wsBase = API_BASE.replace(/^http/, 'ws');
+        const params = new URLSearchParams({ token: localStorage.getItem('access_token') || '' });
+        if (lastMessageId) params.set('last_message_id', lastMessageId);
+
+        const socket = new WebSocket(`${wsBase}/chats/${chatId}/ws?${params}`);
+        socket.onmessage = (event) => onMessage && onMessage(JSON.parse(event.data));
+        socket.onclose = (event) => onClose && onClose(event);
+        return socket;
+    },
+};
+
+// Reads a server-sent event stream from the chatbot and calls onToken for
+// each token as it arrives. Resolves with the full response text.
+const streamChatbot = async (path, body, onToken, signal) => {
+    const token = localStorage.getItem('access_token');
+    const response = await fetch(`${API_BASE}${path}`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            ...(token ? { Authorization: `Bearer ${token}` } : {}),
+        },
+        body: JSON.stringify(body),
+        signal,
+    });
+    if (!response.ok || !response.body) {
+        throw new Error(`Chatbot request failed with status ${response.status}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let text = '';
+
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary = buffer.indexOf('\n\n');
+        while (boundary !== -1) {
+            const rawEvent = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            boundary = buffer.indexOf('\n\n');
+
+            let event = 'message';
+            let data = '';
+            rawEvent.split('\n').forEach((line) => {
+                if (line.startsWith('event: ')) event = line.slice(7);
+                if (line.startsWith('data: ')) data += line.slice(6);
+            });
+            if (!data) continue;
+
+            const payload = JSON.parse(data);
+            if (event === 'error') {
+                text = payload.response;
+                onToken(payload.response, text);
+            } else if (payload.token) {
+                text += payload.token;
+                onToken(payload.token, text);
+            }
+        }
+    }
+    return text;
 };
 
 // ChatBot API
@@ -205,15 +426,33 @@ export const chatbotAPI = {
         return response.data;
     },
 
+    askQuestionStream: (message, onToken, context = '', signal) =>
+        streamChatbot('/chatbot/ask/stream', { message, context }, onToken, signal),
+
     explainVerse: async (book, chapter, verse, text) => {
         const response = await api.post('/chatbot/explain-verse', {
+            message: `Please explain ${book} ${chapter}:${verse}`,
+            context: `${book} ${chapter}:${verse} - ${text}`,
             book,
             chapter,
-            verse,
-            text
+            verse
         });
         return response.data;
     },
+
+    explainVerseStream: (book, chapter, verse, text, onToken, signal) =>
+        streamChatbot('/chatbot/explain-verse/stream', {
+            message: `Please explain ${book} ${chapter}:${verse}`,
+            context: `${book} ${chapter}:${verse} - ${text}`,
+            book,
+            chapter,
+            verse
+        }, onToken, signal),
+
+    getQuota: async () => {
+        const response = await api.get('/chatbot/quota');
+        return response.data;
+    },
 };
 
 export default api;
\ No newline at end of file